@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# times what the scheduler pays every time it parses scrape_vgsi.py: the
+# module is executed in a fresh interpreter, after airflow itself is
+# imported, and the modules it pulled in on top of airflow are listed. None
+# of HEAVY should be among them. e.g.
+#   python bench_dag_import.py --runs 10
+
+DAGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dags')
+DAG_FILE = os.path.join(DAGS, 'scrape_vgsi.py')
+
+HEAVY = ('pandas', 'pyarrow', 'bs4', 'lxml', 'requests', 'urllib3', 'google.cloud.storage', 'google.cloud.bigquery', 'vgsi.vgsi_objects')
+
+_PROBE_ = r'''
+import importlib.util, json, sys, time
+sys.path.insert(0, {dags!r})
+from airflow import DAG
+from airflow.decorators import task, task_group
+before = set(sys.modules)
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('scrape_vgsi', {path!r})
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+seconds = time.perf_counter() - start
+print(json.dumps({{'ms': seconds * 1000, 'modules': sorted(set(sys.modules) - before)}}))
+'''
+
+def probe(path=DAG_FILE):
+    out = subprocess.run(
+        [sys.executable, '-c', _PROBE_.format(dags=DAGS, path=path)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main(argv=None):
+
+    args = argparse.ArgumentParser(description='Times the parse of the scrape_vgsi dag file.')
+    args.add_argument('--runs', type=int, default=5, help='fresh interpreters to parse the file in')
+    args.add_argument('--path', default=DAG_FILE, help='dag file to parse')
+    args = args.parse_args(argv)
+
+    results = [probe(args.path) for _ in range(args.runs)]
+    modules = results[-1]['modules']
+    heavy = [name for name in HEAVY if name in modules]
+
+    sys.stdout.write(f"parse ms           {statistics.median(r['ms'] for r in results):8.1f} (median of {args.runs})\n")
+    sys.stdout.write(f"modules imported   {len(modules):8d}\n")
+    sys.stdout.write(f"heavy modules      {', '.join(heavy) or 'none'}\n")
+
+if __name__ == '__main__':
+    main()
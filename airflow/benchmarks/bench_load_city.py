@@ -0,0 +1,89 @@
+import argparse
+import os
+import resource
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dags'))
+
+from vgsi.vgsi_fetch import FetchOptions, make_session, parse_property
+from vgsi.vgsi_metrics import Metrics
+from vgsi.vgsi_retry import RetryOptions
+from vgsi.vgsi_utils import load_city
+from stub_server import PARCEL_MIX, StubServer, load_fixtures
+
+# scrapes a town served by the local stub server with load_city and reports
+# parcels/s, parse time per page, peak RSS and requests per valid parcel,
+# without touching the network. e.g.
+#   python bench_load_city.py --pids 1000 --latency 0.05 --concurrency 16
+#   python bench_load_city.py --error-rate 0.05 --workers 4 --parser lxml
+
+def parse_ms(parser, number=3):
+
+    # mean over the page mix the stub serves.
+    pages = load_fixtures()
+    seconds = 0
+    for name in PARCEL_MIX:
+        page = pages[name]
+        seconds += min(timeit.repeat(lambda: parse_property('http://127.0.0.1/benchct/', 1, page, parser), number=number, repeat=3)) / number
+    return seconds / len(PARCEL_MIX) * 1000
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on linux. Children are the parse processes, which
+    # have exited once load_city returns.
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_rss / 1024, children_rss / 1024
+
+def main(argv=None):
+
+    args = argparse.ArgumentParser(description='Benchmarks load_city against the local stub server.')
+    args.add_argument('--pids', type=int, default=500, help='pid range of the stub town')
+    args.add_argument('--density', type=float, default=0.9, help='share of pids with a parcel')
+    args.add_argument('--latency', type=float, default=0.02, help='seconds added to every response')
+    args.add_argument('--error-rate', type=float, default=0.0, help='share of responses that are 503s')
+    args.add_argument('--capacity', type=int, default=None, help='requests the stub takes in flight before it answers 503')
+    args.add_argument('--concurrency', type=int, default=8)
+    args.add_argument('--adaptive', action='store_true', help='let the concurrency adapt, up to --concurrency')
+    args.add_argument('--workers', type=int, default=0, help='parse processes, 0 parses on the fetch threads')
+    args.add_argument('--parser', default='html.parser')
+    args.add_argument('--backoff', type=float, default=0.1, help='retry backoff factor of the session')
+    args.add_argument('--retry-rounds', type=int, default=2, help='rounds draining the failed pids at the end')
+    args.add_argument('--retry-backoff', type=float, default=0.5, help='seconds before the first round, doubling')
+    args.add_argument('--metrics', action='store_true', help="also print load_city's metrics summary")
+    args = args.parse_args(argv)
+
+    with StubServer(pids=args.pids, density=args.density, latency=args.latency, error_rate=args.error_rate, capacity=args.capacity) as stub:
+        session = make_session(pool_size=args.concurrency, backoff_factor=args.backoff)
+        metrics = Metrics(city='bench')
+        start = time.perf_counter()
+        frames = load_city(
+            'bench',
+            base_url=stub.url,
+            pid_max=args.pids + 1000,
+            null_pages_seq=10,
+            fetch_options=FetchOptions(concurrency=args.concurrency, delay_seconds=0, adaptive=args.adaptive, session=session),
+            retry_options=RetryOptions(rounds=args.retry_rounds, backoff=args.retry_backoff),
+            parser=args.parser,
+            workers=args.workers or None,
+            metrics=metrics
+        )
+        seconds = time.perf_counter() - start
+        requests = stub.requests
+        expected = len(stub.valid_pids())
+        # before the stub process exits and counts as a child too.
+        self_rss, children_rss = peak_rss_mb()
+
+    parcels = len(frames[0])
+
+    sys.stdout.write(f"parcels            {parcels} of {expected}\n")
+    sys.stdout.write(f"parcels/s          {parcels / seconds:8.1f}\n")
+    sys.stdout.write(f"parse ms/page      {parse_ms(args.parser):8.1f}\n")
+    sys.stdout.write(f"peak rss MB        {self_rss:8.1f} (parse processes {children_rss:.1f})\n")
+    sys.stdout.write(f"requests/parcel    {requests / max(parcels, 1):8.2f}\n")
+    if args.metrics:
+        sys.stdout.write(metrics.to_json() + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dags'))
+
+from vgsi.vgsi_objects import Property
+from vgsi.vgsi_parsers import PARSERS
+
+# parses the same saved parcel page with every parser backend, checks they
+# produce identical records and reports the time per page.
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'long_history.html')
+
+class FixtureResponse:
+
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+class FixtureSession:
+
+    # stands in for requests.Session so Property parses the saved page
+    # without touching the network.
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, **kwargs):
+        return FixtureResponse(self.content)
+
+def strip(data):
+    return {k: v for k, v in data.items() if k != 'updated_at'}
+
+def load(session, parser):
+    p = Property(url='https://gis.vgsi.com/newhavenct/', pid=1, session=session, parser=parser)
+    p.load_all()
+    return p
+
+def records(p):
+    return [strip(p.data)] + [strip(r) for r in p.buildings + p.assesments + p.appraisals + p.ownership]
+
+def main(number=5):
+
+    with open(FIXTURE, 'rb') as f:
+        session = FixtureSession(f.read())
+
+    available = []
+    for parser in PARSERS:
+        try:
+            available.append((parser, records(load(session, parser))))
+        except ImportError as e:
+            sys.stdout.write(f"skipping {parser}: {str(e).strip()}\n")
+
+    reference_parser, reference = available[0]
+    for parser, result in available[1:]:
+        assert result == reference, f"{parser} records differ from {reference_parser}"
+
+    for parser, _ in available:
+        seconds = min(timeit.repeat(lambda: load(session, parser), number=number, repeat=3)) / number
+        sys.stdout.write(f"{parser:<12} {seconds * 1000:8.1f} ms/page\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import timeit
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dags'))
+
+from vgsi.vgsi_objects import ChildRows, row_uuid, table_rows
+
+# compares building every history row with its own table scan (the old
+# per-row Table path, kept here for the comparison) against one table_rows
+# pass per table with the ChildRows records Property builds, on a saved
+# parcel page with a long sales and valuation history.
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'long_history.html')
+TABLES = [
+    ('ownership', 'MainContent_grdSales'),
+    ('appraisal', 'MainContent_grdHistoryValuesAppr'),
+    ('assesment', 'MainContent_grdHistoryValuesAsmt'),
+]
+
+def strip(data):
+    return {k: v for k, v in data.items() if k != 'updated_at'}
+
+def table_row(soup, table_tag, row):
+
+    # what Table.load_table_dict did for every row: finds the table and
+    # reads its header again, then the row.
+    keys = []
+    values = []
+    for tag in soup.find('table', id=table_tag).find_all('tr'):
+        for th in tag.find_all('th'):
+            key = th.get_text(separator = ' ', strip = True)
+            keys.append(key.replace('&', 'and').lower().replace(' ', '_'))
+
+    for tag in soup.find('table', id=table_tag).find_all('tr')[row + 1].find_all('td'):
+        value = tag.get_text(separator = ' ')
+        values.append(value.replace('&', 'and').lower())
+
+    return dict(zip(keys, values))
+
+def per_row(soup):
+    records = []
+    for category, table_tag in TABLES:
+        count = len(soup.find('table', id=table_tag).find_all('tr')) - 1
+        for row in range(0, count):
+            record = {'uuid': None, 'pid': 1, 'city': None, 'updated_at': None}
+            record.update(table_row(soup, table_tag, row))
+            record['property_uuid'] = ''
+            record['uuid'] = row_uuid(category, None, 1, record)
+            records.append(record)
+    return records
+
+def child_rows(soup):
+    rows = ChildRows(1, None, '', None)
+    records = []
+    for category, table_tag in TABLES:
+        for row_data in table_rows(soup.find('table', id=table_tag)):
+            records.append(rows.record(category, row_data))
+    return records
+
+def main(number=5):
+
+    with open(FIXTURE, 'rb') as f:
+        soup = BeautifulSoup(f.read(), "html.parser")
+
+    old, new = per_row(soup), child_rows(soup)
+    assert [strip(r) for r in old] == [strip(r) for r in new], "child rows differ from per-row rows"
+
+    sys.stdout.write(f"{len(new)} history rows in {os.path.basename(FIXTURE)}\n")
+    for name, fn in [('per_row', per_row), ('child_rows', child_rows)]:
+        seconds = min(timeit.repeat(lambda: fn(soup), number=number, repeat=3)) / number
+        sys.stdout.write(f"{name:<12} {seconds * 1000:8.1f} ms/page\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote_plus, urlparse
+
+# a stand-in for gis.vgsi.com that serves the saved pages in fixtures/. Valid
+# pids get one of the parcel pages, every other pid is redirected to the
+# error page the way the real site does. Each request can be slowed down by
+# `latency` seconds and fail with a 503 at `error_rate`. The server runs in
+# a process of its own so it doesn't compete with the scraper for the GIL.
+# With a capacity, requests beyond that many in flight get a 503, like a
+# town instance that can't take more parallel load. Streets.aspx lists the
+# valid pids the way the town's street listing does: a page of letters,
+# a page of streets per letter and a page of parcels per street.
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+ERROR_PATH = 'Error.aspx?Message=There+was+an+error+loading+the+parcel.'
+
+# the pages a valid pid gets, by pid % 10.
+PARCEL_MIX = ['single_building'] * 6 + ['multi_building'] * 2 + ['empty_parcel', 'long_history']
+
+# parcels per street of the street listing, and the letters streets start with.
+STREET_PARCELS = 25
+STREET_LETTERS = 'ABCDEFGH'
+
+def load_fixtures():
+    pages = {}
+    for name in PARCEL_MIX + ['error']:
+        with open(os.path.join(FIXTURES, f"{name}.html"), 'rb') as f:
+            pages[name] = f.read()
+    # kept apart from the pages `python -m vgsi parse fixtures/*.html` reads.
+    with open(os.path.join(FIXTURES, 'listing', 'streets.html'), 'rb') as f:
+        pages['streets'] = f.read()
+    return pages
+
+def parcel_page(pid, pids, density=1.0):
+
+    # the fixture pid serves, or None for pids without a parcel. Parcels sit
+    # in 1..pids with a deterministic `density` of them valid.
+    if pid < 1 or pid > pids or (pid * 2654435761) % 1000 >= density * 1000:
+        return None
+    return PARCEL_MIX[pid % len(PARCEL_MIX)]
+
+def street_name(pid):
+    block = pid // STREET_PARCELS
+    return f"{STREET_LETTERS[block % len(STREET_LETTERS)]}{block} ST"
+
+def streets_page(template, query, pids, density=1.0):
+
+    # the street listing: the letters (on every page), the streets of
+    # ?Letter= or the parcels of ?Name=, linked like the real pages.
+    letters = ''.join(f'\t<a href="Streets.aspx?Letter={letter}&amp;Mode=List">{letter}</a>\n' for letter in STREET_LETTERS)
+    valid = [pid for pid in range(1, pids + 1) if parcel_page(pid, pids, density)]
+    if 'Name' in query:
+        links = [
+            f'\t\t<li><a href="Parcel.aspx?Pid={pid}">{pid} {query["Name"][0]}</a></li>\n'
+            for pid in valid if street_name(pid) == query['Name'][0]
+        ]
+    elif 'Letter' in query:
+        names = dict.fromkeys(street_name(pid) for pid in valid)
+        links = [
+            f"\t\t<li><a href='Streets.aspx?Name={quote_plus(name)}'>{name}</a></li>\n"
+            for name in names if name.startswith(query['Letter'][0])
+        ]
+    else:
+        links = []
+    return template.replace(b'<!--letters-->', letters.encode()).replace(b'<!--links-->', ''.join(links).encode())
+
+def _handler(pages, pids, density, latency, error_rate, requests, capacity=None):
+
+    rng = random.Random(0)
+    in_flight = [0]
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b'', headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with requests.get_lock():
+                requests.value += 1
+            with lock:
+                in_flight[0] += 1
+                overloaded = capacity is not None and in_flight[0] > capacity
+            try:
+                if latency:
+                    time.sleep(latency)
+                if overloaded or (error_rate and rng.random() < error_rate):
+                    return self._send(503)
+                return self._get()
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        def _get(self):
+
+            url = urlparse(self.path)
+            if url.path.endswith('/Error.aspx'):
+                return self._send(200, pages['error'])
+            if url.path.endswith('/Streets.aspx'):
+                return self._send(200, streets_page(pages['streets'], parse_qs(url.query), pids, density))
+            if not url.path.endswith('/Parcel.aspx'):
+                return self._send(404)
+
+            pid = int(parse_qs(url.query).get('pid', ['0'])[0])
+            name = parcel_page(pid, pids, density)
+            if name is None:
+                return self._send(302, headers={'Location': f"./{ERROR_PATH}"})
+            return self._send(200, pages[name])
+
+    return Handler
+
+def _serve(port, ready, pids, density, latency, error_rate, capacity, requests):
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(load_fixtures(), pids, density, latency, error_rate, requests, capacity))
+    server.daemon_threads = True
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+class StubServer:
+
+    # with StubServer(pids=500, latency=0.02) as stub:
+    #     load_city('bench', base_url=stub.url, ...)
+    #     stub.requests  -> requests served so far
+
+    def __init__(self, pids=500, density=1.0, latency=0.0, error_rate=0.0, capacity=None, port=0):
+        self.pids = pids
+        self.capacity = capacity
+        self.density = density
+        self.latency = latency
+        self.error_rate = error_rate
+        self.port = port
+        self._requests = multiprocessing.Value('l', 0)
+        self._process = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/benchct/"
+
+    @property
+    def requests(self):
+        return self._requests.value
+
+    def valid_pids(self):
+        return [pid for pid in range(1, self.pids + 1) if parcel_page(pid, self.pids, self.density)]
+
+    def start(self):
+        ready = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(self.port, ready, self.pids, self.density, self.latency, self.error_rate, self.capacity, self._requests),
+            daemon=True
+        )
+        self._process.start()
+        self.port = ready.get(timeout=30)
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+if __name__ == '__main__':
+    # serves until interrupted, e.g. python stub_server.py 8080
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    with StubServer(port=port) as stub:
+        sys.stdout.write(f"serving {stub.url}Parcel.aspx?pid=1\n")
+        try:
+            stub._process.join()
+        except KeyboardInterrupt:
+            pass
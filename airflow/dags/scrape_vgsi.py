@@ -1,17 +1,16 @@
 import os
+import sys
 import json
-import pandas as pd
 from datetime import datetime, timedelta
 
 from airflow import DAG
+from airflow.decorators import task, task_group
 # from airflow.operators.bash import BashOperator
-from airflow.operators.python import PythonOperator
 # from airflow.operators.trigger_dagrun import TriggerDagRunOperator
 
-from google.cloud import storage
-from airflow.providers.google.cloud.transfers.gcs_to_bigquery import GCSToBigQueryOperator
-
-from vgsi.vgsi_utils import load_city
+# the scheduler parses this file over and over, so it only needs airflow to
+# build the dag. The vgsi modules, and pandas, bs4, requests and the google
+# clients with them, are imported by the callables when a task runs.
 
 # set default arguments
 afw_default_args = {
@@ -29,35 +28,207 @@ BUCKET_NAME = os.environ.get("GCP_GCS_BUCKET")
 BQ_DATASET_NAME = os.environ.get("BQ_DATASET_NAME", 'stg_properties_dataset')
 PATH_TO_LOCAL_HOME = os.environ.get("AIRFLOW_HOME", "/opt/airflow/")
 
-PREFIX_DATASET_FILE = "{{ data_interval_end.strftime(\'%m%d_%H%M\') }}"
 DATA_CATEGORIES = ["property", "building", "assesment", "appraisal", "ownership"]
-
-RUN_DATE = datetime.today().strftime('%Y-%m-%d')
+BQ_TABLES = {
+    "property": "raw_properties",
+    "building": "raw_buildings",
+    "assesment": "raw_assesments",
+    "appraisal": "raw_appraisals",
+    "ownership": "raw_ownership"
+}
 # PARQUET_FILENAME = DATASET_FILE.replace('.json', '.parquet')
 
-def download_city(city, output_parquet_file):
-    property_df, building_df, assesment_df, appraisal_df, ownership_df = load_city(city, base_url='https://gis.vgsi.com/newhavenct/',pid_max=100, delay_seconds=0)
+# every town is served by gis.vgsi.com, so the statewide run shares one
+# budget of in-flight requests: at most VGSI_PARALLEL_SHARDS shards scrape at
+# once, each with its share of VGSI_TOTAL_CONCURRENCY.
+MAX_PARALLEL_SHARDS = int(os.environ.get("VGSI_PARALLEL_SHARDS", 8))
+TOTAL_CONCURRENCY = int(os.environ.get("VGSI_TOTAL_CONCURRENCY", 64))
+SCRAPE_CONCURRENCY = max(1, TOTAL_CONCURRENCY // MAX_PARALLEL_SHARDS)
+# let each town find its own concurrency, up to SCRAPE_CONCURRENCY, from the
+# latency and errors of its responses
+ADAPTIVE_CONCURRENCY = os.environ.get("VGSI_ADAPTIVE_CONCURRENCY", "true").lower() in ("1", "true", "yes")
+# cities with more known (or, from their profile, expected) parcels than
+# this are split into several shards
+SHARD_SIZE = int(os.environ.get("VGSI_SHARD_SIZE", 20000))
+# with VGSI_STATE_DIR, towns whose profile is older than this many days are
+# probed again before the run is planned, VGSI_PROBE_WORKERS at a time
+PROFILE_MAX_AGE_DAYS = int(os.environ.get("VGSI_PROFILE_MAX_AGE_DAYS", 28))
+PROBE_WORKERS = int(os.environ.get("VGSI_PROBE_WORKERS", 8))
+# html.parser, lxml or selectolax (needs the optional selectolax package)
+SCRAPE_PARSER = os.environ.get("VGSI_PARSER", "lxml")
+# processes parsing the fetched pages of a shard, 0 parses on the fetching
+# threads
+PARSE_WORKERS = int(os.environ.get("VGSI_PARSE_WORKERS", 0))
+# local path or gs://bucket/prefix to keep the raw pages in, for re-parsing
+# without scraping again (load_city(..., replay=True))
+RAW_ARCHIVE = os.environ.get("VGSI_ARCHIVE")
+# directory for scrape state kept between runs. When set, the weekly run only
+# fetches the pids found by earlier runs plus a frontier past the largest, and
+# keeps the pids that failed for the next run. The state is committed by each
+# shard's commit_state task, once its output is loaded.
+STATE_DIR = os.environ.get("VGSI_STATE_DIR")
+# with VGSI_STATE_DIR, only parse and write the parcels whose page changed
+# since the last loaded run. The others are listed, with the snapshot date
+# whose files still hold their rows, in the run's carried forward manifest,
+# which is loaded to raw_carried_forward next to the records.
+INCREMENTAL = bool(STATE_DIR) and os.environ.get("VGSI_INCREMENTAL", "false").lower() in ("1", "true", "yes")
+CARRIED_FORWARD = "carried_forward"
+CARRIED_FORWARD_TABLE = "raw_carried_forward"
+# pids that failed with anything but the error page are tried again at the
+# end of their shard, in VGSI_RETRY_ROUNDS rounds VGSI_RETRY_BACKOFF seconds
+# apart (doubling). With VGSI_STATE_DIR the queue is kept for the next run.
+RETRY_ROUNDS = int(os.environ.get("VGSI_RETRY_ROUNDS", 2))
+RETRY_BACKOFF = float(os.environ.get("VGSI_RETRY_BACKOFF", 30))
+# a shard whose town fails this many pids in a row stops and fails its task,
+# which airflow retries later, instead of walking on to the end of its range
+MAX_FAILURES = int(os.environ.get("VGSI_MAX_FAILURES", 50))
+# host:port of a statsd daemon to send each shard's scrape metrics to
+STATSD_ADDRESS = os.environ.get("VGSI_STATSD")
+# write the parquet files straight to the bucket instead of the worker's disk
+DIRECT_UPLOAD = os.environ.get("VGSI_DIRECT_UPLOAD", "false").lower() in ("1", "true", "yes")
+# append: every run adds its records to the day's partition, keeping each
+# weekly snapshot. merge: records are upserted on (city, pid, row), so the
+# tables hold the latest state of every parcel.
+BQ_LOAD_MODE = os.environ.get("VGSI_BQ_LOAD_MODE", "append")
+# record level change sets against the last run, kept in VGSI_STATE_DIR and
+# appended to <table>_changes with a `change` column (insert, update or
+# delete). off, with (next to the snapshot) or only (instead of it).
+CHANGE_SETS = os.environ.get("VGSI_CHANGES", "off") if STATE_DIR else "off"
+OUTPUT_KINDS = {"off": ["parquet"], "with": ["parquet", "changes"], "only": ["changes"]}[CHANGE_SETS]
+# rewrite each partition of the run's files in the bucket as one file once
+# every shard is done
+COMPACT_LAKE = os.environ.get("VGSI_COMPACT", "true").lower() in ("1", "true", "yes")
+LAKE_KINDS = OUTPUT_KINDS + (["carried"] if INCREMENTAL else [])
+
+def output_prefix(data_interval_end):
+    return f"{PATH_TO_LOCAL_HOME}/{data_interval_end:%m%d_%H%M}"
+
+def run_date(data_interval_end):
+    # the day of the run, the same for every task and retry of it.
+    return f"{data_interval_end:%Y-%m-%d}"
+
+def lake_root(kind='parquet'):
+    # the objects of each kind form a vgsi_lake, partitioned by category,
+    # city and snapshot date.
+    return f"raw/{kind}"
+
+def lake_prefix(bucket_name, category, kind='parquet'):
+    # what BigQuery reads the city and snapshot_date partitions under.
+    return f"gs://{bucket_name}/{lake_root(kind)}/category={category}"
 
-    property_df.to_parquet(output_parquet_file + f"_{city}_property.parquet", index=False)
-    building_df.to_parquet(output_parquet_file + f"_{city}_building.parquet", index=False)
-    assesment_df.to_parquet(output_parquet_file + f"_{city}_assesment.parquet", index=False)
-    appraisal_df.to_parquet(output_parquet_file + f"_{city}_appraisal.parquet", index=False)
-    ownership_df.to_parquet(output_parquet_file + f"_{city}_ownership.parquet", index=False)
+def object_name(category, run_date, name, city, kind='parquet'):
+    from vgsi.vgsi_lake import lake_paths
+    return lake_paths(lake_root(kind), city, run_date, name, [category])[category]
 
-def upload_to_gcs(bucket_name, city, output_parquet_file, data_categories, run_date):
-    
-    # create a client for gcs
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
+def local_prefix(output_parquet_file, name, kind='parquet'):
+    return output_parquet_file + f"_{name}" + ("" if kind == 'parquet' else f"_{kind}")
 
-    for category in data_categories:
+def pending_prefix(state_dir, run_date, name):
+    # where a shard's staged state waits for its commit_state task.
+    return os.path.join(state_dir, "pending", f"{run_date}_{name}")
+
+def download_city(city, base_url, output_parquet_file, pid_min=1, pid_max=1000000, null_pages_seq=10, shard=0, concurrency=1, parser='html.parser', archive=None, state_dir=None, bucket_name=None, run_date=None, workers=None, adaptive=False, kinds=('parquet',), incremental=False):
+    from vgsi.vgsi_utils import ScanState, load_city
+    from vgsi.vgsi_fetch import FetchOptions
+    from vgsi.vgsi_writer import ParquetSink
+    from vgsi.vgsi_metrics import Metrics, StatsdSink
+    from vgsi.vgsi_cdc import ChangeSink
+    from vgsi.vgsi_incremental import write_carried_forward
+    from vgsi.vgsi_lake import LAKE_PARTITIONS
+    from vgsi.vgsi_retry import RetryOptions
+
+    name = f"{city}_{shard:03d}"
+    checkpoint = output_parquet_file + f"_{name}_checkpoint.json"
+    if state_dir:
+        state = ScanState.open(state_dir, checkpoint, incremental=incremental, changes='changes' in kinds)
+    else:
+        state = ScanState(checkpoint=checkpoint)
+    metrics = Metrics(city=city, shard=shard)
+
+    # streamed to {output_parquet_file}_{city}_{shard}_{category}.parquet in
+    # bounded batches, so memory stays flat however large the city is. The
+    # file prefix is the same for every try of a run, so a retry finds the
+    # checkpoint and resumes where the failed try stopped. The files leave
+    # out the lake's partition columns, their objects' path holds them.
+    def output_path(category, kind):
+        if bucket_name:
+            return f"gs://{bucket_name}/{object_name(category, run_date, name, city, kind)}"
+        return f"{local_prefix(output_parquet_file, name, kind)}_{category}.parquet"
+
+    def parquet_sink(kind):
+        if bucket_name:
+            # parts and files go straight to the bucket, the files under the
+            # names upload_to_gcs would have given them.
+            return ParquetSink(
+                f"gs://{bucket_name}/tmp/{run_date}_{name}_{kind}",
+                paths={category: f"gs://{bucket_name}/{object_name(category, run_date, name, city, kind)}" for category in DATA_CATEGORIES},
+                drop=LAKE_PARTITIONS
+            )
+        return ParquetSink(local_prefix(output_parquet_file, name, kind), drop=LAKE_PARTITIONS)
+
+    # kinds holds 'parquet' for the snapshot and 'changes' for the change
+    # sets against the last committed run.
+    sink = parquet_sink('parquet') if 'parquet' in kinds else None
+    if 'changes' in kinds:
+        sink = ChangeSink(state.changes, city, parquet_sink('changes'), snapshot=sink, fetch_date=run_date)
+    load_city(
+        city,
+        base_url=base_url,
+        pid_min=pid_min,
+        pid_max=pid_max,
+        null_pages_seq=null_pages_seq,
+        fetch_options=FetchOptions(concurrency=concurrency, delay_seconds=0, adaptive=adaptive),
+        retry_options=RetryOptions(rounds=RETRY_ROUNDS, backoff=RETRY_BACKOFF, max_failures_seq=MAX_FAILURES),
+        state=state,
+        parser=parser,
+        archive=archive,
+        fetch_date=run_date,
+        workers=workers,
+        sink=sink,
+        metrics=metrics
+    )
 
-        path = f"{output_parquet_file}_{city}_{category}.parquet"
+    # the parcels the incremental scan found unchanged, whose rows are in
+    # the files of an earlier snapshot date.
+    if state.fingerprints is not None:
+        carried = state.fingerprints.carried_forward(city, run_date, pid_min, pid_max)
+        write_carried_forward(output_path(CARRIED_FORWARD, 'carried'), carried)
+        metrics.gauge(CARRIED_FORWARD, len(carried))
 
-        # upload data
-        object_name = f"raw/parquet/{category}/{run_date}_{city}.parquet"
-        blob = bucket.blob(object_name)
-        blob.upload_from_filename(path, timeout=300)
+    # committed by commit_state once the output is loaded, otherwise a failed
+    # load would hide the changed parcels from the next run.
+    if state_dir:
+        state.stage(pending_prefix(state_dir, run_date, name))
+
+    summary = metrics.summary()
+    sys.stdout.write(f"Scrape metrics of {name}:\n{json.dumps(summary, indent=2)}\n")
+    if STATSD_ADDRESS:
+        StatsdSink.from_address(STATSD_ADDRESS).send(summary)
+
+    return {'name': name, 'city': city, 'metrics': summary}
+
+def upload_to_gcs(bucket_name, name, city, output_parquet_file, data_categories, run_date, direct=False, kinds=('parquet',), carried=False):
+    from vgsi.vgsi_gcs import upload_files
+
+    # keyed <category> for the snapshot files, <category>_changes for the
+    # change sets.
+    files = {}
+    keys = {}
+    for kind in kinds:
+        for category in data_categories:
+            key = category if kind == 'parquet' else f"{category}_{kind}"
+            keys[key] = object_name(category, run_date, name, city, kind)
+            files[keys[key]] = f"{local_prefix(output_parquet_file, name, kind)}_{category}.parquet"
+    if carried:
+        keys[CARRIED_FORWARD] = object_name(CARRIED_FORWARD, run_date, name, city, 'carried')
+        files[keys[CARRIED_FORWARD]] = f"{local_prefix(output_parquet_file, name, 'carried')}_{CARRIED_FORWARD}.parquet"
+
+    # the files go up in parallel, objects that already hold the same file
+    # (e.g. from a retried run) are skipped.
+    if not direct:
+        upload_files(bucket_name, files, workers=len(files))
+
+    return {'name': name} | {key: [obj] for key, obj in keys.items()}
 
 afw_default_args = {
     "owner": "airflow",
@@ -76,82 +247,181 @@ with DAG(
     tags=['ct-properties']
 ) as dag:
 
-    download_data_task = PythonOperator(
-        task_id = "download_data",
-        python_callable = download_city,
-        op_kwargs={
-            "city": "new_haven",
-            "output_parquet_file": f"{PATH_TO_LOCAL_HOME}/{PREFIX_DATASET_FILE}"
-        }
-        
-    )
+    def profiles_path():
+        return os.path.join(STATE_DIR, "city_profiles.json") if STATE_DIR else None
 
-     # upload the raw data to gcs
-    local_to_gcs_task = PythonOperator(
-        task_id="upload_data_gcs",
-        python_callable=upload_to_gcs,
-        op_kwargs={
-            "bucket_name": BUCKET_NAME,
-            "output_parquet_file": f"{PATH_TO_LOCAL_HOME}/{PREFIX_DATASET_FILE}",
-            "city": "new_haven",
-            "data_categories": DATA_CATEGORIES,
-            "run_date": RUN_DATE
-        }
-    )
+    @task
+    def profile_cities():
 
-    load_property_bq = GCSToBigQueryOperator(
-        task_id="load_property_bq",
-        bucket=BUCKET_NAME,
-        source_objects = [f"raw/parquet/property/{RUN_DATE}_new_haven.parquet"],
-        source_format='PARQUET',
-        destination_project_dataset_table=f'{PROJECT_ID}.{BQ_DATASET_NAME}.raw_properties',
-        autodetect=True,
-        write_disposition='WRITE_TRUNCATE',
-        create_disposition='CREATE_IF_NEEDED',
-    )
+        # probes the towns with a missing or stale profile, concurrently. A
+        # few hundred requests per town, once every PROFILE_MAX_AGE_DAYS.
+        if not STATE_DIR:
+            return []
+        from vgsi.vgsi_catalog import open_catalog, refresh_profiles, stale_cities
+        from vgsi.vgsi_index import PIDIndex
 
-    load_building_bq = GCSToBigQueryOperator(
-        task_id="load_building_bq",
-        bucket=BUCKET_NAME,
-        source_objects = [f"raw/parquet/building/{RUN_DATE}_new_haven.parquet"],
-        source_format='PARQUET',
-        destination_project_dataset_table=f'{PROJECT_ID}.{BQ_DATASET_NAME}.raw_buildings',
-        autodetect=True,
-        write_disposition='WRITE_TRUNCATE',
-        create_disposition='CREATE_IF_NEEDED',
-    )
+        cities = open_catalog(profiles_path=profiles_path())
+        stale = stale_cities(cities, PROFILE_MAX_AGE_DAYS)
+        pid_index = PIDIndex(os.path.join(STATE_DIR, "pid_index.sqlite"))
+        refresh_profiles(cities, profiles_path(), only=stale, workers=PROBE_WORKERS, pid_index=pid_index)
+        return stale
 
-    load_assesments_bq = GCSToBigQueryOperator(
-        task_id="load_assesments_bq",
-        bucket=BUCKET_NAME,
-        source_objects = [f"raw/parquet/assesments/{RUN_DATE}_new_haven.parquet"],
-        source_format='PARQUET',
-        destination_project_dataset_table=f'{PROJECT_ID}.{BQ_DATASET_NAME}.raw_assesments',
-        autodetect=True,
-        write_disposition='WRITE_TRUNCATE',
-        create_disposition='CREATE_IF_NEEDED',
-    )
+    @task
+    def plan_scrape():
 
-    load_appraisals_bq = GCSToBigQueryOperator(
-        task_id="load_appraisals_bq",
-        bucket=BUCKET_NAME,
-        source_objects = [f"raw/parquet/appraisals/{RUN_DATE}_new_haven.parquet"],
-        source_format='PARQUET',
-        destination_project_dataset_table=f'{PROJECT_ID}.{BQ_DATASET_NAME}.raw_appraisals',
-        autodetect=True,
-        write_disposition='WRITE_TRUNCATE',
-        create_disposition='CREATE_IF_NEEDED',
-    )
+        # planned when the run starts, from the city catalog and whatever
+        # pids earlier runs found, not when the scheduler parses this file.
+        from vgsi.vgsi_catalog import open_catalog
+        from vgsi.vgsi_index import PIDIndex
+        from vgsi.vgsi_plan import plan_shards
 
-    load_ownership_bq = GCSToBigQueryOperator(
-        task_id="load_ownership_bq",
-        bucket=BUCKET_NAME,
-        source_objects = [f"raw/parquet/ownership/{RUN_DATE}_new_haven.parquet"],
-        source_format='PARQUET',
-        destination_project_dataset_table=f'{PROJECT_ID}.{BQ_DATASET_NAME}.raw_ownership',
-        autodetect=True,
-        write_disposition='WRITE_TRUNCATE',
-        create_disposition='CREATE_IF_NEEDED',
-    )
+        cities = open_catalog(profiles_path=profiles_path())
+        pid_index = PIDIndex(os.path.join(STATE_DIR, "pid_index.sqlite")) if STATE_DIR else None
+
+        return plan_shards(cities, pid_index=pid_index, shard_size=SHARD_SIZE, concurrency=SCRAPE_CONCURRENCY)
+
+    @task_group(group_id="scrape_shard")
+    def scrape_shard(shard):
+
+        # mapped once per shard. Tasks in the group only wait on their own
+        # shard, so each city goes on to GCS and BigQuery as soon as its
+        # scrape is done, whatever the other cities are doing.
+
+        # returns the shard's name, its city and its scrape metrics, which
+        # stay in xcom as the run's per city report.
+        @task(max_active_tis_per_dagrun=MAX_PARALLEL_SHARDS, multiple_outputs=True)
+        def download_data(shard, data_interval_end=None):
+            return download_city(
+                output_parquet_file=output_prefix(data_interval_end),
+                parser=SCRAPE_PARSER,
+                workers=PARSE_WORKERS,
+                adaptive=ADAPTIVE_CONCURRENCY,
+                archive=RAW_ARCHIVE,
+                state_dir=STATE_DIR,
+                bucket_name=BUCKET_NAME if DIRECT_UPLOAD else None,
+                run_date=run_date(data_interval_end),
+                kinds=OUTPUT_KINDS,
+                incremental=INCREMENTAL,
+                **shard
+            )
+
+        # upload the raw data to gcs, only names the objects when
+        # download_data wrote them there itself
+        @task(multiple_outputs=True)
+        def upload_data_gcs(name, city, data_interval_end=None):
+            return upload_to_gcs(
+                bucket_name=BUCKET_NAME,
+                name=name,
+                city=city,
+                output_parquet_file=output_prefix(data_interval_end),
+                data_categories=DATA_CATEGORIES,
+                run_date=run_date(data_interval_end),
+                direct=DIRECT_UPLOAD,
+                kinds=OUTPUT_KINDS,
+                carried=INCREMENTAL
+            )
+
+        downloaded = download_data(shard)
+        uploaded = upload_data_gcs(downloaded['name'], downloaded['city'])
+
+        if BQ_LOAD_MODE == 'merge':
+
+            # concurrent MERGEs into one table conflict in BigQuery, so the
+            # shards merge into each category's table one at a time.
+            @task(max_active_tis_per_dag=1)
+            def load_bq(category, objects, name):
+                from vgsi.vgsi_bigquery import merge_load
+
+                merge_load(
+                    target=f'{PROJECT_ID}.{BQ_DATASET_NAME}.{BQ_TABLES[category]}',
+                    category=category,
+                    uris=[f"gs://{BUCKET_NAME}/{obj}" for obj in objects],
+                    staging_suffix=name,
+                    hive_prefix=lake_prefix(BUCKET_NAME, category)
+                )
+        else:
+
+            # shards and cities share the tables, so every load appends.
+            @task
+            def load_bq(category, objects, name):
+                from vgsi.vgsi_bigquery import append_load
+
+                append_load(
+                    target=f'{PROJECT_ID}.{BQ_DATASET_NAME}.{BQ_TABLES[category]}',
+                    uris=[f"gs://{BUCKET_NAME}/{obj}" for obj in objects],
+                    hive_prefix=lake_prefix(BUCKET_NAME, category)
+                )
+
+        # same task ids as when append loads were GCSToBigQueryOperators.
+        task_prefix = 'merge' if BQ_LOAD_MODE == 'merge' else 'load'
+        loads = []
+        if 'parquet' in OUTPUT_KINDS:
+            for category in DATA_CATEGORIES:
+                loads.append(load_bq.override(task_id=f"{task_prefix}_{category}_bq")(category, uploaded[category], uploaded['name']))
+
+        # change sets are a log, they are always appended.
+        @task
+        def load_changes_bq(category, objects):
+            from vgsi.vgsi_bigquery import append_load
+
+            append_load(
+                target=f'{PROJECT_ID}.{BQ_DATASET_NAME}.{BQ_TABLES[category]}_changes',
+                uris=[f"gs://{BUCKET_NAME}/{obj}" for obj in objects],
+                hive_prefix=lake_prefix(BUCKET_NAME, category, 'changes')
+            )
+
+        if 'changes' in OUTPUT_KINDS:
+            for category in DATA_CATEGORIES:
+                loads.append(load_changes_bq.override(task_id=f"load_{category}_changes_bq")(category, uploaded[f"{category}_changes"]))
+
+        # the manifest of the parcels an incremental run carried forward,
+        # appended like the change sets.
+        @task
+        def load_carried_bq(objects):
+            from vgsi.vgsi_bigquery import append_load
+
+            append_load(
+                target=f'{PROJECT_ID}.{BQ_DATASET_NAME}.{CARRIED_FORWARD_TABLE}',
+                uris=[f"gs://{BUCKET_NAME}/{obj}" for obj in objects],
+                hive_prefix=lake_prefix(BUCKET_NAME, CARRIED_FORWARD, 'carried')
+            )
+
+        if INCREMENTAL:
+            loads.append(load_carried_bq(uploaded[CARRIED_FORWARD]))
+
+        # the fingerprints, pid index, retry queue and change store only
+        # take in what the shard saw once all of its output is loaded. A
+        # shard whose load failed is scanned against the old state again.
+        @task
+        def commit_state(name, data_interval_end=None):
+            from vgsi.vgsi_utils import ScanState
+
+            state = ScanState.open(STATE_DIR, incremental=INCREMENTAL, changes='changes' in OUTPUT_KINDS)
+            committed = state.commit_staged(pending_prefix(STATE_DIR, run_date(data_interval_end), name))
+            sys.stdout.write(f"Committed the {', '.join(committed) or 'no'} state of {name}\n")
+
+        if STATE_DIR:
+            loads >> commit_state(downloaded['name'])
+
+    # the shards of a town each leave a file in its partitions, which are
+    # rewritten as one sorted file once the whole run is loaded. Only after
+    # every shard loaded: the files of a failed shard are still what its
+    # retried load reads. Only the run's partitions of the planned cities
+    # are listed.
+    @task
+    def compact_lake(shards, data_interval_end=None):
+        from vgsi.vgsi_lake import compact_lake
+
+        cities = sorted({shard['city'] for shard in shards})
+        compacted = {}
+        for kind in LAKE_KINDS:
+            categories = [CARRIED_FORWARD] if kind == 'carried' else DATA_CATEGORIES
+            compacted |= compact_lake(f"gs://{BUCKET_NAME}/{lake_root(kind)}", run_date(data_interval_end), cities, categories)
+        sys.stdout.write(f"Compacted {len(compacted)} partitions\n")
+        return compacted
 
-    download_data_task >> local_to_gcs_task >> [load_property_bq, load_building_bq, load_assesments_bq, load_appraisals_bq, load_ownership_bq]
\ No newline at end of file
+    shards = plan_scrape()
+    profile_cities() >> shards
+    scraped = scrape_shard.expand(shard=shards)
+    if COMPACT_LAKE:
+        scraped >> compact_lake(shards)
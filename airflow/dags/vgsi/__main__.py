@@ -0,0 +1,171 @@
+import argparse
+import os
+import sys
+from .vgsi_fetch import FetchOptions, make_session, parse_property
+from .vgsi_metrics import Metrics
+from .vgsi_objects import InvalidPIDException
+from .vgsi_profile import profiled
+from .vgsi_retry import RetryOptions
+from .vgsi_utils import ScanState, load_city
+from .vgsi_writer import CATEGORIES, DataFrameSink, ParquetSink
+
+# runs the scraper from the command line, in the directory holding vgsi:
+#
+#   python -m vgsi scrape newhaven --pid-min 10 --pid-max 100 --output out/newhaven
+#   python -m vgsi replay newhaven --archive /data/raw --output out/newhaven
+#   python -m vgsi --timings --tracemalloc parse ../benchmarks/fixtures/*.html
+#   python -m vgsi --profile sample --profile-out scan.collapsed scrape newhaven --pid-max 500
+#
+# Without --output the records stay in memory and only their counts are
+# printed. The profiling options go before the command and cover this
+# process only, so leave --workers at 0 when profiling the parse.
+
+def _sink(output):
+    return ParquetSink(output) if output else DataFrameSink()
+
+def _report(output, metrics=None):
+
+    # the file paths of a ParquetSink, the records per category of a
+    # DataFrameSink.
+    if isinstance(output, dict):
+        for category, path in output.items():
+            sys.stdout.write(f"{category:<10} {path}\n")
+    else:
+        for category, frame in zip(CATEGORIES, output):
+            sys.stdout.write(f"{category:<10} {len(frame):>8} records\n")
+    if metrics is not None:
+        sys.stdout.write(metrics.to_json() + "\n")
+
+def scrape(args):
+
+    # the state stores are the ones the dag keeps in VGSI_STATE_DIR, and
+    # are only committed once the output is written, the same way.
+    state = ScanState.open(args.state_dir, incremental=args.incremental) if args.state_dir else None
+
+    metrics = Metrics(city=args.city)
+    output = load_city(
+        args.city,
+        base_url=args.url,
+        pid_min=args.pid_min,
+        pid_max=args.pid_max,
+        null_pages_seq=args.null_pages or None,
+        fetch_options=FetchOptions(
+            concurrency=args.concurrency,
+            rate_limit=args.rate,
+            delay_seconds=0,
+            adaptive=args.adaptive,
+            session=make_session(pool_size=args.concurrency)
+        ),
+        retry_options=RetryOptions(
+            rounds=args.retry_rounds,
+            backoff=args.retry_backoff,
+            max_failures_seq=args.max_failures or None
+        ),
+        state=state,
+        parser=args.parser,
+        archive=args.archive,
+        workers=args.workers or None,
+        sink=_sink(args.output),
+        metrics=metrics
+    )
+    if state is not None:
+        state.commit()
+    _report(output, metrics if args.metrics else None)
+
+def replay(args):
+
+    metrics = Metrics(city=args.city)
+    output = load_city(
+        args.city,
+        base_url=args.url or 'https://gis.vgsi.com/replay/',
+        pid_min=args.pid_min,
+        pid_max=args.pid_max,
+        parser=args.parser,
+        archive=args.archive,
+        fetch_date=args.fetch_date,
+        replay=True,
+        workers=args.workers or None,
+        sink=_sink(args.output),
+        metrics=metrics
+    )
+    _report(output, metrics if args.metrics else None)
+
+def parse(args):
+
+    # saved parcel pages, e.g. the benchmark fixtures, parsed `repeat` times
+    # each. Pages that turn out to be the error page are counted, not
+    # written.
+    sink = _sink(args.output)
+    invalid = 0
+    for n in range(args.repeat):
+        for pid, path in enumerate(args.pages, start=1):
+            with open(path, 'rb') as f:
+                content = f.read()
+            try:
+                p = parse_property(args.url, pid, content, args.parser, args.city)
+            except InvalidPIDException:
+                invalid += 1
+                continue
+            if n == 0:
+                sink.add(p)
+    if invalid:
+        sys.stdout.write(f"{invalid // args.repeat} of {len(args.pages)} pages are error pages\n")
+    _report(sink.close())
+
+def main(argv=None):
+
+    args = argparse.ArgumentParser(prog='python -m vgsi', description='Scrapes, replays or parses vgsi parcel pages.')
+    args.add_argument('--profile', choices=('cprofile', 'sample'), help='profile the command with cProfile or by sampling stacks')
+    args.add_argument('--profile-out', help='file for the cProfile stats or sampled stacks (vgsi.prof, vgsi.collapsed)')
+    args.add_argument('--interval', type=float, default=0.005, help='seconds between stack samples')
+    args.add_argument('--timings', action='store_true', help='time the record builders, coercers and page stages')
+    args.add_argument('--tracemalloc', action='store_true', help='also the peak allocations of every page stage (slow)')
+    commands = args.add_subparsers(dest='command', required=True)
+
+    def command(name, function, help):
+        parser = commands.add_parser(name, help=help)
+        parser.set_defaults(function=function)
+        parser.add_argument('--parser', default='lxml', help='html.parser, lxml or selectolax')
+        parser.add_argument('--output', help='write <output>_<category>.parquet (a local path or gs:// url)')
+        return parser
+
+    parser = command('scrape', scrape, 'scrape a city, or a pid range of it')
+    parser.add_argument('city')
+    parser.add_argument('--url', help='the town\'s vgsi url, looked up in the city catalog if not given')
+    parser.add_argument('--pid-min', type=int, default=1)
+    parser.add_argument('--pid-max', type=int, default=1000000)
+    parser.add_argument('--null-pages', type=int, default=10, help='error pages in a row that end the scan, 0 scans the whole range')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--adaptive', action='store_true', help='let the concurrency adapt, up to --concurrency')
+    parser.add_argument('--rate', type=float, help='requests per second at most')
+    parser.add_argument('--workers', type=int, default=0, help='parse processes, 0 parses on the fetch threads')
+    parser.add_argument('--archive', help='keep the raw pages under this local path or gs:// url')
+    parser.add_argument('--state-dir', help='scan state kept between runs, like the dag\'s VGSI_STATE_DIR')
+    parser.add_argument('--incremental', action='store_true', help='with --state-dir, only parse the parcels that changed since the last scan')
+    parser.add_argument('--retry-rounds', type=int, default=2)
+    parser.add_argument('--retry-backoff', type=float, default=10)
+    parser.add_argument('--max-failures', type=int, default=50, help='failed pids in a row that abort the scan, 0 never aborts')
+    parser.add_argument('--metrics', action='store_true', help="print the scan's metrics summary")
+
+    parser = command('replay', replay, 'rebuild a city from the pages in a raw archive')
+    parser.add_argument('city')
+    parser.add_argument('--archive', required=True, help='local path or gs:// url of the archive')
+    parser.add_argument('--fetch-date', help='the archived run to replay, the latest if not given')
+    parser.add_argument('--url', help='url the records are given')
+    parser.add_argument('--pid-min', type=int, default=1)
+    parser.add_argument('--pid-max', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=0, help='parse processes, 0 for one per core')
+    parser.add_argument('--metrics', action='store_true', help="print the replay's metrics summary")
+
+    parser = command('parse', parse, 'parse saved parcel pages')
+    parser.add_argument('pages', nargs='+')
+    parser.add_argument('--city', default='fixtures')
+    parser.add_argument('--url', default='https://gis.vgsi.com/fixtures/')
+    parser.add_argument('--repeat', type=int, default=1, help='parse every page this many times')
+
+    args = args.parse_args(argv)
+    with profiled(args.profile, args.profile_out, args.timings, args.tracemalloc, args.interval):
+        args.function(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import os
+import re
+from datetime import date
+from .vgsi_fetch import parse_property
+from .vgsi_store import atomic_write
+
+# the asp.net state fields (__VIEWSTATE, __EVENTVALIDATION, ...) change on
+# every request and are never parsed, so they are dropped before hashing.
+# Otherwise an unchanged parcel would get a new object every week.
+_HIDDEN_INPUT_ = re.compile(rb'<input\b[^>]*\btype\s*=\s*["\']?hidden\b[^>]*>', re.I)
+
+def strip_volatile(content):
+    return _HIDDEN_INPUT_.sub(b'', content)
+
+class _LocalStore:
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def read(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, data):
+
+        atomic_write(self._path(key), data)
+
+    def list(self, prefix):
+        path = self._path(prefix)
+        if not os.path.isdir(path):
+            return []
+        return os.listdir(path)
+
+class _GCSStore:
+
+    def __init__(self, bucket_name, prefix):
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip('/')
+        self._bucket = None
+
+    def __getstate__(self):
+        # storage clients don't pickle, every process makes its own.
+        return {'bucket_name': self.bucket_name, 'prefix': self.prefix, '_bucket': None}
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            from google.cloud import storage
+            self._bucket = storage.Client().bucket(self.bucket_name)
+        return self._bucket
+
+    def _name(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key):
+        return self.bucket.blob(self._name(key)).exists()
+
+    def read(self, key):
+        return self.bucket.blob(self._name(key)).download_as_bytes()
+
+    def write(self, key, data):
+        self.bucket.blob(self._name(key)).upload_from_string(data, timeout=300)
+
+    def list(self, prefix):
+
+        # objects and "directories" directly under prefix, like os.listdir.
+        name = self._name(prefix).rstrip('/') + '/'
+        blobs = self.bucket.client.list_blobs(self.bucket_name, prefix=name, delimiter='/')
+        names = [blob.name[len(name):] for blob in blobs]
+        return names + [sub[len(name):].rstrip('/') for sub in blobs.prefixes]
+
+class RawArchive:
+
+    # raw parcel pages, stored once per distinct content under
+    # objects/<sha256>.html.gz, with refs/<city>/<fetch date>/<pid> pointing
+    # at the object a pid returned on that day. root is a local directory or
+    # gs://bucket/prefix.
+
+    def __init__(self, root):
+        self.root = root
+        if root.startswith('gs://'):
+            bucket_name, _, prefix = root[len('gs://'):].partition('/')
+            self.store = _GCSStore(bucket_name, prefix)
+        else:
+            self.store = _LocalStore(root)
+
+    def _object_key(self, digest):
+        return f"objects/{digest[:2]}/{digest}.html.gz"
+
+    def put(self, city, pid, content, fetch_date=None):
+
+        fetch_date = fetch_date or date.today().isoformat()
+        content = strip_volatile(content)
+        digest = hashlib.sha256(content).hexdigest()
+
+        key = self._object_key(digest)
+        if not self.store.exists(key):
+            self.store.write(key, gzip.compress(content))
+        self.store.write(f"refs/{city}/{fetch_date}/{pid}", digest.encode())
+
+        return digest
+
+    def get(self, city, pid, fetch_date):
+        digest = self.store.read(f"refs/{city}/{fetch_date}/{pid}").decode()
+        return gzip.decompress(self.store.read(self._object_key(digest)))
+
+    def fetch_dates(self, city):
+        return sorted(self.store.list(f"refs/{city}"))
+
+    def pids(self, city, fetch_date):
+        return sorted(int(pid) for pid in self.store.list(f"refs/{city}/{fetch_date}") if pid.isdigit())
+
+def replay_property(archive, city, fetch_date, url, pid, parser='html.parser'):
+    return parse_property(url, pid, archive.get(city, pid, fetch_date), parser, city)
@@ -0,0 +1,121 @@
+from .vgsi_schema import FIELDS, ROW_KEYS, MONEY, FLOAT, INT, DATE, TIMESTAMP, STRING
+
+# the raw tables are partitioned by the day a record was scraped and
+# clustered on (city, pid), so a load only touches the day's partition and
+# lookups of a parcel only read its blocks.
+PARTITION_FIELD = 'updated_at'
+CLUSTER_FIELDS = ['city', 'pid']
+
+# merged tables tell rows of a parcel that share their row keys apart by
+# their occurrence among them, counted from 0 in uuid order, the way
+# vgsi_cdc.row_keys does.
+OCCURRENCE_FIELD = 'row_occurrence'
+
+_SQL_TYPES_ = {
+    MONEY: 'FLOAT64',
+    FLOAT: 'FLOAT64',
+    INT: 'INT64',
+    DATE: 'DATE',
+    TIMESTAMP: 'TIMESTAMP',
+    STRING: 'STRING'
+}
+
+def merge_query(target, staging, category, columns=None):
+
+    # upserts the staging table into target on the category's row keys and
+    # the row's occurrence among the parcel's rows sharing them, creating
+    # target the first time. columns are the staging table's columns,
+    # building details the schema doesn't know are added to target as
+    # strings. Rows merged before the occurrence was kept count as the
+    # first one.
+    kinds = dict(FIELDS[category])
+    columns = [name for name in columns or list(kinds) if name != OCCURRENCE_FIELD] + [OCCURRENCE_FIELD]
+    keys = ROW_KEYS[category]
+
+    definition = ', '.join(f"`{name}` {_SQL_TYPES_[kind]}" for name, kind in FIELDS[category])
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS `{target}` ({definition}, `{OCCURRENCE_FIELD}` INT64) "
+        f"PARTITION BY DATE(`{PARTITION_FIELD}`) CLUSTER BY {', '.join(CLUSTER_FIELDS)}",
+        f"ALTER TABLE `{target}` ADD COLUMN IF NOT EXISTS `{OCCURRENCE_FIELD}` INT64"
+    ]
+    statements += [
+        f"ALTER TABLE `{target}` ADD COLUMN IF NOT EXISTS `{name}` STRING"
+        for name in columns if name not in kinds and name != OCCURRENCE_FIELD
+    ]
+
+    # a parcel scraped twice in the batch would make the merge ambiguous,
+    # only the rows of its latest scrape are merged. Identical rows a
+    # parcel lists twice (the same sale) are both kept, as two occurrences.
+    source = (
+        f"SELECT * EXCEPT (_latest), "
+        f"ROW_NUMBER() OVER (PARTITION BY {', '.join(f'`{key}`' for key in keys)} ORDER BY `uuid`) - 1 AS `{OCCURRENCE_FIELD}` "
+        f"FROM (SELECT *, MAX(`{PARTITION_FIELD}`) OVER (PARTITION BY `city`, `pid`) AS _latest FROM `{staging}`) "
+        f"WHERE `{PARTITION_FIELD}` = _latest"
+    )
+    condition = ' AND '.join(
+        [f"T.`{key}` IS NOT DISTINCT FROM S.`{key}`" for key in keys]
+        + [f"COALESCE(T.`{OCCURRENCE_FIELD}`, 0) = S.`{OCCURRENCE_FIELD}`"]
+    )
+    updates = ', '.join(f"`{name}` = S.`{name}`" for name in columns)
+    names = ', '.join(f"`{name}`" for name in columns)
+    values = ', '.join(f"S.`{name}`" for name in columns)
+    statements.append(
+        f"MERGE `{target}` T USING ({source}) S ON {condition} "
+        f"WHEN MATCHED THEN UPDATE SET {updates} "
+        f"WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})"
+    )
+
+    return ';\n'.join(statements) + ';'
+
+def _hive_partitioning(bigquery, hive_prefix):
+
+    # the partition columns (city, snapshot_date) of vgsi_lake files, read
+    # from their path under hive_prefix.
+    options = bigquery.HivePartitioningOptions()
+    options.mode = 'STRINGS'
+    options.source_uri_prefix = hive_prefix.rstrip('/') + '/'
+    return options
+
+def append_load(target, uris, hive_prefix=None):
+
+    # appends the parquet files to the day's partition of target, creating
+    # it partitioned and clustered the first time. The column types come
+    # from the files, building details that differ between towns come as
+    # extra string columns. With hive_prefix the files are vgsi_lake files.
+    from google.cloud import bigquery
+
+    client = bigquery.Client()
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        time_partitioning=bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field=PARTITION_FIELD),
+        clustering_fields=CLUSTER_FIELDS,
+        schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED
+    )
+    if hive_prefix is not None:
+        job_config.hive_partitioning = _hive_partitioning(bigquery, hive_prefix)
+    client.load_table_from_uri(uris, target, job_config=job_config).result()
+
+def merge_load(target, category, uris, staging_suffix, hive_prefix=None):
+
+    # loads the parquet files into a staging table next to target, merges it
+    # in and drops it. Only the rows in the files are read and written, so
+    # the cost follows the number of changed parcels, not the table size.
+    from google.cloud import bigquery
+
+    client = bigquery.Client()
+    staging = f"{target}__staging_{staging_suffix}"
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+    )
+    if hive_prefix is not None:
+        job_config.hive_partitioning = _hive_partitioning(bigquery, hive_prefix)
+
+    try:
+        client.load_table_from_uri(uris, staging, job_config=job_config).result()
+        columns = [field.name for field in client.get_table(staging).schema]
+        client.query(merge_query(target, staging, category, columns)).result()
+    finally:
+        client.delete_table(staging, not_found_ok=True)
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from .vgsi_objects import __end_section__, __request_timeout__
+from .vgsi_fetch import fetch_page, make_session
+from .vgsi_index import discover_pids, probe_pid_max
+from .vgsi_parsers import form_action
+from .vgsi_store import atomic_write
+
+# the city catalog: vgsi_cities_<state>.json next to the dags, which lists
+# every town and its url, and a measured profile per town kept with the
+# scrape state. A profile is what a cheap probe of the town saw:
+#
+#   pid_min, pid_max  the lowest parcel found and the top of the pid range
+#   density           share of pids in the range that hold a parcel
+#   page_bytes        mean size of a parcel page
+#   latency_ms        median response time
+#   layout            signature of the ids a parcel page uses
+#   probed_at         when the probe ran
+#   last_scraped_at   last scan of the town that committed (from PIDIndex)
+#
+# The planner sizes and orders the shards of a run from it.
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PAGE_ID_ = re.compile(rb'\bid\s*=\s*["\']?((?:MainContent_|lblTownName)\w*)', re.I)
+_BLOCK_NUMBER_ = re.compile(rb'ctl\d+')
+
+def catalog_path(state='ct'):
+    return os.path.join(CATALOG_DIR, f"vgsi_cities_{state}.json")
+
+def open_catalog(state='ct', profiles_path=None):
+
+    # the state's towns, each with its profile when profiles_path holds one.
+    with open(catalog_path(state)) as city_json:
+        cities = json.load(city_json)
+
+    for city, profile in load_profiles(profiles_path).items():
+        if city in cities:
+            cities[city]['profile'] = profile
+    return cities
+
+def load_profiles(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_profiles(path, profiles):
+    atomic_write(path, json.dumps(profiles, indent=4, sort_keys=True).encode())
+
+def layout_signature(content):
+
+    # the ids of a parcel page, with the building block numbers taken out,
+    # hashed. Towns on the same page layout share it.
+    ids = sorted(set(_BLOCK_NUMBER_.sub(b'ctlNN', match) for match in _PAGE_ID_.findall(content)))
+    return hashlib.sha1(b'\n'.join(ids)).hexdigest()[:12]
+
+def probe_city(url, session=None, known=(), sample=20, window=10, misses=3, timeout=__request_timeout__, seed=0):
+
+    # probe_pid_max for the top of the range, then `sample` random pids
+    # between the lowest parcel and the top for the density. The known pids
+    # (of the PIDIndex or the street listing) are where the probe starts,
+    # and their density sizes its windows. A few hundred requests at most,
+    # against a full scan's one per pid.
+    session = session or make_session(pool_size=1)
+    latencies = []
+    sizes = []
+    valid = []
+    layout = None
+
+    def is_valid(pid):
+        nonlocal layout
+        start = time.perf_counter()
+        content = fetch_page(url, pid, session, timeout).content
+        latencies.append(time.perf_counter() - start)
+        action = form_action(content)
+        if action is None or action == __end_section__:
+            return False
+        sizes.append(len(content))
+        valid.append(pid)
+        if layout is None:
+            layout = layout_signature(content)
+        return True
+
+    known = sorted(known)
+    known_density = len(known) / (known[-1] - known[0] + 1) if known else None
+    pid_max = None
+    # from the largest known pid, or the lowest if that one is gone.
+    for start in dict.fromkeys([known[-1], known[0]] if known else [1]):
+        pid_max = probe_pid_max(is_valid, start=start, window=window, misses=misses, density=known_density)
+        if pid_max is not None:
+            break
+
+    pid_min = min(known[:1] + valid) if known or valid else None
+    density = 0.0
+    if pid_max is not None:
+        pids = random.Random(seed).sample(range(pid_min, pid_max + 1), min(sample, pid_max - pid_min + 1))
+        density = sum(is_valid(pid) for pid in pids) / len(pids)
+
+    return {
+        'pid_min': pid_min,
+        'pid_max': pid_max,
+        'density': round(density, 3),
+        'page_bytes': round(statistics.mean(sizes)) if sizes else None,
+        'latency_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        'layout': layout,
+        'probed_at': datetime.now().isoformat(timespec='seconds')
+    }
+
+def stale_cities(cities, max_age_days=28):
+    # towns without a profile, or with one probed more than max_age_days ago.
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec='seconds')
+    return [
+        city for city, info in cities.items()
+        if (info.get('profile') or {}).get('probed_at', '') < cutoff
+    ]
+
+def refresh_profiles(cities, profiles_path, only=None, workers=8, pid_index=None, **options):
+
+    # probes the towns (all of them, or `only`) concurrently, one session
+    # each, and saves their profiles. A town whose probe fails keeps the
+    # profile it had. The pid_index's pids of a town are what its probe
+    # starts from; a town it knows none of has its street listing walked
+    # instead (a request per street, once), and the pids found there seed
+    # the index, for the planner to shard the town's first scan by.
+    profiles = load_profiles(profiles_path)
+    names = list(only) if only is not None else list(cities)
+
+    def probe(city):
+        known = pid_index.pids(city) if pid_index is not None else []
+        listed = []
+        try:
+            if not known:
+                listed = discover_pids(cities[city]['url'])
+        except Exception as e:
+            sys.stdout.write(f"Could not list the streets of {city}: {e}\n")
+        try:
+            return city, probe_city(cities[city]['url'], known=known or listed, **options), listed
+        except Exception as e:
+            sys.stdout.write(f"Could not probe {city}: {e}\n")
+            return city, None, listed
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for city, profile, listed in executor.map(probe, names):
+            if profile is not None:
+                profiles[city] = profile
+            if listed and pid_index is not None:
+                pid_index.seed(city, listed)
+
+    if pid_index is not None:
+        for city, profile in profiles.items():
+            profile['last_scraped_at'] = pid_index.last_seen(city)
+
+    save_profiles(profiles_path, profiles)
+    for city, profile in profiles.items():
+        if city in cities:
+            cities[city]['profile'] = profile
+    return profiles
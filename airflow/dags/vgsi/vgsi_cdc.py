@@ -0,0 +1,188 @@
+import json
+from datetime import date, datetime
+from .vgsi_objects import record_digest
+from .vgsi_schema import ROW_KEYS
+from .vgsi_store import SqliteStore
+from .vgsi_writer import CATEGORIES, property_records
+
+# record level change sets between runs. A ChangeStore keeps the digest of
+# every record it has seen, per (city, category, pid, row key), and turns the
+# records of a scanned parcel into the inserts, updates and deletes since the
+# last committed run. ChangeSink writes those change sets, with a `change`
+# column, next to (or instead of) the full snapshot, so downstream models
+# only read the rows that changed.
+
+CHANGE_FIELD = 'change'
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+def _key_fields(category):
+    return [name for name in ROW_KEYS[category] if name not in ('city', 'pid')]
+
+def row_keys(category, records):
+
+    # the identity of each record of one parcel: its ROW_KEYS past (city,
+    # pid), plus a count for rows that share them (a parcel can list the
+    # same sale twice). The count follows the rows' uuids, not the page, the
+    # same occurrence vgsi_bigquery.merge_query merges them by.
+    fields = _key_fields(category)
+    values = [
+        [value.strip() if isinstance(value, str) else value for value in (record.get(name) for name in fields)]
+        for record in records
+    ]
+    identities = [json.dumps(row_values) for row_values in values]
+    seen = {}
+    keys = [None] * len(records)
+    for i in sorted(range(len(records)), key=lambda i: records[i].get('uuid') or ''):
+        count = seen.get(identities[i], 0)
+        seen[identities[i]] = count + 1
+        keys[i] = json.dumps(values[i] + [count])
+    return keys
+
+class ChangeStore(SqliteStore):
+
+    # last committed digest and uuid of every record, by city and pid.
+    # Like FingerprintStore, diffs are staged during a scan and only written
+    # by commit(), once the scan's output is safely stored, so a failed run
+    # reports the same changes again on the next one.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            city TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            uuid TEXT,
+            changed_at TEXT,
+            PRIMARY KEY (city, pid, category, row_key)
+        )
+        """
+
+    def _load(self, city):
+
+        # {pid: {(category, row_key): (digest, uuid, changed_at)}}
+        known = {}
+        rows = self._conn.execute(
+            "SELECT pid, category, row_key, digest, uuid, changed_at FROM records WHERE city = ?",
+            (city,)
+        )
+        for pid, category, row_key, digest, uuid, changed_at in rows:
+            known.setdefault(pid, {})[(category, row_key)] = (digest, uuid, changed_at)
+        return known
+
+    def diff(self, city, pid, records, updated_at=None, fetch_date=None):
+
+        # {category: [change record]} between the parcel's records
+        # ({category: [record]}) and what the store holds for it. Inserts and
+        # updates are the records themselves, deletes the row keys and uuid
+        # of the rows that are gone.
+        fetch_date = fetch_date or date.today().isoformat()
+        known = self._city(city).get(pid, {})
+        current = {}
+        changes = {category: [] for category in CATEGORIES}
+
+        for category in CATEGORIES:
+            category_records = records.get(category, [])
+            for row_key, record in zip(row_keys(category, category_records), category_records):
+                digest = record_digest(record)
+                previous = known.get((category, row_key))
+                if previous is not None and previous[0] == digest:
+                    current[(category, row_key)] = previous
+                    continue
+                current[(category, row_key)] = (digest, record.get('uuid'), fetch_date)
+                changes[category].append(record | {CHANGE_FIELD: INSERT if previous is None else UPDATE})
+
+        self._deletes(city, pid, known, current, changes, updated_at)
+        self._stage(city, pid, current)
+        return changes
+
+    def remove(self, city, pid, updated_at=None):
+
+        # deletes for every row of a parcel whose pid no longer holds one.
+        known = self._city(city).get(pid)
+        changes = {category: [] for category in CATEGORIES}
+        if not known:
+            return changes
+
+        self._deletes(city, pid, known, {}, changes, updated_at)
+        self._stage(city, pid, {})
+        return changes
+
+    def _deletes(self, city, pid, known, current, changes, updated_at):
+        updated_at = updated_at or datetime.now()
+        for (category, row_key), (_, uuid, _) in known.items():
+            if (category, row_key) in current:
+                continue
+            values = json.loads(row_key)[:-1]
+            changes[category].append(
+                {'uuid': uuid, 'pid': pid, 'city': city}
+                | dict(zip(_key_fields(category), values))
+                | {'updated_at': updated_at, CHANGE_FIELD: DELETE}
+            )
+
+    def _write(self, staged):
+        for (city, pid), rows in staged.items():
+            self._conn.execute("DELETE FROM records WHERE city = ? AND pid = ?", (city, pid))
+            self._conn.executemany(
+                """
+                INSERT INTO records (city, pid, category, row_key, digest, uuid, changed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(city, pid, category, row_key) + tuple(values) for (category, row_key), values in rows.items()]
+            )
+            if city in self._cities:
+                self._cities[city][pid] = rows
+
+class ChangeSink:
+
+    # diffs every parcel against a ChangeStore and hands the change sets to
+    # `changes`, a sink with add_records (a ParquetSink or DataFrameSink).
+    # With a `snapshot` sink the parcels also go there as they are. The two
+    # flush together, so a checkpoint always covers both. close() returns
+    # {'changes': ..., 'snapshot': ...}, what each sink's close returned.
+    #
+    # The store is committed by the caller once the output is stored. With
+    # the store in its ScanState, a checkpoint keeps what it staged, so a
+    # resumed scan commits the parcels before the checkpoint too.
+
+    def __init__(self, store, city, changes, snapshot=None, fetch_date=None):
+        self.store = store
+        self.city = city
+        self.changes = changes
+        self.snapshot = snapshot
+        self.fetch_date = fetch_date
+
+    def _sinks(self):
+        return [sink for sink in (self.changes, self.snapshot) if sink is not None]
+
+    def _flushed(self, flushed):
+        if flushed:
+            for sink in self._sinks():
+                if hasattr(sink, 'flush'):
+                    sink.flush()
+        return flushed
+
+    def add(self, p):
+        flushed = self.changes.add_records(self.store.diff(self.city, p.pid, property_records(p), p.updated_at, self.fetch_date))
+        if self.snapshot is not None:
+            flushed = self.snapshot.add(p) or flushed
+        return self._flushed(flushed)
+
+    def remove(self, pid):
+        return self._flushed(self.changes.add_records(self.store.remove(self.city, pid)))
+
+    def state(self):
+        return {'changes': self.changes.state(), 'snapshot': self.snapshot.state() if self.snapshot is not None else None}
+
+    def restore(self, state):
+        self.changes.restore(state['changes'])
+        if self.snapshot is not None and state.get('snapshot') is not None:
+            self.snapshot.restore(state['snapshot'])
+
+    def close(self):
+        return {
+            'changes': self.changes.close(),
+            'snapshot': self.snapshot.close() if self.snapshot is not None else None
+        }
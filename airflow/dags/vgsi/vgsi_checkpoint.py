@@ -0,0 +1,55 @@
+import json
+import os
+from .vgsi_store import atomic_write
+
+class Checkpoint:
+
+    # progress of a city scan: the last pid whose records are all flushed,
+    # the null page counter at that point, the fetch date and the part files
+    # the sink has written. A retry that finds it picks the scan up after
+    # that pid instead of starting again from pid_min.
+    #
+    # stores ({name: SqliteStore}) are the state stores of the scan: what
+    # they staged is saved next to the checkpoint, <path>.<name>, and staged
+    # again by load(), so a resumed scan commits the parcels before the
+    # checkpoint too.
+
+    def __init__(self, path, stores=None):
+        self.path = path
+        self.fetch_date = None
+        self.stores = stores or {}
+
+    def _staged_path(self, name):
+        return f"{self.path}.{name}"
+
+    def load(self):
+
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            state = json.load(f)
+        for name, store in self.stores.items():
+            store.load_staged(self._staged_path(name))
+        return state
+
+    def save(self, pid, null_page_cnt, sink_state):
+
+        state = {
+            'pid': pid,
+            'null_page_cnt': null_page_cnt,
+            'fetch_date': self.fetch_date,
+            'sink': sink_state
+        }
+
+        # what the stores staged goes first, it may be ahead of the
+        # checkpoint but never behind it.
+        for name, store in self.stores.items():
+            store.save_staged(self._staged_path(name))
+
+        atomic_write(self.path, json.dumps(state).encode())
+
+    def clear(self):
+
+        for path in [self.path] + [self._staged_path(name) for name in self.stores]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,81 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict
+
+# building blocks are numbered MainContent_ctl01_*, MainContent_ctl02_*, ...
+_BUILDING_ID_ = re.compile(r'^MainContent_ctl(\d+)_(\w+)$')
+
+BUILDING_FIELDS = {
+    'lblYearBuilt': 'year_built',
+    'lblBldArea': 'building_area',
+    'lblRcn': 'replacement_cost',
+    'lblRcnld': 'less_depreciation'
+}
+BUILDING_TABLE = 'grdCns'
+
+_plans = {}
+
+@dataclass
+class Extraction:
+
+    # what one pass over a parcel page found: the mapped span texts, the
+    # history tables by id, and per building number its span texts and its
+    # construction table.
+    spans: Dict = field(default_factory=lambda: {})
+    tables: Dict = field(default_factory=lambda: {})
+    buildings: Dict = field(default_factory=lambda: {})
+
+class ExtractionPlan:
+
+    # which ids of a page layout hold what, compiled once per layout (see
+    # plan_for) so a parcel page is walked a single time, over the elements
+    # that have an id, with one dict lookup each.
+
+    def __init__(self, span_fields, table_ids, building_fields=BUILDING_FIELDS, building_table=BUILDING_TABLE):
+        self.span_fields = dict(span_fields)
+        self.table_ids = frozenset(table_ids)
+        self.building_fields = dict(building_fields)
+        self.building_table = building_table
+
+    def extract(self, soup):
+
+        extraction = Extraction()
+        buildings = {}
+
+        for tag in soup.find_all(['span', 'table'], id=True):
+            tag_id = tag['id']
+            is_span = tag.name == 'span'
+
+            if is_span and tag_id in self.span_fields:
+                extraction.spans[self.span_fields[tag_id]] = tag.get_text(separator = ' ', strip = True)
+                continue
+            if not is_span and tag_id in self.table_ids:
+                extraction.tables[tag_id] = tag
+                continue
+
+            match = _BUILDING_ID_.match(tag_id)
+            if match is None:
+                continue
+            spans, table = buildings.setdefault(int(match.group(1)), ({}, []))
+            if is_span and match.group(2) in self.building_fields:
+                spans[self.building_fields[match.group(2)]] = tag.get_text(separator = ' ', strip = True)
+            elif not is_span and match.group(2) == self.building_table:
+                table.append(tag)
+
+        # a block is a building when it has its construction table, the
+        # same rule the old probing applied.
+        extraction.buildings = {
+            bid: (spans, table[0])
+            for bid, (spans, table) in sorted(buildings.items()) if table
+        }
+        return extraction
+
+def plan_for(span_fields, table_ids):
+
+    # every town runs the same layout so in practice this compiles a single
+    # plan per process, keyed on the mappings in case a caller changes them.
+    key = (tuple(span_fields.items()), tuple(table_ids))
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = ExtractionPlan(span_fields, table_ids)
+    return plan
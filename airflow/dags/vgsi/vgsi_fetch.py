@@ -0,0 +1,323 @@
+import asyncio
+import sys
+import threading
+import time
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, parse_url
+from .vgsi_objects import InvalidPIDException, Property, __request_timeout__
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_host_buckets = {}
+_host_buckets_lock = threading.Lock()
+_instance_limits = {}
+
+@dataclass
+class FetchOptions:
+
+    # how a live scan talks to the town's host: `concurrency` requests in
+    # flight (at most, when adaptive lets the town's AdaptiveLimit find
+    # how many it takes), rate_limit requests per second (one every
+    # delay_seconds when not given) and the session and timeout of every
+    # request (make_session(concurrency) when no session is given).
+    concurrency: int = 1
+    rate_limit: float | None = None
+    delay_seconds: float = 1
+    adaptive: bool = False
+    session: requests.Session | None = None
+    timeout: tuple = __request_timeout__
+
+class TokenBucket:
+
+    def __init__(self, rate=None, capacity=1):
+        # rate is in requests per second, None or 0 means unlimited.
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+
+        # takes a token (possibly going into debt) and returns the number of
+        # seconds the caller has to wait before using it.
+        if not self.rate:
+            return 0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    async def acquire(self):
+
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+def host_bucket(url, rate=None, capacity=1):
+
+    # every city lives on gis.vgsi.com, so the limit is shared per host and
+    # not per city.
+    host = parse_url(url).host
+
+    with _host_buckets_lock:
+        bucket = _host_buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity)
+            _host_buckets[host] = bucket
+        else:
+            bucket.rate = rate
+            bucket.capacity = capacity
+
+    return bucket
+
+class AdaptiveLimit:
+
+    # additive increase, multiplicative decrease of the requests a scan keeps
+    # in flight. Every healthy response adds 1/limit, i.e. about one request
+    # per round of `limit` responses. A transient error (429, 5xx, timeouts,
+    # after the session's retries) or a latency above `tolerance` times the
+    # best latency seen cuts the limit by `decrease`, at most once per round
+    # so one burst of bad responses counts once. A response the session
+    # only got after retrying a 429 or 5xx counts as an error too (see
+    # fetch_raw), or the retries would hide the overload from the limit.
+
+    def __init__(self, initial=4, minimum=1, maximum=64, decrease=0.5, tolerance=2.0, smoothing=0.2, name=None):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.name = name
+        self.latency = None
+        self.best_latency = None
+        self.history = deque(maxlen=1000)
+        self._since_decrease = 0
+        self._lock = threading.Lock()
+
+    def __int__(self):
+        return int(self.limit)
+
+    def _set(self, limit, reason):
+
+        # history and log only see whole-request steps.
+        old = int(self.limit)
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        if int(self.limit) != old:
+            self.history.append((time.time(), int(self.limit), reason))
+            sys.stdout.write(f"Concurrency of {self.name or 'scan'} {old} -> {int(self.limit)} ({reason}).\n")
+
+    def success(self, latency):
+
+        with self._lock:
+            self._since_decrease += 1
+            self.latency = latency if self.latency is None else self.smoothing * latency + (1 - self.smoothing) * self.latency
+            self.best_latency = self.latency if self.best_latency is None else min(self.best_latency, self.latency)
+
+            if self.latency > self.tolerance * self.best_latency:
+                self._cut(f"latency {self.latency * 1000:.0f} ms")
+            else:
+                self._set(self.limit + 1 / self.limit, 'healthy')
+
+    def failure(self):
+        with self._lock:
+            self._since_decrease += 1
+            self._cut('errors')
+
+    def _cut(self, reason):
+        if self._since_decrease >= self.limit:
+            self._since_decrease = 0
+            self._set(self.limit * self.decrease, reason)
+
+def instance_limit(url, **options):
+
+    # towns share gis.vgsi.com but each one is its own instance behind it,
+    # with its own capacity, so the limit is kept per base url and carries
+    # over from one scan of the town to the next in the same process.
+    with _host_buckets_lock:
+        limit = _instance_limits.get(url)
+        if limit is None:
+            limit = AdaptiveLimit(name=url, **options)
+            _instance_limits[url] = limit
+        return limit
+
+def make_session(pool_size=10, retries=5, backoff_factor=0.5):
+
+    # one session per city scan so every parcel reuses the same keep-alive
+    # connections to the host instead of a new TCP+TLS handshake each time.
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.verify = False
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+def is_transient(error):
+
+    # errors that say nothing about whether the pid exists, so they must not
+    # count as an empty page.
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.RetryError,
+        requests.exceptions.ChunkedEncodingError
+    ))
+
+# what a failed pid says about it, see classify_error.
+INVALID = 'invalid'
+TRANSIENT = 'transient'
+HTTP = 'http'
+PARSE = 'parse'
+
+def classify_error(error):
+
+    # invalid: the pid returned the error page, it holds no parcel. The
+    # others say nothing about the pid: transient errors (see is_transient)
+    # outlived the session's retries, http ones are any other bad response,
+    # and parse ones came back as a page Property failed on.
+    if isinstance(error, InvalidPIDException):
+        return INVALID
+    if is_transient(error):
+        return TRANSIENT
+    if isinstance(error, requests.RequestException):
+        return HTTP
+    return PARSE
+
+def fetch_page(url, pid, session=None, timeout=__request_timeout__, headers=None):
+
+    http = session or requests
+    page = http.get(f"{url}Parcel.aspx?pid={pid}", verify=False, timeout=timeout, headers=headers)
+    page.raise_for_status()
+    return page
+
+def parse_property(url, pid, content, parser='html.parser', city='newhaven'):
+
+    p = Property(url=url, pid=pid, city=city, content=content, parser=parser)
+    p.load_all()
+    return p
+
+def fetch_raw(url, pid, session=None, timeout=__request_timeout__, archive=None, city=None, fetch_date=None, fingerprints=None, metrics=None, limit=None):
+
+    headers = fingerprints.headers(city, pid) if fingerprints is not None else None
+    start = time.perf_counter()
+    page = fetch_page(url, pid, session, timeout, headers)
+
+    # what the session's Retry went through before this response.
+    retries = getattr(page.raw, 'retries', None)
+    history = retries.history if retries is not None else ()
+    if limit is not None and any(entry.status in RETRY_STATUSES or entry.error is not None for entry in history):
+        limit.failure()
+
+    if metrics is not None:
+        metrics.timing('fetch_ms', time.perf_counter() - start)
+        metrics.incr('bytes_downloaded', len(page.content))
+        if history:
+            metrics.incr('retries', len(history))
+        if page.status_code == 304:
+            metrics.incr('not_modified')
+
+    # archived before parsing, so pages the parser chokes on can be replayed
+    # once it is fixed.
+    if archive is not None and page.status_code != 304:
+        archive.put(city, pid, page.content, fetch_date)
+
+    # None tells the caller the parcel is unchanged since the last run and
+    # there is nothing to parse or write.
+    if fingerprints is not None and fingerprints.check(city, pid, page, fetch_date):
+        return None
+    return page
+
+def fetch_property(url, pid, session=None, timeout=__request_timeout__, parser='html.parser', archive=None, city=None, fetch_date=None, fingerprints=None, metrics=None, limit=None):
+
+    page = fetch_raw(url, pid, session, timeout, archive, city, fetch_date, fingerprints, metrics, limit)
+    if page is None:
+        return None
+
+    p = parse_property(url, pid, page.content, parser, city)
+    if fingerprints is not None:
+        fingerprints.update(city, pid, page, fetch_date)
+    return p
+
+async def scan_pids(fetch, pids, concurrency=1, bucket=None, executor=None, limit=None):
+
+    # keeps up to `concurrency` calls of fetch(pid) in flight and yields
+    # (pid, result, error) strictly in the order of `pids`, regardless of the
+    # order the responses come back in. Closing the generator cancels
+    # whatever is still pending. fetch runs on a private thread pool unless
+    # an executor (e.g. a process pool) is handed in. With an AdaptiveLimit
+    # `concurrency` is only the most it can go up to, the limit itself
+    # follows the latency and errors of the responses.
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+    pids = iter(pids)
+    pending = deque()
+
+    async def run(pid):
+        if bucket is not None:
+            await bucket.acquire()
+        if limit is None:
+            return await loop.run_in_executor(executor, fetch, pid)
+
+        start = loop.time()
+        try:
+            result = await loop.run_in_executor(executor, fetch, pid)
+        except Exception as e:
+            if is_transient(e):
+                limit.failure()
+            else:
+                limit.success(loop.time() - start)
+            raise
+        limit.success(loop.time() - start)
+        return result
+
+    def fill():
+        while len(pending) < (min(int(limit), concurrency) if limit is not None else concurrency):
+            pid = next(pids, None)
+            if pid is None:
+                return
+            pending.append((pid, asyncio.ensure_future(run(pid))))
+
+    try:
+        fill()
+        while pending:
+            pid, task = pending.popleft()
+            try:
+                result, error = await task, None
+            except Exception as e:
+                result, error = None, e
+            fill()
+            yield pid, result, error
+    finally:
+        for _, task in pending:
+            task.cancel()
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
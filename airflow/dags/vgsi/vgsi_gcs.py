@@ -0,0 +1,131 @@
+import base64
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# files above this go up as resumable uploads in chunks of CHUNK_SIZE (a
+# multiple of 256 KiB, as gcs requires), so a dropped connection only
+# resends the chunk it was on.
+RESUMABLE_THRESHOLD = 32 * 1024 * 1024
+CHUNK_SIZE = 16 * 1024 * 1024
+
+def is_gcs_uri(path):
+    return str(path).startswith('gs://')
+
+def split_uri(uri):
+    bucket_name, _, name = uri[len('gs://'):].partition('/')
+    return bucket_name, name
+
+@lru_cache(maxsize=None)
+def _client():
+    # one client per process, imported only when gcs is actually used.
+    from google.cloud import storage
+    return storage.Client()
+
+def open_uri(path, mode='rb'):
+
+    # a local file or a gs:// object. Objects are streamed through the
+    # storage api's file objects, writes as resumable uploads, so nothing is
+    # staged on the worker's disk.
+    if not is_gcs_uri(path):
+        if 'w' in mode:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        return open(path, mode)
+
+    bucket_name, name = split_uri(path)
+    blob = _client().bucket(bucket_name).blob(name)
+    if 'w' in mode:
+        # parquet writers flush on their own schedule, gcs can only take
+        # whole chunks.
+        return blob.open(mode, chunk_size=CHUNK_SIZE, ignore_flush=True)
+    return blob.open(mode)
+
+def remove_tree(path):
+
+    if not is_gcs_uri(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+
+    bucket_name, prefix = split_uri(path)
+    bucket = _client().bucket(bucket_name)
+    blobs = list(_client().list_blobs(bucket_name, prefix=prefix.rstrip('/') + '/'))
+    if blobs:
+        bucket.delete_blobs(blobs)
+
+def list_files(prefix):
+
+    # every file under a local directory or gs:// prefix, sorted.
+    if not is_gcs_uri(prefix):
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(prefix) for name in names
+        )
+
+    bucket_name, name = split_uri(prefix)
+    blobs = _client().list_blobs(bucket_name, prefix=name.rstrip('/') + '/')
+    return sorted(f"gs://{bucket_name}/{blob.name}" for blob in blobs)
+
+def remove_files(paths):
+
+    for path in paths:
+        if not is_gcs_uri(path):
+            os.remove(path)
+
+    names = {}
+    for path in paths:
+        if is_gcs_uri(path):
+            bucket_name, name = split_uri(path)
+            names.setdefault(bucket_name, []).append(name)
+    for bucket_name, bucket_names in names.items():
+        bucket = _client().bucket(bucket_name)
+        bucket.delete_blobs([bucket.blob(name) for name in bucket_names])
+
+def file_checksums(path):
+
+    # base64 md5 and crc32c, the way gcs reports them for an object.
+    import google_crc32c
+
+    md5 = hashlib.md5()
+    crc32c = google_crc32c.Checksum()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+            crc32c.update(chunk)
+
+    return base64.b64encode(md5.digest()).decode(), base64.b64encode(crc32c.digest()).decode()
+
+def is_uploaded(blob, path):
+
+    # composite objects have no md5, only a crc32c.
+    if blob is None or blob.size != os.path.getsize(path):
+        return False
+    md5, crc32c = file_checksums(path)
+    if blob.md5_hash:
+        return blob.md5_hash == md5
+    return blob.crc32c == crc32c
+
+def upload_file(bucket, object_name, path, timeout=300):
+
+    # True when the file was uploaded, False when the object already held it.
+    if is_uploaded(bucket.get_blob(object_name), path):
+        return False
+
+    size = os.path.getsize(path)
+    blob = bucket.blob(object_name, chunk_size=CHUNK_SIZE if size > RESUMABLE_THRESHOLD else None)
+    blob.upload_from_filename(path, timeout=timeout, checksum='crc32c')
+    return True
+
+def upload_files(bucket_name, files, workers=8, timeout=300):
+
+    # uploads {object_name: local path} concurrently and returns which of the
+    # objects had to be written.
+    bucket = _client().bucket(bucket_name)
+
+    def upload(item):
+        object_name, path = item
+        return object_name, upload_file(bucket, object_name, path, timeout)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(upload, files.items()))
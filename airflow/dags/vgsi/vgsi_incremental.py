@@ -0,0 +1,117 @@
+import hashlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import date
+from .vgsi_archive import strip_volatile
+from .vgsi_gcs import open_uri
+from .vgsi_store import SqliteStore
+
+def fingerprint(content):
+    return hashlib.sha256(strip_volatile(content)).hexdigest()
+
+class FingerprintStore(SqliteStore):
+
+    # last seen fingerprint per (city, pid), plus the http validators the
+    # server sent with it. Changes are staged during a scan and only written
+    # by commit(), which the caller runs once the scan's output is safely
+    # stored. A failed run therefore never hides changed parcels from the
+    # next one.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            city TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            changed_at TEXT,
+            seen_at TEXT,
+            PRIMARY KEY (city, pid)
+        )
+        """
+
+    def _load(self, city):
+        rows = self._conn.execute(
+            "SELECT pid, digest, etag, last_modified, changed_at FROM fingerprints WHERE city = ?",
+            (city,)
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    def headers(self, city, pid):
+
+        known = self._city(city).get(pid)
+        if known is None:
+            return None
+
+        _, etag, last_modified, _ = known
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers or None
+
+    def check(self, city, pid, page, fetch_date=None):
+
+        # True when the parcel is the same as in the last committed run,
+        # either because the server answered 304 or because the page hashes
+        # the same.
+        known = self._city(city).get(pid)
+        if known is None:
+            return False
+
+        digest, etag, last_modified, changed_at = known
+        if page.status_code != 304 and fingerprint(page.content) != digest:
+            return False
+
+        self._stage(city, pid, (digest, etag, last_modified, changed_at, fetch_date or date.today().isoformat()))
+        return True
+
+    def update(self, city, pid, page, fetch_date=None):
+
+        fetch_date = fetch_date or date.today().isoformat()
+        self._stage(city, pid, (
+            fingerprint(page.content),
+            page.headers.get('ETag'),
+            page.headers.get('Last-Modified'),
+            fetch_date,
+            fetch_date
+        ))
+
+    def _write(self, staged):
+        self._conn.executemany(
+            """
+            INSERT OR REPLACE INTO fingerprints (city, pid, digest, etag, last_modified, changed_at, seen_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(city, pid) + tuple(values) for (city, pid), values in staged.items()]
+        )
+        for (city, pid), values in staged.items():
+            if city in self._cities:
+                self._cities[city][pid] = tuple(values[:4])
+
+    def carried_forward(self, city, fetch_date, pid_min=1, pid_max=None):
+
+        # {pid: changed_at} of the parcels this scan staged as seen unchanged
+        # on fetch_date: their rows are not in this run's output but still
+        # in the output of the run of changed_at.
+        with self._lock:
+            return {
+                pid: changed_at
+                for (staged_city, pid), (_, _, _, changed_at, seen_at) in sorted(self._staged.items())
+                if staged_city == city and seen_at == fetch_date and changed_at < fetch_date
+                and pid >= pid_min and (pid_max is None or pid <= pid_max)
+            }
+
+def write_carried_forward(path, carried):
+
+    # the manifest of a run's carried forward parcels, {pid: changed_at}, as
+    # parquet with a pid and a changed_at column. Read next to the records,
+    # a parcel's rows are those of the run whose snapshot date is
+    # changed_at.
+    table = pa.table({
+        'pid': pa.array(list(carried), pa.int64()),
+        'changed_at': pa.array(list(carried.values()), pa.string())
+    })
+    with open_uri(path, 'wb') as f:
+        pq.write_table(table, f)
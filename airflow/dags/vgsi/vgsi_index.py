@@ -0,0 +1,142 @@
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from urllib.parse import urljoin
+from .vgsi_objects import __request_timeout__
+from .vgsi_fetch import make_session
+from .vgsi_store import SqliteStore
+
+_PARCEL_LINK_ = re.compile(rb'Parcel\.aspx\?pid=(\d+)', re.I)
+_STREET_LINK_ = re.compile(rb'href\s*=\s*["\']([^"\']*Streets\.aspx\?[^"\']*)["\']', re.I)
+
+class PIDIndex(SqliteStore):
+
+    # pids known to hold a parcel, per city. Scans record what they see and
+    # commit() writes it, later scans fetch the known pids and only walk a
+    # frontier past the largest one. A staged pid maps to the day it was
+    # seen, or to None when it turned out to be empty. Pids seeded from the
+    # town's street listing have not been seen by a scan yet.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS valid_pids (
+            city TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            last_seen TEXT,
+            PRIMARY KEY (city, pid)
+        )
+        """
+
+    def pids(self, city):
+        rows = self._conn.execute("SELECT pid FROM valid_pids WHERE city = ? ORDER BY pid", (city,))
+        return [row[0] for row in rows]
+
+    def last_seen(self, city):
+        # the date of the last scan of the city that committed.
+        row = self._conn.execute("SELECT MAX(last_seen) FROM valid_pids WHERE city = ?", (city,)).fetchone()
+        return row[0]
+
+    def seed(self, city, pids):
+
+        # written right away, with no last_seen, and never over a pid a
+        # scan has seen.
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO valid_pids (city, pid, last_seen) VALUES (?, ?, NULL)",
+                [(city, pid) for pid in pids]
+            )
+            self._conn.commit()
+
+    def add(self, city, pid, seen_at=None):
+        self._stage(city, pid, seen_at or date.today().isoformat())
+
+    def discard(self, city, pid):
+        self._stage(city, pid, None)
+
+    def _write(self, staged):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO valid_pids (city, pid, last_seen) VALUES (?, ?, ?)",
+            [(city, pid, seen_at) for (city, pid), seen_at in staged.items() if seen_at is not None]
+        )
+        self._conn.executemany(
+            "DELETE FROM valid_pids WHERE city = ? AND pid = ?",
+            [key for key, seen_at in staged.items() if seen_at is None]
+        )
+
+def probe_pid_max(is_valid, start=1, window=10, misses=4, density=None, pid_limit=10000000):
+
+    # finds the top of a city's pid range in a logarithmic number of probes.
+    # A probe checks `window` consecutive pids, widened to hold three
+    # parcels on average when the town's density is known, and only misses
+    # once `misses` such windows are empty, each twice as far past the
+    # probed pid as the last (at 0, 1, 3, 7... windows), so neither a sparse
+    # town nor a gap in a dense one ends it early. It gallops up from start,
+    # a pid known to hold a parcel (the largest one the PIDIndex or the
+    # street listing knows), doubling the step while probes keep hitting
+    # parcels, then bisects between the last hit and the first miss.
+    if density:
+        window = max(window, math.ceil(3 / density))
+    span = window * 2 ** (misses - 1)
+    found = {}
+
+    def hit(pid):
+        for n in range(misses):
+            first = pid + window * (2 ** n - 1)
+            for p in range(first, min(first + window, pid_limit + 1)):
+                if is_valid(p):
+                    found[pid] = p
+                    return True
+        return False
+
+    lo, step = start, 1
+    if not hit(lo):
+        return None
+
+    while lo + step <= pid_limit and hit(lo + step):
+        lo += step
+        step *= 2
+    hi = min(lo + step, pid_limit + 1)
+
+    while hi - lo > span:
+        mid = (lo + hi) // 2
+        if hit(mid):
+            lo = mid
+        else:
+            hi = mid
+
+    # the probe that hit at lo may have more parcels past the first one it
+    # found, up to hi, whose probe found none. A probe that skipped past hi
+    # may have found one further up.
+    top = max(found.values())
+    for p in range(found[lo] + 1, hi):
+        if p > top and is_valid(p):
+            top = p
+    return top
+
+def discover_pids(base_url, session=None, workers=8, timeout=__request_timeout__):
+
+    # walks the town's street listing (Streets.aspx, its letter pages and
+    # every street page) and collects the pids it links to.
+    session = session or make_session(pool_size=workers)
+    seen = set()
+    pids = set()
+    pages = [urljoin(base_url, 'Streets.aspx')]
+
+    def get(url):
+        page = session.get(url, verify=False, timeout=timeout)
+        page.raise_for_status()
+        return url, page.content
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pages:
+            seen.update(pages)
+            found = []
+            for url, content in executor.map(get, pages):
+                pids.update(int(pid) for pid in _PARCEL_LINK_.findall(content))
+                for link in _STREET_LINK_.findall(content):
+                    link = urljoin(url, link.decode('utf-8', errors='replace').replace('&amp;', '&'))
+                    if link not in seen:
+                        found.append(link)
+            pages = list(dict.fromkeys(found))
+
+    return sorted(pids)
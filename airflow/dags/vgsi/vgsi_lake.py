@@ -0,0 +1,154 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from .vgsi_gcs import list_files, open_uri, remove_files
+from .vgsi_writer import merge_sorted, parquet_writer, read_row_groups, write_row_groups
+
+# the parquet lake: one directory per category, city and snapshot date,
+#
+#   <root>/category=<category>/city=<city>/snapshot_date=<date>/<name>.parquet
+#
+# under a local directory or a gs:// prefix. The partition columns live in
+# the path only (LAKE_PARTITIONS is what a ParquetSink writing into it
+# drops), the way pyarrow datasets, duckdb and BigQuery's hive partitioning
+# read them back. Every shard of a run writes its own file, so a partition
+# collects several small ones; compact_lake rewrites them as one, sorted by
+# pid.
+
+LAKE_PARTITIONS = ('city',)
+
+COMPACTED_KEY = b'vgsi_compacted_from'
+
+def partition_path(root, category, city, snapshot_date):
+    return f"{root.rstrip('/')}/category={category}/city={city}/snapshot_date={snapshot_date}"
+
+def lake_paths(root, city, snapshot_date, name, categories):
+    # {category: path} of a shard's files, the paths of a ParquetSink.
+    return {
+        category: f"{partition_path(root, category, city, snapshot_date)}/{name}.parquet"
+        for category in categories
+    }
+
+def partitions(root, snapshot_date, cities, categories, workers=8):
+
+    # {partition directory: [parquet files]} of the cities' partitions of
+    # one snapshot date. Only those directories are listed, never the
+    # lake's history.
+    directories = [
+        partition_path(root, category, city, snapshot_date)
+        for category in categories
+        for city in cities
+    ]
+
+    def parquet_files(directory):
+        return directory, [path for path in list_files(directory) if path.endswith('.parquet')]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {directory: files for directory, files in executor.map(parquet_files, directories) if files}
+
+def _file_name(path):
+    return path.rsplit('/', 1)[-1]
+
+def _is_compacted(path):
+    return _file_name(path).startswith('compacted-')
+
+def _sources(path):
+    # {file name: [digest, first pid, last pid]} of the shard files a
+    # compacted file holds, and {file name: None} of the compacted files it
+    # was made from.
+    with open_uri(path, 'rb') as f:
+        metadata = pq.read_schema(f).metadata or {}
+    sources = metadata.get(COMPACTED_KEY)
+    return json.loads(sources) if sources else {}
+
+def _source(path):
+
+    # what a compacted file records of a shard's file: the sha1 of its bytes,
+    # and the pids its rows span (None when it has none).
+    digest = hashlib.sha1()
+    with open_uri(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    with open_uri(path, 'rb') as f:
+        pids = pq.read_table(f, columns=['pid']).column('pid')
+    if not len(pids):
+        return [digest.hexdigest(), None, None]
+    return [digest.hexdigest(), pc.min(pids).as_py(), pc.max(pids).as_py()]
+
+def _without_pids(tables, spans):
+    # the rows of a stream of tables outside every (first, last) pid span.
+    for table in tables:
+        keep = None
+        for first, last in spans:
+            inside = pc.and_(pc.greater_equal(table.column('pid'), first), pc.less_equal(table.column('pid'), last))
+            keep = pc.invert(inside) if keep is None else pc.and_(keep, pc.invert(inside))
+        yield table.filter(keep)
+
+def compact_partition(files):
+
+    # rewrites a partition's files as one, sorted by pid, in row groups of
+    # ROW_GROUP_ROWS, and removes them. The files are each sorted by pid and
+    # merged a row group of each at a time, never read whole.
+    #
+    # The new file records every shard file it holds by name, digest and pid
+    # span (_sources), and the compacted files it was made from by name,
+    # which holds the digest of their sources. A file the record holds with
+    # the same digest is a leftover of a compaction that stopped before the
+    # removal and is removed. A shard file under a recorded name but with
+    # other bytes is a re-run of that shard: its rows replace the ones of the
+    # recorded span.
+    files = sorted(files)
+    directory = files[0][:-len(_file_name(files[0])) - 1]
+
+    compacted = {path: _sources(path) for path in files if _is_compacted(path)}
+    consumed = {name for sources in compacted.values() for name, source in sources.items() if source is None}
+    leftover = [path for path in compacted if _file_name(path) in consumed]
+    recorded = {}
+    for path, sources in compacted.items():
+        if path not in leftover:
+            recorded |= {name: source for name, source in sources.items() if source is not None}
+
+    shards = {path: _source(path) for path in files if not _is_compacted(path)}
+    leftover += [path for path, source in shards.items() if recorded.get(_file_name(path)) == source]
+    rerun = [path for path in shards if path not in leftover and _file_name(path) in recorded]
+    if leftover:
+        remove_files(leftover)
+        files = [path for path in files if path not in leftover]
+    if len(files) < 2:
+        return files
+
+    schemas = []
+    for path in files:
+        with open_uri(path, 'rb') as f:
+            schemas.append(pq.read_schema(f))
+    schema = pa.unify_schemas(schemas, promote_options='permissive').remove_metadata()
+    replaced = [recorded[_file_name(path)][1:] for path in rerun if recorded[_file_name(path)][1] is not None]
+    runs = [
+        _without_pids(read_row_groups(path, schema), replaced) if _is_compacted(path) and replaced else read_row_groups(path, schema)
+        for path in files
+    ]
+
+    sources = recorded | {_file_name(path): shards[path] for path in files if path in shards}
+    sources |= {_file_name(path): None for path in files if _is_compacted(path)}
+    sources = json.dumps(sources, sort_keys=True)
+    path = f"{directory}/compacted-{hashlib.sha1(sources.encode()).hexdigest()[:16]}.parquet"
+    with open_uri(path, 'wb') as f, parquet_writer(f, schema.with_metadata({COMPACTED_KEY: sources.encode()})) as writer:
+        write_row_groups(writer, merge_sorted(runs))
+
+    remove_files(files)
+    return [path]
+
+def compact_lake(root, snapshot_date, cities, categories, min_files=2):
+
+    # compacts the cities' partitions of one snapshot date holding min_files
+    # or more files. Returns {partition directory: number of files
+    # compacted}.
+    compacted = {}
+    for directory, files in partitions(root, snapshot_date, cities, categories).items():
+        if len(files) >= min_files:
+            compact_partition(files)
+            compacted[directory] = len(files)
+    return compacted
@@ -0,0 +1,159 @@
+import bisect
+import json
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds, in milliseconds, of the timing histogram buckets.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+class Histogram:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def quantile(self, q):
+
+        # upper bound of the bucket the quantile falls in, the max for the
+        # last one.
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else None,
+            'min_ms': round(self.min, 3) if self.count else None,
+            'max_ms': round(self.max, 3) if self.count else None,
+            'p50_ms': round(self.quantile(0.5), 3) if self.count else None,
+            'p95_ms': round(self.quantile(0.95), 3) if self.count else None,
+            'buckets_ms': dict(zip([str(b) for b in BUCKETS_MS] + ['inf'], self.buckets))
+        }
+
+class Metrics:
+
+    # counters and timing histograms of one scrape, safe to update from the
+    # fetch threads. summary() is plain json, for xcom and the statsd sink.
+    #
+    #   fetch_ms               time per request, retries included
+    #   bytes_downloaded       page bytes received
+    #   retries                requests the session retried
+    #   not_modified           304s of conditional requests
+    #   invalid_pids           pids that returned the error page
+    #   failed_pids            pids whose page failed to parse
+    #   transient_errors       pids given up on after the session's retries
+    #   http_errors            pids that got any other bad response
+    #   retried_pids           pids tried again from the retry queue
+    #   recovered_pids         of those, the ones that went through
+    #   unchanged              parcels skipped by an incremental scan
+    #   parcels                parcels written
+    #   parse_ms.<section>     page, spans, buildings and each history table
+    #   parse_failures.<section>
+    #   records.<category>     records written per category
+    #
+    # and gauges, e.g. concurrency_limit, where an adaptive scan ended up,
+    # retry_queue, the pids still due in the queue once it was drained, and
+    # parked_pids, the queued ones past vgsi_retry.MAX_ATTEMPTS.
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def timing(self, name, seconds):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(seconds * 1000)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(name, time.perf_counter() - start)
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.time() - self.started
+            return {
+                **self.labels,
+                'elapsed_seconds': round(elapsed, 3),
+                'parcels_per_second': round(self.counters.get('parcels', 0) / elapsed, 3) if elapsed else None,
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'timings': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+            }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+class StatsdSink:
+
+    # sends a summary to a statsd compatible daemon over udp: counters as
+    # counts and each timing as mean/p95/max gauges, all under
+    # <prefix>.<city>.
+    def __init__(self, host='localhost', port=8125, prefix='vgsi'):
+        self.address = (host, int(port))
+        self.prefix = prefix
+
+    @classmethod
+    def from_address(cls, address, prefix='vgsi'):
+        host, _, port = address.partition(':')
+        return cls(host, port or 8125, prefix)
+
+    def lines(self, summary):
+
+        prefix = '.'.join(str(part) for part in (self.prefix, summary.get('city')) if part)
+        lines = [f"{prefix}.elapsed_seconds:{summary['elapsed_seconds']}|g"]
+        for name, value in summary['counters'].items():
+            lines.append(f"{prefix}.{name}:{value}|c")
+        for name, value in summary.get('gauges', {}).items():
+            if isinstance(value, (int, float)):
+                lines.append(f"{prefix}.{name}:{value}|g")
+        for name, timing in summary['timings'].items():
+            for stat in ('mean_ms', 'p95_ms', 'max_ms'):
+                if timing[stat] is not None:
+                    lines.append(f"{prefix}.{name}.{stat}:{timing[stat]}|g")
+        return lines
+
+    def send(self, summary):
+
+        # one line per packet keeps every packet far below the udp limit. A
+        # missing daemon is not the scrape's problem, udp never blocks on it.
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for line in self.lines(summary):
+                try:
+                    sock.sendto(line.encode(), self.address)
+                except OSError:
+                    pass
@@ -6,31 +6,59 @@ from urllib3.util import parse_url
 import requests
 import re
 import uuid
-import sys
 import hashlib
-from typing import List, Dict
+import time
+from typing import ClassVar, List, Dict
+from .vgsi_parsers import parse_page
+from .vgsi_extract import plan_for
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 __end_section__ = './Error.aspx?Message=There+was+an+error+loading+the+parcel.'
+__request_timeout__ = (10, 60)
 
 class InvalidPIDException(Exception):
   pass
 
+# what a record carries besides the parcel's content, left out of its digest.
+# A child row's property_uuid only names the version of the property row it
+# was written with, a change to the property alone leaves its rows as they
+# were.
+_RECORD_META_ = frozenset(('uuid', 'property_uuid', 'pid', 'city', 'updated_at'))
+
+def record_digest(data):
+
+    # the content of a record, with its text stripped and whatever the order
+    # of its keys. Two scans of an unchanged parcel give the same digests.
+    digest = hashlib.sha1()
+    for key in sorted(data or {}):
+        if key in _RECORD_META_:
+            continue
+        value = data[key]
+        if isinstance(value, str):
+            value = value.strip()
+        digest.update(f"{key}\x1f{value}\x1e".encode("UTF-8"))
+    return digest.hexdigest()
+
+def row_uuid(category, city, pid, data):
+    # one uuid per version of a record: the same content of the same parcel
+    # gets the same uuid in every run, other towns and versions a new one.
+    hex_string = hashlib.md5(f"{category}/{city}/{pid}/{record_digest(data)}".encode("UTF-8")).hexdigest()
+    return str(uuid.UUID(hex=hex_string))
+
 @dataclass(kw_only=True)
 class Base:
 
+    # records of a class are named after it in their uuids.
+    category: ClassVar[str] = None
+
     uuid: str = field(init=False)
     pid: int = field(default=None)
+    city: str = field(default=None)
     data: dict | None = None
     _data: dict | None = None
-    money_fields: List | None = None
-    float_fields: List | None = None
-    integer_fields: List | None = None
-    datetime_fields: List | None = None
-    tag_mapping: Dict = field(default_factory = lambda: {})
-    url: str = field(default=None)
-    soup: BeautifulSoup = field(default=None)
+    # the mapped span texts of the page, found by its extraction plan.
+    span_data: dict | None = field(default=None, repr=False)
     updated_at: datetime = field(init=False)
 
     @property
@@ -39,16 +67,9 @@ class Base:
     
     @data.setter
     def data(self, new_data: dict):
+        # kept as the page text, vgsi_schema types whole columns when the
+        # records are written.
         if isinstance(new_data, dict):
-            for key, value in new_data.items():
-                if self.money_fields is not None and key in self.money_fields:
-                    new_data[key] = self.handle_money(value)
-                elif self.float_fields is not None and key in self.float_fields:
-                    new_data[key] = self.handle_float(value)
-                elif self.integer_fields is not None and key in self.integer_fields:
-                    new_data[key] = self.handle_int(value)
-                else:
-                    new_data[key] = self.handle_none(str(value))
             self._data = new_data
 
     def update_data(self, new_data: dict):
@@ -56,193 +77,81 @@ class Base:
             new_data |= self._data
         self.data = new_data
 
-    @staticmethod
-    def handle_money(money_string):
-
-        if isinstance(money_string, str):
-            money_value = money_string.strip().replace('$', '').replace(',', '')
-
-            if money_value == '':
-                return None
-            else:
-                return float(money_value)
-        elif isinstance(money_string, float):
-            return money_string
-        else:
-            return None
-        
-    @staticmethod
-    def handle_none(column):
-
-        if isinstance(column, str):
-            if column.strip() == '':
-                return None
-        return column
-    
-    @staticmethod
-    def handle_float(float_string):
-
-        if isinstance(float_string, str):
-            try:
-                return float(float_string.strip())
-            except ValueError:
-                return None
-        elif isinstance(float_string, float):
-            return float_string
-        else:
-            return None
-        
-    @staticmethod
-    def handle_int(int_string):
-
-        try:
-            return int(int_string.strip())
-        except ValueError:
-            return None
-
-    def load_dict(self):
-
-        tag_dict = {}
-
-        for tag in self.soup.find_all('span'):
-            try:
-                field_name = self.tag_mapping[tag['id']]
-                tag_content = tag.get_text(separator = ' ', strip = True)
-                tag_dict.update({field_name : tag_content})
-            except KeyError:
-                pass
-
-        return tag_dict
-
     def __post_init__(self):
         
-        uuid_str = f"{self.pid}{self.data}"
-        hex_string = hashlib.md5(uuid_str.encode("UTF-8")).hexdigest()
-        self.uuid = str(uuid.UUID(hex=hex_string))
         self.updated_at = datetime.now()
-
-        if self.tag_mapping:
-            self.data = self.load_dict()
+        self.data = dict(self.span_data or {})
+        self.uuid = row_uuid(self.category, self.city, self.pid, self.data)
         
         self.update_data(
             {
                 'uuid': self.uuid,
-                # 'propery_uuid': self.property_uuid,
                 'pid': self.pid,
+                'city': self.city,
                 'updated_at': self.updated_at
             }
         )
 
-@dataclass(kw_only=True)
-class Table(Base):
-
-    property_uuid: str
-    row: int = field(default=None)
-    table_tag: str = field(default=None)
-    tag_mapping: Dict = field(default_factory=lambda: {})
-
-    def load_table_dict(self):
-
-        keys = []
-        values = []
-        for tag in self.soup.find('table', id=self.table_tag).find_all('tr'):
-            for th in tag.find_all('th'):
-                key = th.get_text(separator = ' ', strip = True)
-                keys.append(key.replace('&', 'and').lower().replace(' ', '_'))
-
-        for tag in self.soup.find('table', id=self.table_tag).find_all('tr')[self.row + 1].find_all('td'):
-            value = tag.get_text(separator = ' ')
-            values.append(value.replace('&', 'and').lower())
-
-        table_dict = dict(zip(keys, values))
-
-        return table_dict
-    
-    def __post_init__(self):
-        super().__post_init__()
-        table_data = self.load_table_dict()
-        self.update_data(table_data)
-
-        self.update_data(
-            {
-                'property_uuid': self.property_uuid
-            }
-        )
-
-        del self.soup
-
-@dataclass(kw_only=True)
-class Building(Table):
-
-    property_uuid: str 
-    money_fields: List[str] = field(default_factory=lambda: [
-        'replacement_cost', 
-        'less_depreciation'
-        ]
-    )
-    float_fields: List[str] = field(default_factory=lambda: ['building_area'])
-
-    def load_table_dict(self):
-
-        table_dict = {}
-
-        table_dict.update({'bid': self.row})
-
-        for tag in self.soup.find('table', id=self.table_tag).find_all('tr'):
-
-            try:
-                key = tag.find_all('td')[0].get_text(separator = ' ', strip = True).lower()
-                value = tag.find_all('td')[1].get_text(separator = ' ', strip = True)
-                table_dict.update({key.replace(' ','_').replace(':','') : value})
-            except (KeyError, IndexError):
-                pass
-        
-        return table_dict
-
-    def __post_init__(self):
-        if not self.tag_mapping:
-            self.tag_mapping = {
-                f"MainContent_ctl0{self.row}_lblYearBuilt" : 'year_built',
-                f"MainContent_ctl0{self.row}_lblBldArea" : 'building_area',
-                f"MainContent_ctl0{self.row}_lblRcn" : 'replacement_cost',
-                f"MainContent_ctl0{self.row}_lblRcnld" : "less_depreciation"
-            }
-        
-        if self.table_tag:
-            self.table_tag = self.table_tag.format(str(self.row))
-        else:
-            self.table_tag = f"MainContent_ctl0{self.row}_grdCns"
-
-        super().__post_init__()
-
-@dataclass(kw_only=True)
-class Ownership(Table):
-
-    table_tag: str = field(default="MainContent_grdHistoryValuesAppr")
-    money_fields: List[str] = field(default_factory=lambda: ['sale_price'])
-
-@dataclass(kw_only=True)
-class Appraisal(Table):
+def table_rows(table):
+
+    # walks a history table once and returns one dict per data row, so
+    # callers building every row don't re-scan the table for each one.
+    keys = []
+    rows = []
+    for i, tag in enumerate(table.find_all('tr')):
+        for th in tag.find_all('th'):
+            key = th.get_text(separator = ' ', strip = True)
+            keys.append(key.replace('&', 'and').lower().replace(' ', '_'))
+        if i > 0:
+            rows.append([td.get_text(separator = ' ').replace('&', 'and').lower() for td in tag.find_all('td')])
+
+    return [dict(zip(keys, values)) for values in rows]
+
+def table_details(table, table_dict=None):
+
+    # the label/value rows of a building's grdCns table, added to table_dict.
+    table_dict = {} if table_dict is None else table_dict
+    for tag in table.find_all('tr'):
+        cells = tag.find_all('td')
+        if len(cells) < 2:
+            continue
+        key = cells[0].get_text(separator = ' ', strip = True).lower()
+        value = cells[1].get_text(separator = ' ', strip = True)
+        table_dict.update({key.replace(' ','_').replace(':','') : value})
+
+    return table_dict
+
+class ChildRows:
+
+    # builds the building and history records of one parcel, one dict per
+    # row. What every row of the parcel shares, its pid, city and one
+    # timestamp, is set up once.
+
+    __slots__ = ('property_uuid', 'shared')
+
+    def __init__(self, pid, city, property_uuid, updated_at):
+        self.property_uuid = property_uuid
+        self.shared = {
+            'uuid': None,
+            'pid': pid,
+            'city': city,
+            'updated_at': updated_at
+        }
 
-    table_tag: str
-    money_fields: List[str] = field(default_factory=lambda:[
-        'improvements', 
-        'land', 
-        'total'
-        ]
-    )
+    def record(self, category, table_data, span_data=None):
+        record = {'property_uuid': self.property_uuid}
+        record.update(table_data)
+        record.update(self.shared)
+        if span_data:
+            record.update(span_data)
+        record['uuid'] = row_uuid(category, self.shared['city'], self.shared['pid'], record)
+        return record
 
 @dataclass(kw_only=True)
 class Property(Base):
 
-    money_fields: List[str] = field(default_factory=lambda:[
-        'sale_price', 
-        'assesment_value', 
-        'appraisal_value', 
-        'land_assessed_value', 
-        'land_appraised_value'
-        ]
-    )
+    category: ClassVar[str] = 'property'
+
     city: str = field(default='newhaven')
     state: str = field(default='ct')
     ownership: List = field(default_factory=lambda: [])
@@ -254,6 +163,19 @@ class Property(Base):
     url: str = field(default=None)
     city_url: str = field(default=None)
     soup: BeautifulSoup = field(default = None)
+    session: requests.Session = field(default=None, repr=False)
+    timeout: tuple = field(default=__request_timeout__)
+    parser: str = field(default='html.parser')
+    content: bytes = field(default=None, repr=False)
+    # seconds spent on each part of the page and the sections that failed to
+    # load, for vgsi_metrics. Kept on the parcel so they come back from the
+    # parse processes with it.
+    timings: Dict = field(default_factory=lambda: {}, repr=False)
+    failures: List = field(default_factory=lambda: [], repr=False)
+    # what the layout's extraction plan found on the page, dropped with the
+    # soup once the sections are loaded.
+    extraction: object = field(default=None, repr=False)
+    rows: ChildRows = field(default=None, repr=False)
     tag_mapping: Dict = field(default_factory=lambda: {
             "MainContent_lblPid": "pid",
             "MainContent_lblAcctNum": "account_number",
@@ -291,139 +213,91 @@ class Property(Base):
     assesment_table_tag: str = field(default='MainContent_grdHistoryValuesAsmt')
     building_table_tag: str = field(default="MainContent_ctl0{}_grdCns")
 
-    def add_building(self, bid):
-
-        # sys.stdout.write(f'Adding building {bid} to property {self.pid}. \n')s
-        building = Building(
-            pid=self.pid, 
-            property_uuid=self.uuid, 
-            row=bid,
-            soup=self.soup,
-            table_tag=self.building_table_tag
-        )
+    def add_building(self, bid, span_data, table):
+        table_data = table_details(table, {'bid': bid})
+        self.buildings.append(self.rows.record('building', table_data, span_data))
 
-        self.buildings.append(building.data)
-
-    def add_ownership(self, row):
-
-        # sys.stdout.write(f'Adding property ownership to property {self.pid}. \r')
-        owner = Ownership(
-            pid=self.pid, 
-            property_uuid=self.uuid, 
-            row=row, 
-            soup=self.soup,
-            table_tag=self.ownership_table_tag
-        )
-
-        self.ownership.append(owner.data)
-    
-    def add_assesment(self, row):
-
-        # sys.stdout.write(f'Adding property assesments to property {self.pid}. \r')
-        assesment = Appraisal(
-            pid=self.pid, 
-            property_uuid=self.uuid, 
-            row=row, 
-            soup=self.soup,
-            table_tag=self.assesment_table_tag
-        )
+    def add_ownership(self, row_data):
+        self.ownership.append(self.rows.record('ownership', row_data))
     
-        self.assesments.append(assesment.data)
+    def add_assesment(self, row_data):
+        self.assesments.append(self.rows.record('assesment', row_data))
 
-    def add_appraisal(self, row):
-
-        # sys.stdout.write(f'Adding appraisals assesments to property {self.pid}. \r')
-        appraisal = Appraisal(
-            pid=self.pid, 
-            property_uuid=self.uuid, 
-            row=row, 
-            soup=self.soup,
-            table_tag=self.appraisal_table_tag
-        )
-
-        self.appraisals.append(appraisal.data)
+    def add_appraisal(self, row_data):
+        self.appraisals.append(self.rows.record('appraisal', row_data))
 
     def load_assesment(self):
-        try:
-            assesments_count = len(self.soup.find('table', id=self.assesment_table_tag).find_all('tr')) - 1
-            # print(f"Assesment count {assesments_count}")
-            for row in range(0, assesments_count):
-                self.add_assesment(row)
-                
-        except KeyError:
+        table = self.extraction.tables.get(self.assesment_table_tag)
+        if table is None:
             raise Warning(
                 """
                 Null assesments history.
                 """
             )
+        for row_data in table_rows(table):
+            self.add_assesment(row_data)
 
     def load_appraisal(self):
-        try:
-            appraisal_count = len(self.soup.find('table', id=self.appraisal_table_tag).find_all('tr')) - 1
-            for row in range(0, appraisal_count):
-                self.add_appraisal(row)
-                
-        except KeyError:
+        table = self.extraction.tables.get(self.appraisal_table_tag)
+        if table is None:
             raise Warning(
                 """
                 Null appraisal history.
                 """
             )
+        for row_data in table_rows(table):
+            self.add_appraisal(row_data)
 
     def load_ownership(self):
-        try:
-            ownership_count = len(self.soup.find('table', id=self.ownership_table_tag).find_all('tr')) - 1
-            for row in range(0, ownership_count):
-                self.add_ownership(row)
-                
-        except KeyError:
+        table = self.extraction.tables.get(self.ownership_table_tag)
+        if table is None:
             raise Warning(
                 """
                 Null ownership history.
                 """
             )
+        for row_data in table_rows(table):
+            self.add_ownership(row_data)
 
     def load_buildings(self):
-        try:
-            building_count = self.handle_int(self.data['building_count'])
-            for bid in range(0, building_count+3):
-                try:
-                    self.add_building(bid)
-                except:
-                    pass
-                
-        except KeyError:
+
+        # the building blocks the extraction plan found on the page, however
+        # many there are.
+        if 'building_count' not in self.data:
             raise Warning(
                 """
                 Null building count.
                 """
             )
+        for bid, (span_data, table) in self.extraction.buildings.items():
+            self.add_building(bid, span_data, table)
     
     def load_all(self):
 
-        # sys.stdout.write(f'Adding all subclasses to property {self.pid}. \r')
-        try:
-            self.load_buildings()
-        except:
-            print("Could not load buildings.")
-        try:
-            self.load_assesment()
-        except:
-            print("Could not load assesments.")
-        try:
-            self.load_appraisal()
-        except:
-            print("Could not load appraisals")
-        try:
-            self.load_ownership()
-        except:
-            print("Could not load ownership.")
+        sections = [
+            ('buildings', self.load_buildings),
+            ('assesment', self.load_assesment),
+            ('appraisal', self.load_appraisal),
+            ('ownership', self.load_ownership)
+        ]
+        for section, load in sections:
+            start = time.perf_counter()
+            try:
+                load()
+            except Exception as e:
+                print(f"Could not load {section} of property {self.pid}: {str(e).strip()}")
+                self.failures.append(section)
+            self.timings[section] = time.perf_counter() - start
 
         del self.soup
+        self.extraction = None
+        self.span_data = None
+        self.rows = None
 
     def __post_init__(self):
 
         url = parse_url(self.url)
+        http = self.session or requests
         if self.pid is None:
             match = re.search(r'(pid=)([\d]+)', str(url.query))
             if match:
@@ -438,26 +312,39 @@ class Property(Base):
                     ex: (url='https://gis.vgsi.com/newhavenct/Parcel.aspx?pid=82')
                     """
                 )
-            page = requests.get(str(url), verify=False)
+            page_url = str(url)
         else:
-            page = requests.get(str(url) + 'Parcel.aspx?pid=' + str(self.pid) , verify=False)
+            page_url = str(url) + 'Parcel.aspx?pid=' + str(self.pid)
+
+        # pages handed in as content (e.g. replayed from the raw archive) are
+        # parsed without touching the network.
+        content = self.content
+        if content is None:
+            page = http.get(page_url, verify=False, timeout=self.timeout)
+            page.raise_for_status()
+            content = page.content
+        self.content = None
         
-        soup = BeautifulSoup(page.content, "html.parser")
+        start = time.perf_counter()
+        soup, action = parse_page(content, self.parser)
+        self.timings['page'] = time.perf_counter() - start
         self.soup = soup
         self.url = url
         
-        try:
-            if self.soup.find(id="form1")['action'] == __end_section__:
-                raise InvalidPIDException(
-                    """
-                    PID doesn't return housing data.
-                    """
-                )
-        except AttributeError:
-                raise InvalidPIDException(
-                    """
-                    PID doesn't return housing data.
-                    """
-                )
+        if action is None or action == __end_section__:
+            raise InvalidPIDException(
+                """
+                PID doesn't return housing data.
+                """
+            )
         
-        super().__post_init__()
\ No newline at end of file
+        start = time.perf_counter()
+        plan = plan_for(
+            self.tag_mapping,
+            (self.ownership_table_tag, self.appraisal_table_tag, self.assesment_table_tag)
+        )
+        self.extraction = plan.extract(soup)
+        self.span_data = self.extraction.spans
+        super().__post_init__()
+        self.rows = ChildRows(self.pid, self.city, self.uuid, self.updated_at)
+        self.timings['spans'] = time.perf_counter() - start
\ No newline at end of file
@@ -0,0 +1,109 @@
+import html
+import re
+from bs4 import BeautifulSoup, SoupStrainer
+
+PARSERS = ('html.parser', 'lxml', 'selectolax')
+
+# everything the records are built from has one of these ids: the mapped
+# spans, the MainContent_grd* history tables and the MainContent_ctlNN_*
+# building blocks. The targeted backends skip the rest of the page.
+_TARGET_IDS_ = re.compile(r'^(lblTownName|MainContent_\w+)$')
+_TARGET_TAGS_ = ['span', 'table']
+
+_FORM_ = re.compile(rb'<form\b[^>]*\bid\s*=\s*["\']?form1\b[^>]*>', re.I)
+_ACTION_ = re.compile(rb'\baction\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.I)
+
+def form_action(content):
+
+    # the targeted backends never build the form element, so its action is
+    # read straight from the raw page.
+    form = _FORM_.search(content)
+    if not form:
+        return None
+
+    action = _ACTION_.search(form.group(0))
+    if not action:
+        return None
+
+    value = next(group for group in action.groups() if group is not None)
+    return html.unescape(value.decode('utf-8', errors='replace'))
+
+def parse_page(content, parser='html.parser'):
+
+    # returns the parsed page and the action of form1, which tells valid
+    # parcels apart from the error page.
+    if parser == 'html.parser':
+        soup = BeautifulSoup(content, "html.parser")
+        form = soup.find(id="form1")
+        return soup, form.get('action') if form else None
+
+    if parser == 'lxml':
+        strainer = SoupStrainer(_TARGET_TAGS_, id=_TARGET_IDS_)
+        return BeautifulSoup(content, "lxml", parse_only=strainer), form_action(content)
+
+    if parser == 'selectolax':
+        try:
+            from selectolax.lexbor import LexborHTMLParser
+        except ImportError:
+            raise ImportError(
+                """
+                The selectolax parser needs the selectolax package (pip install selectolax).
+                """
+            )
+        return SelectolaxNode(LexborHTMLParser(content).root), form_action(content)
+
+    raise ValueError(f"Unknown parser {parser}, expected one of {PARSERS}.")
+
+class SelectolaxNode:
+
+    # the small part of the BeautifulSoup Tag api that vgsi_objects uses,
+    # backed by a selectolax node.
+
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    def __getitem__(self, key):
+        value = self.node.attributes.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self.node.attributes.get(key)
+        return default if value is None else value
+
+    @property
+    def name(self):
+        return self.node.tag
+
+    def _selector(self, name, id):
+
+        # name can be a list of tag names and id=True matches any id, like
+        # in bs4.
+        names = name if isinstance(name, (list, tuple)) else [name or '*']
+        if id is True:
+            condition = '[id]'
+        elif id is not None:
+            condition = f'[id="{id}"]'
+        else:
+            condition = ''
+        return ', '.join(n + condition for n in names)
+
+    def find(self, name=None, id=None):
+        node = self.node.css_first(self._selector(name, id))
+        return SelectolaxNode(node) if node is not None else None
+
+    def find_all(self, name=None, id=None):
+        return [SelectolaxNode(node) for node in self.node.css(self._selector(name, id))]
+
+    def get_text(self, separator='', strip=False):
+
+        # same joining rules as bs4: every text node, stripped and dropped
+        # when empty if strip is set.
+        strings = (n.text_content for n in self.node.traverse(include_text=True) if n.tag == '-text')
+        if strip:
+            strings = (s.strip() for s in strings)
+            strings = (s for s in strings if s)
+        return separator.join(strings)
@@ -0,0 +1,149 @@
+import asyncio
+import queue
+import threading
+from collections import deque
+from .vgsi_objects import InvalidPIDException, __end_section__
+from .vgsi_fetch import fetch_raw
+from .vgsi_parsers import form_action
+
+# a live scan split in three stages, each with its own parallelism:
+#
+#   fetch  scan_pids keeps `concurrency` requests in flight on threads and
+#          only hands on the raw pages.
+#   parse  parse_pages keeps `window` pages in a process pool, so parsing
+#          uses every core instead of sharing one with the sockets.
+#   write  SinkWriter feeds the sink from its own thread.
+#
+# Every stage only pulls from the one before when it has room, so a slow
+# stage holds the others back instead of piling pages up in memory.
+
+def fetch_valid_page(url, pid, **kwargs):
+
+    # fetch_raw, with the error page raised here (from the form action, the
+    # page isn't parsed) so it never goes to the parse stage.
+    page = fetch_raw(url, pid, **kwargs)
+    if page is not None and page.status_code != 304:
+        action = form_action(page.content)
+        if action is None or action == __end_section__:
+            raise InvalidPIDException(
+                """
+                PID doesn't return housing data.
+                """
+            )
+    return page
+
+async def parse_pages(results, parse, window, executor, parsed=None):
+
+    # takes the (pid, page, error) of the fetch stage and yields
+    # (pid, property, error) in the same order, with parse(pid, content)
+    # running on executor for up to `window` pages at a time. parsed(pid,
+    # page) is called for every page that parsed.
+    pending = deque()
+    results = aiter(results)
+    exhausted = False
+
+    async def fill():
+        nonlocal exhausted
+        while not exhausted and len(pending) < window:
+            try:
+                pid, page, error = await anext(results)
+            except StopAsyncIteration:
+                exhausted = True
+                return
+            future = None
+            if page is not None:
+                future = asyncio.wrap_future(executor.submit(parse, pid, page.content))
+            pending.append((pid, page, future, error))
+
+    try:
+        await fill()
+        while pending:
+            pid, page, future, error = pending.popleft()
+            p = None
+            if future is not None:
+                try:
+                    p = await future
+                except Exception as e:
+                    error = e
+                else:
+                    if parsed is not None:
+                        parsed(pid, page)
+            await fill()
+            yield pid, p, error
+    finally:
+        for _, _, future, _ in pending:
+            if future is not None:
+                future.cancel()
+        await results.aclose()
+
+class SinkWriter:
+
+    # runs a sink on a thread of its own behind a queue of at most maxsize
+    # parcels. add() only blocks when the queue is full. With a checkpoint
+    # the writer saves it whenever the sink flushes, like _CityScan does
+    # for a sink it writes to itself. remove() goes through the same queue,
+    # so the sink sees parcels and removed pids in scan order, and so does
+    # stop_checkpoints().
+
+    _DONE_ = object()
+
+    def __init__(self, sink, checkpoint=None, maxsize=100):
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE_:
+                return
+            if self._error is not None:
+                continue
+            method, value = item
+            if method == 'stop_checkpoints':
+                self.checkpoint = None
+                continue
+            try:
+                flushed = getattr(self.sink, method)(value)
+                if flushed and method == 'add' and self.checkpoint is not None:
+                    self.checkpoint.save(value.pid, 0, self.sink.state())
+            except Exception as e:
+                self._error = e
+
+    def _raise(self):
+        if self._error is not None:
+            raise self._error
+
+    def add(self, p):
+
+        # always False, flushes happen later on the writer thread.
+        self._raise()
+        self._queue.put(('add', p))
+        return False
+
+    def remove(self, pid):
+        self._raise()
+        if hasattr(self.sink, 'remove'):
+            self._queue.put(('remove', pid))
+
+    def stop_checkpoints(self):
+
+        # parcels added after this leave the checkpoint alone, e.g. the
+        # retried pids behind it at the end of a scan.
+        self._raise()
+        self._queue.put(('stop_checkpoints', None))
+
+    def state(self):
+        return self.sink.state()
+
+    def restore(self, state):
+        self.sink.restore(state)
+
+    def close(self):
+        self._queue.put(self._DONE_)
+        self._thread.join()
+        self._raise()
+        return self.sink.close()
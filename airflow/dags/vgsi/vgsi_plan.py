@@ -0,0 +1,99 @@
+import math
+
+# a town whose profile doesn't say how slow it is counts as this slow, and
+# one whose size is unknown as this many pids, so new towns start early.
+DEFAULT_LATENCY_MS = 500
+DEFAULT_PIDS = 50000
+
+def _profile_ranges(profile, shard_size):
+
+    # pid ranges of about shard_size parcels each, from the probed range and
+    # density, for towns the PIDIndex doesn't know yet.
+    pid_max = profile.get('pid_max')
+    density = profile.get('density')
+    if not pid_max or not density:
+        return [(1, None)]
+
+    count = math.ceil(pid_max * density / shard_size)
+    width = math.ceil(pid_max / count)
+    return [(1 + i * width, (i + 1) * width if i < count - 1 else None) for i in range(count)]
+
+# shards get the concurrency that fetches them in about this long, up to
+# plan_shards' concurrency.
+SHARD_SECONDS = 900
+
+def _latency(profile):
+    return (profile.get('latency_ms') or DEFAULT_LATENCY_MS) / 1000
+
+def _requests(shard, profile, known=None):
+
+    # the requests a shard makes: its known pids, or every pid of its range.
+    # A sparse town's range holds fewer parcels per pid, so its shards, cut
+    # to shard_size parcels by density, make more requests.
+    if known:
+        return known + (shard['null_pages_seq'] or 0)
+    if shard['null_pages_seq'] is None:
+        return shard['pid_max'] - shard['pid_min'] + 1
+    top = profile.get('pid_max') or DEFAULT_PIDS
+    return max(top - shard['pid_min'] + 1, 0) + shard['null_pages_seq']
+
+def shard_concurrency(shard, profile=None, known=None, concurrency=8):
+
+    # requests in flight for the shard to take about SHARD_SECONDS at the
+    # town's latency, between 1 and concurrency. Small, quick shards don't
+    # hold connections they have no use for.
+    profile = profile or {}
+    wanted = math.ceil(_requests(shard, profile, known) * _latency(profile) / SHARD_SECONDS)
+    return min(max(wanted, 1), concurrency)
+
+def estimated_seconds(shard, profile=None, known=None):
+
+    # requests the shard will make times the town's latency, spread over its
+    # concurrency. Only good for ordering shards against each other.
+    profile = profile or {}
+    return _requests(shard, profile, known) * _latency(profile) / max(shard['concurrency'], 1)
+
+def plan_shards(cities, pid_index=None, shard_size=20000, concurrency=8, null_pages_seq=10, pid_max=1000000):
+
+    # one task per city, or per pid shard for cities whose PIDIndex holds more
+    # than shard_size known pids. Every shard but the last is bounded by the
+    # next shard's first known pid and runs without the stop rule, since a
+    # gap inside a town's range must not end it early. The last one walks
+    # past the largest known pid until null_pages_seq empty pages in a row.
+    #
+    # Towns the PIDIndex doesn't know yet are split the same way from their
+    # profile (see vgsi_catalog), if they have one. The shards come back
+    # longest first, so the large and slow towns are not the ones left
+    # running at the end of a statewide run. Each shard gets the concurrency
+    # its work and the town's latency call for, up to `concurrency`.
+    planned = []
+
+    for city, info in cities.items():
+        profile = info.get('profile') or {}
+        known = pid_index.pids(city) if pid_index is not None else []
+
+        if known:
+            chunks = [known[i:i + shard_size] for i in range(0, len(known), shard_size)]
+            ranges = [
+                (1 if n == 0 else chunk[0], None if n == len(chunks) - 1 else chunks[n + 1][0] - 1)
+                for n, chunk in enumerate(chunks)
+            ]
+            counts = [len(chunk) for chunk in chunks]
+        else:
+            ranges = _profile_ranges(profile, shard_size)
+            counts = [None] * len(ranges)
+
+        for n, ((low, high), count) in enumerate(zip(ranges, counts)):
+            shard = {
+                'city': city,
+                'base_url': info['url'],
+                'shard': n,
+                'pid_min': low,
+                'pid_max': pid_max if high is None else high,
+                'null_pages_seq': null_pages_seq if high is None else None
+            }
+            shard['concurrency'] = shard_concurrency(shard, profile, count, concurrency)
+            planned.append((estimated_seconds(shard, profile, count), shard))
+
+    planned.sort(key=lambda item: item[0], reverse=True)
+    return [shard for _, shard in planned]
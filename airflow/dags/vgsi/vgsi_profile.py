@@ -0,0 +1,303 @@
+import cProfile
+import functools
+import importlib
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# opt-in profiling of a scrape, for finding the hot spots of real pages
+# without a debugger:
+#
+#   FunctionTimer  calls and wall time of named functions, patched in place
+#                  while it runs, and with memory=True the peak allocations
+#                  of each stage (tracemalloc)
+#   Sampler        a statistical profiler, takes the stack of every thread
+#                  every `interval` seconds
+#   ThreadProfiler cProfile, for the scan's threads too
+#   profiled()     runs a block under them and reports
+#
+# All of them only see the process they run in, not the parse processes of
+# a scan with workers.
+
+# what FunctionTimer patches: module:qualified name, in the module the scan
+# looks it up in. A function imported by name into several modules is
+# patched in each of them and timed as one. The record builders and
+# coercers, and the stages a page goes through, which the tracemalloc peaks
+# are kept for.
+STAGES = (
+    'vgsi.vgsi_fetch:fetch_page',
+    'vgsi.vgsi_objects:parse_page',
+    'vgsi.vgsi_extract:ExtractionPlan.extract',
+    'vgsi.vgsi_objects:Property.load_buildings',
+    'vgsi.vgsi_objects:Property.load_assesment',
+    'vgsi.vgsi_objects:Property.load_appraisal',
+    'vgsi.vgsi_objects:Property.load_ownership',
+    'vgsi.vgsi_writer:property_records',
+    'vgsi.vgsi_utils:property_records',
+    'vgsi.vgsi_cdc:property_records',
+    'vgsi.vgsi_writer:to_table',
+    'vgsi.vgsi_writer:to_frame'
+)
+
+TIMED = STAGES + (
+    'vgsi.vgsi_objects:table_rows',
+    'vgsi.vgsi_objects:table_details',
+    'vgsi.vgsi_objects:ChildRows.record',
+    'vgsi.vgsi_schema:coerce_column'
+)
+
+def _resolve(target):
+
+    # (owner, attribute, name) of a module:qualified name target.
+    module_name, _, name = target.partition(':')
+    owner = importlib.import_module(module_name)
+    *parents, attribute = name.split('.')
+    for parent in parents:
+        owner = getattr(owner, parent)
+    return owner, attribute, name
+
+class FunctionTimer:
+
+    # stats are {name: [calls, seconds, peak bytes, top allocations]}. Times
+    # include the timed functions a function calls. A stage's peak is the
+    # most its calls allocated on top of what was allocated when they
+    # started, and its top allocations the lines the largest one left
+    # allocated when it returned (its result, not its temporaries). A
+    # stage called from another stage is only timed, and with several scan
+    # threads the peaks overlap, they are exact with concurrency 1.
+
+    def __init__(self, targets=TIMED, stages=STAGES, memory=False, top=5):
+        self.targets = targets
+        self.stages = {_resolve(target)[2] for target in stages} if memory else set()
+        self.top = top
+        self.stats = {}
+        self._patched = []
+        self._tracing = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _wrap(self, name, function):
+
+        stage = name in self.stages
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            measure = stage and not getattr(self._local, 'in_stage', False)
+            if measure:
+                self._local.in_stage = True
+                before = tracemalloc.take_snapshot()
+                base = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] - base if measure else 0
+                with self._lock:
+                    stats = self.stats[name]
+                    stats[0] += 1
+                    stats[1] += seconds
+                    largest = peak > stats[2]
+                    stats[2] = max(stats[2], peak)
+                if measure:
+                    if largest:
+                        # what the call left allocated, without the
+                        # snapshots themselves.
+                        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+                        after = tracemalloc.take_snapshot().filter_traces(ignore)
+                        diffs = after.compare_to(before.filter_traces(ignore), 'lineno')
+                        stats[3] = sorted((diff for diff in diffs if diff.size_diff > 0), key=lambda diff: -diff.size_diff)[:self.top]
+                    self._local.in_stage = False
+
+        return timed
+
+    def start(self):
+        if self.stages and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        for target in self.targets:
+            owner, attribute, name = _resolve(target)
+            original = owner.__dict__[attribute]
+            if isinstance(original, staticmethod):
+                wrapped = staticmethod(self._wrap(name, original.__func__))
+            else:
+                wrapped = self._wrap(name, original)
+            self.stats.setdefault(name, [0, 0.0, 0, []])
+            setattr(owner, attribute, wrapped)
+            self._patched.append((owner, attribute, original))
+
+    def stop(self):
+        for owner, attribute, original in reversed(self._patched):
+            setattr(owner, attribute, original)
+        self._patched = []
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def report(self, stream=sys.stderr):
+
+        stream.write(f"{'function':<32} {'calls':>8} {'total ms':>10} {'mean us':>9}" + (f" {'peak KiB':>9}" if self.stages else '') + "\n")
+        for name, (calls, seconds, peak, _) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            line = f"{name:<32} {calls:>8} {seconds * 1000:>10.1f} {seconds / calls * 1e6 if calls else 0:>9.1f}"
+            if self.stages:
+                line += f" {peak / 1024:>9.1f}" if name in self.stages else f" {'':>9}"
+            stream.write(line + "\n")
+
+        for name in sorted(self.stages):
+            top = self.stats[name][3]
+            if top:
+                stream.write(f"\nlargest {name} call allocated:\n")
+                for diff in top:
+                    stream.write(f"  {diff.size_diff / 1024:9.1f} KiB  {diff.traceback}\n")
+
+class Sampler:
+
+    # every `interval` seconds a thread of its own takes the stack of every
+    # other thread. Threads waiting on a lock or a socket are sampled too,
+    # so waits show up next to the work. collapsed() has one
+    # "frame;frame;frame count" line per stack, which flamegraph.pl and
+    # speedscope read.
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, stream=sys.stderr, limit=25):
+
+        # samples a function was on top of the stack (self) and anywhere in
+        # it (total).
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = sum(self.stacks.values()) or 1
+
+        stream.write(f"{'self %':>7} {'total %':>7}  function ({samples} samples)\n")
+        for frame, count in own.most_common(limit):
+            stream.write(f"{count / samples * 100:>7.1f} {total[frame] / samples * 100:>7.1f}  {frame}\n")
+
+class ThreadProfiler:
+
+    # cProfile for every thread: the one that starts it and each thread
+    # started after (the scan's fetch threads), merged by stats(). Up to
+    # Python 3.11 that is a profiler per thread. From 3.12 cProfile is a
+    # sys.monitoring tool, only one can be active in a process and it sees
+    # every thread, so a single one is enabled; calls that overlap on
+    # several threads can then be charged to each other, the sampler
+    # separates them.
+
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, frame, event, arg):
+        # the first event of a new thread swaps this hook for a profiler.
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if not self.PER_THREAD:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                raise RuntimeError(f"cannot profile with cProfile while another profiler is active ({e}), use --profile sample") from e
+            self.profiles.append(profile)
+            return
+        threading.setprofile(self._start_thread)
+        self._start_thread(None, None, None)
+
+    def stop(self):
+        if self.PER_THREAD:
+            threading.setprofile(None)
+        self.profiles[0].disable()
+
+    def stats(self, stream=sys.stderr):
+        with self._lock:
+            stats = pstats.Stats(self.profiles[0], stream=stream)
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        return stats
+
+@contextmanager
+def profiled(profile=None, out=None, timings=False, memory=False, interval=0.005, stream=sys.stderr):
+
+    # profile is 'cprofile' or 'sample'. cProfile stats go to out (or
+    # vgsi.prof) for pstats or snakeviz, sampled stacks to out (or
+    # vgsi.collapsed). timings times TIMED, memory adds the stage peaks.
+    timer = FunctionTimer(memory=memory) if timings or memory else None
+    profiler = ThreadProfiler() if profile == 'cprofile' else None
+    sampler = Sampler(interval) if profile == 'sample' else None
+
+    if timer is not None:
+        timer.start()
+    if sampler is not None:
+        sampler.start()
+    if profiler is not None:
+        profiler.start()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if sampler is not None:
+            sampler.stop()
+        if timer is not None:
+            timer.stop()
+
+        if profiler is not None:
+            out = out or 'vgsi.prof'
+            stats = profiler.stats(stream)
+            stats.dump_stats(out)
+            threads = f"{len(profiler.profiles)} threads" if profiler.PER_THREAD else "all threads"
+            stream.write(f"\ncProfile stats of {threads} written to {out}, top functions by internal time:\n")
+            stats.sort_stats('tottime').print_stats(25)
+        if sampler is not None:
+            out = out or 'vgsi.collapsed'
+            with open(out, 'w') as f:
+                f.write(sampler.collapsed())
+            stream.write(f"\nsampled stacks written to {out}:\n")
+            sampler.report(stream)
+        if timer is not None:
+            stream.write("\n")
+            timer.report(stream)
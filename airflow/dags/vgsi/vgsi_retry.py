@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from .vgsi_store import SqliteStore
+
+# a pid that failed this many times in a row is parked: drains only try it
+# again once PARKED_WAIT has passed since its last failure, a wait that
+# doubles with every further failure up to MAX_PARKED_WAIT. It is never
+# dropped, a pid behind the frontier that the pid index does not hold is
+# only ever fetched from the queue.
+MAX_ATTEMPTS = 8
+PARKED_WAIT = timedelta(days=1)
+MAX_PARKED_WAIT = timedelta(days=32)
+
+# this many pids in a row failing with anything but the error page means the
+# town is down or turning the scan away, not that its parcels are missing.
+MAX_FAILURES_SEQ = 50
+
+class TooManyFailuresException(Exception):
+    # raised by a scan that hit max_failures_seq failures in a row. The
+    # failed pids are in the retry queue and the checkpoint holds what was
+    # written, so a retry of the task resumes from there.
+    pass
+
+@dataclass
+class RetryOptions:
+
+    # how a scan deals with its failed pids: `rounds` drains of the retry
+    # queue at the end, `backoff` seconds before the first and doubling,
+    # and max_failures_seq failures in a row (None for no limit) abort it.
+    rounds: int = 2
+    backoff: float = 10
+    max_failures_seq: int | None = MAX_FAILURES_SEQ
+
+class RetryQueue(SqliteStore):
+
+    # pids whose last fetch or parse failed for any other reason than the
+    # error page (see vgsi_fetch.classify_error), per city, with the class
+    # and text of the error and how often in a row they failed. load_city
+    # drains it at the end of a scan.
+    #
+    # Failures are written as they happen, so a run that dies still leaves
+    # them to the next one. A pid that went through is only staged, and
+    # taken off by commit(), like the other stores.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS failed_pids (
+            city TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            error TEXT,
+            attempts INTEGER NOT NULL,
+            failed_at TEXT,
+            PRIMARY KEY (city, pid)
+        )
+        """
+
+    def _load(self, city):
+        # {pid: (attempts, failed_at)}
+        rows = self._conn.execute("SELECT pid, attempts, failed_at FROM failed_pids WHERE city = ?", (city,))
+        return {pid: (attempts, datetime.fromisoformat(failed_at)) for pid, attempts, failed_at in rows}
+
+    def add(self, city, pid, reason, error=None):
+
+        attempts = self._city(city).get(pid, (0, None))[0] + 1
+        failed_at = datetime.now().replace(microsecond=0)
+        with self._lock:
+            self._cities[city][pid] = (attempts, failed_at)
+            self._staged.pop((city, pid), None)
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO failed_pids (city, pid, reason, error, attempts, failed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (city, pid, reason, str(error)[:500] if error is not None else None, attempts, failed_at.isoformat())
+            )
+            self._conn.commit()
+
+    def resolve(self, city, pid):
+
+        # the pid went through (or turned out to be empty).
+        if pid in self._city(city):
+            self._stage(city, pid, True)
+
+    def _queued(self, city, pid_min, pid_max):
+        return [
+            (pid, attempts, failed_at) for pid, (attempts, failed_at) in sorted(self._city(city).items())
+            if pid >= pid_min and (pid_max is None or pid <= pid_max) and (city, pid) not in self._staged
+        ]
+
+    def pids(self, city, pid_min=1, pid_max=None, max_attempts=MAX_ATTEMPTS, now=None):
+
+        # the queued pids of a city between pid_min and pid_max that are due,
+        # in order: those that failed fewer than max_attempts times, and the
+        # parked ones whose wait is over.
+        now = now or datetime.now()
+        return [
+            pid for pid, attempts, failed_at in self._queued(city, pid_min, pid_max)
+            if attempts < max_attempts
+            or now - failed_at >= min(PARKED_WAIT * 2 ** (attempts - max_attempts), MAX_PARKED_WAIT)
+        ]
+
+    def parked(self, city, pid_min=1, pid_max=None, max_attempts=MAX_ATTEMPTS):
+        # the queued pids that failed max_attempts times or more, due or not.
+        return [pid for pid, attempts, _ in self._queued(city, pid_min, pid_max) if attempts >= max_attempts]
+
+    def _write(self, staged):
+        self._conn.executemany("DELETE FROM failed_pids WHERE city = ? AND pid = ?", sorted(staged))
+        for city, pid in staged:
+            self._cities.get(city, {}).pop(pid, None)
@@ -0,0 +1,170 @@
+import pandas as pd
+import pyarrow as pa
+
+# the records come out of vgsi_objects as the raw strings of the page. They
+# are typed here, a whole column at a time, when a batch is written. Every
+# field has an arrow type and, for the typed ones, the rule that reads it
+# from the page text:
+#   money  "$1,234" -> 1234.0
+#   float  "0.12" -> 0.12
+#   int    "1907" -> 1907
+#   date   "05/12/2015" -> 2015-05-12
+# Text that doesn't read as its type, and blank text, becomes null.
+
+MONEY = 'money'
+FLOAT = 'float'
+INT = 'int'
+DATE = 'date'
+TIMESTAMP = 'timestamp'
+STRING = 'string'
+
+_TYPES_ = {
+    MONEY: pa.float64(),
+    FLOAT: pa.float64(),
+    INT: pa.int64(),
+    DATE: pa.date32(),
+    TIMESTAMP: pa.timestamp('us'),
+    STRING: pa.string()
+}
+
+_ROW_FIELDS_ = [
+    ('uuid', STRING),
+    ('pid', INT),
+    ('city', STRING),
+    ('property_uuid', STRING)
+]
+
+FIELDS = {
+    'property': [
+        ('uuid', STRING),
+        ('pid', INT),
+        ('city', STRING),
+        ('town_name', STRING),
+        ('address', STRING),
+        ('account_number', STRING),
+        ('owner', STRING),
+        ('owner_address', STRING),
+        ('co_owner', STRING),
+        ('sale_price', MONEY),
+        ('certificate', STRING),
+        ('sale_date', DATE),
+        ('book_page', STRING),
+        ('book_label', STRING),
+        ('book', STRING),
+        ('page_label', STRING),
+        ('page', STRING),
+        ('label_instrument', STRING),
+        ('assesment_value', MONEY),
+        ('appraisal_value', MONEY),
+        ('building_count', INT),
+        ('building_use', STRING),
+        ('land_alt_approved', STRING),
+        ('land_use_code', STRING),
+        ('land_zone', STRING),
+        ('land_neighborhood_code', STRING),
+        ('land_size_acres', FLOAT),
+        ('land_frontage', FLOAT),
+        ('land_depth', FLOAT),
+        ('land_assessed_value', MONEY),
+        ('land_appraised_value', MONEY),
+        ('updated_at', TIMESTAMP)
+    ],
+    # plus one string column per construction detail the town lists (style,
+    # grade, roof_cover, ...), which differ between towns.
+    'building': _ROW_FIELDS_ + [
+        ('bid', INT),
+        ('year_built', INT),
+        ('building_area', FLOAT),
+        ('replacement_cost', MONEY),
+        ('less_depreciation', MONEY),
+        ('updated_at', TIMESTAMP)
+    ],
+    'assesment': _ROW_FIELDS_ + [
+        ('valuation_year', INT),
+        ('improvements', MONEY),
+        ('land', MONEY),
+        ('total', MONEY),
+        ('updated_at', TIMESTAMP)
+    ],
+    'appraisal': _ROW_FIELDS_ + [
+        ('valuation_year', INT),
+        ('improvements', MONEY),
+        ('land', MONEY),
+        ('total', MONEY),
+        ('updated_at', TIMESTAMP)
+    ],
+    'ownership': _ROW_FIELDS_ + [
+        ('owner', STRING),
+        ('sale_price', MONEY),
+        ('certificate', STRING),
+        ('book_and_page', STRING),
+        ('instrument', STRING),
+        ('sale_date', DATE),
+        ('updated_at', TIMESTAMP)
+    ]
+}
+
+# what tells the rows of a parcel apart, for upserts and change sets.
+ROW_KEYS = {
+    'property': ['city', 'pid'],
+    'building': ['city', 'pid', 'bid'],
+    'assesment': ['city', 'pid', 'valuation_year'],
+    'appraisal': ['city', 'pid', 'valuation_year'],
+    'ownership': ['city', 'pid', 'owner', 'sale_date', 'book_and_page']
+}
+
+SCHEMAS = {
+    category: pa.schema([(name, _TYPES_[kind]) for name, kind in fields])
+    for category, fields in FIELDS.items()
+}
+
+def _text(column):
+
+    # stripped text with blanks as nulls, whatever the raw values were.
+    text = column.astype('string').str.strip()
+    return text.mask(text == '')
+
+def _number(column):
+    return pd.to_numeric(_text(column), errors='coerce')
+
+def coerce_column(column, kind):
+
+    if kind == MONEY:
+        return pd.to_numeric(_text(column).str.replace(r'[$,]', '', regex=True), errors='coerce')
+    if kind == FLOAT:
+        return _number(column)
+    if kind == INT:
+        number = _number(column)
+        return number.where(number % 1 == 0).astype('Int64')
+    if kind == DATE:
+        return pd.to_datetime(_text(column), format='%m/%d/%Y', errors='coerce')
+    if kind == TIMESTAMP:
+        return pd.to_datetime(column, errors='coerce')
+    return _text(column)
+
+def to_table(records, category):
+
+    # one arrow table for a batch of category records, with the category's
+    # fields in schema order followed by the columns it doesn't know, as
+    # strings.
+    frame = pd.DataFrame(records)
+    schema = SCHEMAS[category]
+    kinds = dict(FIELDS[category])
+    names = schema.names + [name for name in frame.columns if name not in kinds]
+
+    columns = []
+    fields = []
+    for name in names:
+        kind = kinds.get(name, STRING)
+        if name in frame.columns:
+            column = pa.array(coerce_column(frame[name], kind), from_pandas=True)
+            column = column.cast(_TYPES_[kind])
+        else:
+            column = pa.nulls(len(frame), _TYPES_[kind])
+        columns.append(column)
+        fields.append(pa.field(name, _TYPES_[kind]))
+
+    return pa.Table.from_arrays(columns, schema=pa.schema(fields))
+
+def to_frame(records, category):
+    return to_table(records, category).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
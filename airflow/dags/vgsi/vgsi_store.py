@@ -0,0 +1,90 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+
+def atomic_write(path, data):
+
+    # writes data (bytes) to a temp file next to path and moves it over it,
+    # so a reader never sees half of it and a crash mid-write leaves the
+    # previous one.
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+class SqliteStore:
+
+    # what scans keep between runs, per city, in a sqlite file that the
+    # parallel shard tasks of a statewide run share. A subclass gives its
+    # table (SCHEMA), what it keeps in memory of a city (_load) and how its
+    # staged changes are written (_write).
+    #
+    # A scan stages its changes in _staged, {(city, pid): value}, and only
+    # commit() writes them, which the caller runs once the scan's output is
+    # stored. A failed run therefore leaves the state as the last one that
+    # got through. save_staged() keeps the staged changes in a file, for a
+    # resumed scan or a later task to pick up with load_staged().
+
+    SCHEMA = None
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute(self.SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._cities = {}
+        self._staged = {}
+
+    def _load(self, city):
+        raise NotImplementedError
+
+    def _write(self, staged):
+        # runs holding the lock, before the transaction is committed.
+        raise NotImplementedError
+
+    def _city(self, city):
+
+        # each city is read once, lookups after that never touch sqlite.
+        with self._lock:
+            if city not in self._cities:
+                self._cities[city] = self._load(city)
+            return self._cities[city]
+
+    def _stage(self, city, pid, value):
+        with self._lock:
+            self._staged[(city, pid)] = value
+
+    def commit(self):
+
+        with self._lock:
+            staged, self._staged = self._staged, {}
+            self._write(staged)
+            self._conn.commit()
+
+    def save_staged(self, path):
+        with self._lock:
+            staged = pickle.dumps(self._staged)
+        atomic_write(path, staged)
+
+    def load_staged(self, path):
+
+        # stages what save_staged() kept, under what was staged since.
+        # False when there is no such file.
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            staged = pickle.load(f)
+        with self._lock:
+            self._staged = staged | self._staged
+        return True
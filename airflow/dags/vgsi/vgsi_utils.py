@@ -1,23 +1,40 @@
 import json
+import os
 from os import path
-import pandas as pd
 import sys
 import re
-import time
+import asyncio
 import requests
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing
+from dataclasses import dataclass, replace
+from datetime import date
+from functools import partial
+from itertools import chain
 from bs4 import BeautifulSoup
-from .vgsi_objects import Property, InvalidPIDException
+from .vgsi_fetch import INVALID, TRANSIENT, HTTP, PARSE, FetchOptions, classify_error, fetch_property, host_bucket, instance_limit, make_session, parse_property, scan_pids
+from .vgsi_pipeline import SinkWriter, fetch_valid_page, parse_pages
+from .vgsi_archive import RawArchive, replay_property
+from .vgsi_writer import DataFrameSink, property_records
+from .vgsi_checkpoint import Checkpoint
+from .vgsi_catalog import catalog_path
+from .vgsi_retry import RetryOptions, RetryQueue, TooManyFailuresException
+from .vgsi_incremental import FingerprintStore
+from .vgsi_index import PIDIndex
+from .vgsi_cdc import ChangeStore
+from .vgsi_store import SqliteStore
 
 _VGSIURL_ = "https://www.vgsi.com/connecticut-online-database/"
 
 def open_vgsi_cities(state='ct'):
-    path = f"vgsi_cities_{state}.json"
+    # next to the dags, wherever the caller runs from.
+    path = catalog_path(state)
     with open(path) as city_json:
         return json.load(city_json)
     
 def get_vgsi_cities(url=_VGSIURL_, state='ct'):
 
-    json_path = f"vgsi_cities_{state}.json"
+    json_path = catalog_path(state)
 
     if path.exists(json_path):
         sys.stdout.write(f"Will overwrite the json for {state}.\n")
@@ -46,21 +63,81 @@ def get_vgsi_cities(url=_VGSIURL_, state='ct'):
                 "city":city_row.get_text(),
                 "state":state,
                 "url": url,
-                "type": None
+                "type": "vgsi"
             }
-
-        city_dict[city]["type"] = "vgsi"
     
     with open(json_path, "w") as outfile:
         json.dump(city_dict, outfile, indent=4)
     sys.stdout.write(f"Loaded {json_path}.")
 
-def load_city(city='newhaven', base_url=None, pid_min=1, pid_max=1000000, null_pages_seq=10, delay_seconds=1):
-    property_list = []
-    building_list = []
-    assesment_list = []
-    appraisal_list = []
-    ownership_list = []
+@dataclass
+class ScanState:
+
+    # the stores a scan reads and stages its changes in, all optional.
+    # fingerprints (a FingerprintStore) only hands on parcels that changed
+    # since its last commit, pid_index (a PIDIndex) has the known pids
+    # fetched first, retry_queue (a RetryQueue, or its path) keeps the pids
+    # that failed and checkpoint (a Checkpoint, or its path) lets a re-run
+    # resume. changes is the ChangeStore of the scan's ChangeSink, if it has
+    # one, kept here to be saved and committed with the others.
+    #
+    # Nothing is written before the caller commits them, once the scan's
+    # output is stored. A caller that stores it in a later task, like the
+    # dag, saves the staged changes with stage() and commits them from there
+    # with commit_staged().
+    fingerprints: FingerprintStore | None = None
+    pid_index: PIDIndex | None = None
+    retry_queue: RetryQueue | str | None = None
+    checkpoint: Checkpoint | str | None = None
+    changes: ChangeStore | None = None
+
+    @classmethod
+    def open(cls, state_dir, checkpoint=None, incremental=True, changes=False):
+        # the stores a town's scans keep in state_dir.
+        return cls(
+            fingerprints=FingerprintStore(path.join(state_dir, "fingerprints.sqlite")) if incremental else None,
+            pid_index=PIDIndex(path.join(state_dir, "pid_index.sqlite")),
+            retry_queue=RetryQueue(path.join(state_dir, "retry_queue.sqlite")),
+            checkpoint=checkpoint,
+            changes=ChangeStore(path.join(state_dir, "changes.sqlite")) if changes else None
+        )
+
+    def stores(self):
+        # {name: store} of the stores that are open.
+        stores = {
+            'fingerprints': self.fingerprints,
+            'pid_index': self.pid_index,
+            'retry_queue': self.retry_queue,
+            'changes': self.changes
+        }
+        return {name: store for name, store in stores.items() if isinstance(store, SqliteStore)}
+
+    def commit(self):
+        for store in self.stores().values():
+            store.commit()
+
+    def stage(self, prefix):
+        for name, store in self.stores().items():
+            store.save_staged(f"{prefix}.{name}")
+
+    def commit_staged(self, prefix):
+
+        # commits what stage(prefix) saved, once. Returns the names of the
+        # stores committed.
+        committed = []
+        for name, store in self.stores().items():
+            staged = f"{prefix}.{name}"
+            if store.load_staged(staged):
+                store.commit()
+                os.remove(staged)
+                committed.append(name)
+        return committed
+
+def _with_legacy(options, **fields):
+    given = {name: value for name, value in fields.items() if value is not None}
+    return replace(options, **given) if given else options
+
+def load_city(city='newhaven', base_url=None, pid_min=1, pid_max=1000000, null_pages_seq=10, delay_seconds=None, concurrency=None, rate_limit=None, session=None, timeout=None, fetch_options=None, retry_options=None, state=None, parser='html.parser', archive=None, fetch_date=None, replay=False, workers=None, sink=None, write_queue=100, metrics=None, adaptive=None, retry_rounds=None, retry_backoff=None):
 
     if not base_url:
         city_json = open_vgsi_cities()
@@ -68,40 +145,307 @@ def load_city(city='newhaven', base_url=None, pid_min=1, pid_max=1000000, null_p
     else:
         vgsi_url = base_url
 
-    # if pid_min and pid_max:
-    #     for i in range (pid_min, pid_max+1):
-    #         try:
-    #             p = Property(url=vgsi_url, pid=i)
-    #             property_list.append(p.data)
-    #             building_list.extend(p.buildings)
-    #             assesment_list.extend(p.assesments)
-    #             appraisal_list.extend(p.appraisals)
-    #             ownership_list.extend(p.ownership)
-    #         except InvalidPIDException:
-    #             pass
-    # else:
+    # sink receives every parcel. By default a DataFrameSink that returns the
+    # five DataFrames, a ParquetSink streams them to disk in bounded batches
+    # and returns the file paths instead.
+    if sink is None:
+        sink = DataFrameSink()
+
+    # null_pages_seq=None turns the stop rule off, for pid ranges known to
+    # hold parcels up to pid_max.
+
+    # metrics (a vgsi_metrics.Metrics) collects fetch and parse timings and
+    # counts of what the scan found.
+
+    # fetch_options (FetchOptions) say how pages are fetched, retry_options
+    # (RetryOptions) how failed pids are retried and state (ScanState) which
+    # stores the scan uses, see each of them. Pids that fail for any other
+    # reason than the error page are drained from the retry queue at the end
+    # of the scan, whatever is still queued when the caller commits it is
+    # tried again by the next scan of the town.
+    #
+    # delay_seconds, concurrency, rate_limit, session, timeout and adaptive,
+    # and retry_rounds and retry_backoff, are the arguments load_city took
+    # before the options were grouped. When given they override the same
+    # field of fetch_options or retry_options.
+    fetch_options = _with_legacy(
+        fetch_options or FetchOptions(), delay_seconds=delay_seconds, concurrency=concurrency,
+        rate_limit=rate_limit, session=session, timeout=timeout, adaptive=adaptive
+    )
+    retry_options = _with_legacy(retry_options or RetryOptions(), rounds=retry_rounds, backoff=retry_backoff)
+    state = replace(state) if state is not None else ScanState()
+    if isinstance(state.retry_queue, str):
+        state.retry_queue = RetryQueue(state.retry_queue)
+
+    # archive is a RawArchive (or its root, a local path or gs:// url). Live
+    # scans store every page they fetch in it, replay scans rebuild the
+    # DataFrames from the pages archived on fetch_date (the latest one if not
+    # given) using every core and no network.
+    if isinstance(archive, str):
+        archive = RawArchive(archive)
+
+    if replay:
+        if archive is None:
+            raise Exception(
+                """
+                Replaying a city needs the archive its pages were stored in.
+                """
+            )
+        fetch_date = fetch_date or archive.fetch_dates(city)[-1]
+        pids = [pid for pid in archive.pids(city, fetch_date) if pid_min <= pid <= pid_max]
+        sys.stdout.write(f"Replaying {len(pids)} archived pages of {city} from {fetch_date}.\n")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fetch = partial(replay_property, archive, city, fetch_date, vgsi_url, parser=parser)
+            # twice the workers in flight keeps every core busy while results
+            # are collected in pid order.
+            results = scan_pids(fetch, pids, 2 * (workers or os.cpu_count() or 1), executor=executor)
+            return asyncio.run(_CityScan(sink, metrics=metrics).run(results, null_pages_seq))
+
+    # rate_limit is requests per second against the city's host. When it is
+    # not given it falls back to the old one request every delay_seconds.
+    concurrency = fetch_options.concurrency
+    rate_limit = fetch_options.rate_limit
+    if rate_limit is None and fetch_options.delay_seconds:
+        rate_limit = 1 / fetch_options.delay_seconds
+
+    # a scan without a queue of its own still retries its failures.
+    if state.retry_queue is None:
+        state.retry_queue = RetryQueue(':memory:')
+
+    session = fetch_options.session
+    if session is None:
+        session = make_session(pool_size=concurrency)
+
+    # with a checkpoint the scan records its progress every time the sink
+    # flushes, and a re-run resumes after the last checkpointed pid with the
+    # same fetch date, null page counter and flushed parts.
+    # What the stores staged is saved with it, see Checkpoint.
+    checkpoint = state.checkpoint
+    if isinstance(checkpoint, str):
+        checkpoint = state.checkpoint = Checkpoint(checkpoint)
+    if checkpoint is not None:
+        checkpoint.stores = state.stores()
+    if checkpoint is not None and not hasattr(sink, 'restore'):
+        raise Exception(
+            """
+            Checkpoints need a sink that flushes to disk, e.g. a ParquetSink.
+            """
+        )
+
+    resume = checkpoint.load() if checkpoint is not None else None
+    if resume is not None:
+        sys.stdout.write(f"Resuming {city} after property id {resume['pid']}.\n")
+        fetch_date = resume['fetch_date']
+        sink.restore(resume['sink'])
+
+    fetch_date = fetch_date or date.today().isoformat()
+    if checkpoint is not None:
+        checkpoint.fetch_date = fetch_date
+
+    # adaptive scans start low and let the town's AdaptiveLimit find how
+    # many requests it takes in flight, up to concurrency.
+    limit = None
+    if fetch_options.adaptive:
+        limit = instance_limit(vgsi_url, initial=min(4, concurrency), maximum=concurrency)
+        limit.maximum = concurrency
+
+    # with fingerprints only parcels that changed since its last commit are
+    # parsed and returned.
+    fetch_kwargs = {
+        'session': session,
+        'timeout': fetch_options.timeout,
+        'archive': archive,
+        'city': city,
+        'fetch_date': fetch_date,
+        'fingerprints': state.fingerprints,
+        'metrics': metrics,
+        'limit': limit
+    }
+
+    # with a pid index the pids known from earlier scans are fetched first,
+    # then the scan walks on past the largest of them until the stop rule
+    # ends it. Only that frontier counts toward null_pages_seq.
+    pids = range(pid_min, pid_max + 1)
+    frontier_start = pid_min
+    if state.pid_index is not None:
+        known = [pid for pid in state.pid_index.pids(city) if pid_min <= pid <= pid_max]
+        if known:
+            frontier_start = known[-1] + 1
+            pids = chain(known, range(frontier_start, pid_max + 1))
+
     null_page_cnt = 0
+    if resume is not None:
+        # pids only ever increase along the scan, so everything up to the
+        # checkpointed pid is already in the flushed parts.
+        pids = (pid for pid in pids if pid > resume['pid'])
+        null_page_cnt = resume['null_page_cnt']
 
-    while null_page_cnt < null_pages_seq and pid_min <= pid_max:
-        # print(f"Trying property id {pid_min} for city {city}")
-        try:
-            p = Property(url=vgsi_url, pid=pid_min)
-            p.load_all()
-            property_list.append(p.data)
-            building_list.extend(p.buildings)
-            assesment_list.extend(p.assesments)
-            appraisal_list.extend(p.appraisals)
-            ownership_list.extend(p.ownership)
-            null_page_cnt = 0
-            time.sleep(delay_seconds)
-        except:
-            null_page_cnt += 1
-        pid_min += 1
-    
-    property_df = pd.DataFrame(property_list)
-    building_df = pd.DataFrame(building_list)
-    assesment_df = pd.DataFrame(assesment_list)
-    appraisal_df = pd.DataFrame(appraisal_list)
-    ownership_df = pd.DataFrame(ownership_list)
+    bucket = host_bucket(vgsi_url, rate_limit)
+
+    if not workers:
+        fetch = partial(fetch_property, vgsi_url, parser=parser, **fetch_kwargs)
+        scan = lambda pids: scan_pids(fetch, pids, concurrency, bucket, limit=limit)
+        city_scan = _CityScan(sink, city, state, retry_options, metrics, checkpoint)
+        rescan = partial(_rescan, scan, state.retry_queue, city, pid_min, pid_max)
+        output = asyncio.run(city_scan.run(scan(pids), null_pages_seq, frontier_start, null_page_cnt, rescan))
+    else:
+        # with workers, fetching, parsing and writing run as separate stages
+        # (see vgsi_pipeline): the `concurrency` threads only fetch, `workers`
+        # processes parse and the sink gets a thread of its own behind a
+        # queue of write_queue parcels, which saves the checkpoint itself.
+        fetch = partial(fetch_valid_page, vgsi_url, **fetch_kwargs)
+        parse = partial(parse_property, vgsi_url, parser=parser, city=city)
+        parsed = partial(state.fingerprints.update, city, fetch_date=fetch_date) if state.fingerprints is not None else None
+        writer = SinkWriter(sink, checkpoint, write_queue)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            scan = lambda pids: parse_pages(scan_pids(fetch, pids, concurrency, bucket, limit=limit), parse, 2 * workers, executor, parsed)
+            city_scan = _CityScan(writer, city, state, retry_options, metrics)
+            rescan = partial(_rescan, scan, state.retry_queue, city, pid_min, pid_max)
+            output = asyncio.run(city_scan.run(scan(pids), null_pages_seq, frontier_start, null_page_cnt, rescan))
+
+    if metrics is not None:
+        metrics.gauge('retry_queue', len(state.retry_queue.pids(city, pid_min, pid_max)))
+        metrics.gauge('parked_pids', len(state.retry_queue.parked(city, pid_min, pid_max)))
+    if metrics is not None and limit is not None:
+        metrics.gauge('concurrency_limit', int(limit))
+        metrics.gauge('concurrency_history', [entry[1] for entry in limit.history])
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    return output
+
+def _record_property(metrics, p):
+
+    metrics.incr('parcels')
+    for section, seconds in p.timings.items():
+        metrics.timing(f"parse_ms.{section}", seconds)
+    for section in p.failures:
+        metrics.incr(f"parse_failures.{section}")
+    for category, records in property_records(p).items():
+        metrics.incr(f"records.{category}", len(records))
+
+def _rescan(scan, retry_queue, city, pid_min, pid_max):
+    # a scan of the pids queued for the shard, None when there are none.
+    queued = retry_queue.pids(city, pid_min, pid_max)
+    return scan(queued) if queued else None
+
+# the metrics counter of each class of failed pid.
+_ERROR_COUNTERS_ = {
+    INVALID: 'invalid_pids',
+    TRANSIENT: 'transient_errors',
+    HTTP: 'http_errors',
+    PARSE: 'failed_pids'
+}
+
+class _CityScan:
+
+    # hands the results of a scan of one city on to its sink and the stores
+    # of its ScanState, and applies the stop rules. Without RetryOptions
+    # (a replay) failed pids are neither drained nor stop the scan.
+
+    def __init__(self, sink, city=None, state=None, retry_options=None, metrics=None, checkpoint=None):
+        self.sink = sink
+        self.city = city
+        self.state = state or ScanState()
+        self.retry_options = retry_options or RetryOptions(rounds=0, max_failures_seq=None)
+        self.metrics = metrics
+        self.checkpoint = checkpoint
+
+    def take(self, pid, p, error):
+
+        # hands one result of the scan on. Returns what the pid turned out to
+        # be (a classify_error class, 'unchanged' or 'parcel') and whether the
+        # sink flushed.
+        metrics = self.metrics
+        retry_queue = self.state.retry_queue
+        pid_index = self.state.pid_index
+        if error is not None:
+            reason = classify_error(error)
+            if metrics is not None:
+                metrics.incr(_ERROR_COUNTERS_[reason])
+            if reason != INVALID:
+                sys.stdout.write(f"Could not load property id {pid} ({reason}): {error}\n")
+                if retry_queue is not None:
+                    retry_queue.add(self.city, pid, reason, error)
+                return reason, False
+
+            if retry_queue is not None:
+                retry_queue.resolve(self.city, pid)
+            if pid_index is not None:
+                pid_index.discard(self.city, pid)
+            # a change sink turns a parcel that is gone into deletes.
+            if hasattr(self.sink, 'remove'):
+                self.sink.remove(pid)
+            return reason, False
+
+        if retry_queue is not None:
+            retry_queue.resolve(self.city, pid)
+        if pid_index is not None:
+            pid_index.add(self.city, pid)
+        if p is None:
+            # unchanged since the last incremental run
+            if metrics is not None:
+                metrics.incr('unchanged')
+            return 'unchanged', False
+
+        if metrics is not None:
+            _record_property(metrics, p)
+        return 'parcel', self.sink.add(p)
+
+    async def run(self, results, null_pages_seq, frontier_start=None, null_page_cnt=0, rescan=None):
+
+        # results come back in pid order, so the stop rule below sees exactly
+        # the same sequence of pages as a one-at-a-time scan would. Only the
+        # error page counts toward it: any other failure says nothing about
+        # the pid, it goes to the retry queue instead and leaves the counter
+        # as it was. Those are counted apart, and a town failing
+        # max_failures_seq pids in a row ends the scan with an error, for the
+        # task to be retried later.
+        max_failures_seq = self.retry_options.max_failures_seq
+        failure_cnt = 0
+        async with aclosing(results):
+            async for pid, p, error in results:
+                outcome, flushed = self.take(pid, p, error)
+                if outcome in (INVALID, 'unchanged', 'parcel'):
+                    failure_cnt = 0
+                else:
+                    failure_cnt += 1
+                    if max_failures_seq is not None and failure_cnt >= max_failures_seq:
+                        raise TooManyFailuresException(
+                            f"""
+                            {failure_cnt} property ids of {self.city} in a row failed, the last {pid}: {error}
+                            """
+                        )
+                if outcome == INVALID:
+                    if frontier_start is None or pid >= frontier_start:
+                        null_page_cnt += 1
+                    if null_pages_seq is not None and null_page_cnt >= null_pages_seq:
+                        break
+                elif outcome in ('unchanged', 'parcel'):
+                    null_page_cnt = 0
+                    if flushed and self.checkpoint is not None:
+                        self.checkpoint.save(pid, null_page_cnt, self.sink.state())
+
+        # rescan() scans the pids still queued for the shard. They are behind
+        # the checkpoint, so from here on it stays where the scan left it; a
+        # retry of the run resumes there and drains the queue again.
+        rounds = self.retry_options.rounds if rescan is not None else 0
+        if rounds and hasattr(self.sink, 'stop_checkpoints'):
+            self.sink.stop_checkpoints()
+        for attempt in range(rounds):
+            retried = rescan()
+            if retried is None:
+                break
+            # nothing is fetched before the generator is iterated.
+            await asyncio.sleep(self.retry_options.backoff * 2 ** attempt)
+            async with aclosing(retried):
+                async for pid, p, error in retried:
+                    outcome, _ = self.take(pid, p, error)
+                    if self.metrics is not None:
+                        self.metrics.incr('retried_pids')
+                        if outcome not in _ERROR_COUNTERS_:
+                            self.metrics.incr('recovered_pids')
 
-    return property_df, building_df, assesment_df, appraisal_df, ownership_df
\ No newline at end of file
+        return self.sink.close()
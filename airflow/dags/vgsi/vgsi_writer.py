@@ -0,0 +1,218 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from .vgsi_gcs import open_uri, remove_tree
+from .vgsi_schema import to_frame, to_table
+
+CATEGORIES = ('property', 'building', 'assesment', 'appraisal', 'ownership')
+
+# rows per row group of the merged files. Rows are in pid order, so readers
+# filtering on pid skip most row groups from their statistics.
+ROW_GROUP_ROWS = 128 * 1024
+
+def property_records(p):
+    return {
+        'property': [p.data],
+        'building': p.buildings,
+        'assesment': p.assesments,
+        'appraisal': p.appraisals,
+        'ownership': p.ownership
+    }
+
+class DataFrameSink:
+
+    # keeps every record of the city in memory and hands back the five
+    # DataFrames, which is what load_city has always returned, typed by
+    # vgsi_schema.
+
+    def __init__(self):
+        self.records = {category: [] for category in CATEGORIES}
+
+    def add(self, p):
+        self.add_records(property_records(p))
+
+    def add_records(self, records):
+        for category, category_records in records.items():
+            self.records[category].extend(category_records)
+
+    def close(self):
+        return tuple(to_frame(self.records[category], category) for category in CATEGORIES)
+
+class ParquetSink:
+
+    # streams records to <output_prefix>_<category>.parquet without holding
+    # the city in memory. Every batch_size records (counted over all
+    # categories, and always on a whole parcel) each category's buffer is
+    # written as a part file under <output_prefix>_parts/. close() streams
+    # the parts into the final file one row group at a time, so a building
+    # detail column that only shows up late in the scan still ends up in the
+    # file.
+    #
+    # output_prefix may be a gs://bucket/prefix, then parts and files are
+    # written straight to the bucket and the worker's disk is never used.
+    # paths ({category: path}) puts the final files somewhere else than next
+    # to the parts, drop leaves columns out of them (e.g. the partition
+    # columns of a vgsi_lake path).
+
+    def __init__(self, output_prefix, batch_size=5000, paths=None, drop=()):
+        self.output_prefix = output_prefix
+        self.batch_size = batch_size
+        self.paths = paths or {}
+        self.drop = tuple(drop)
+        self.parts_dir = f"{output_prefix}_parts"
+        self.parts = {category: [] for category in CATEGORIES}
+        self._buffer = {category: [] for category in CATEGORIES}
+        self._buffered = 0
+
+    def path(self, category):
+        return self.paths.get(category, f"{self.output_prefix}_{category}.parquet")
+
+    def add(self, p):
+
+        # True when the parcel's records were flushed, i.e. everything added
+        # so far is on disk.
+        return self.add_records(property_records(p))
+
+    def add_records(self, records):
+
+        # {category: [record]}, for records that don't come from a parcel
+        # as they are, e.g. change sets.
+        for category, category_records in records.items():
+            self._buffer[category].extend(category_records)
+            self._buffered += len(category_records)
+
+        if self._buffered >= self.batch_size:
+            self.flush()
+            return True
+        return False
+
+    def state(self):
+        return {category: list(parts) for category, parts in self.parts.items()}
+
+    def restore(self, state):
+
+        # picks up the parts of an interrupted scan. Parts written after its
+        # last checkpoint are not in state and get overwritten.
+        self.parts = {category: list(state.get(category, [])) for category in CATEGORIES}
+
+    def flush(self):
+
+        for category in CATEGORIES:
+            records = self._buffer[category]
+            if not records:
+                continue
+
+            part = f"{self.parts_dir}/{category}/part-{len(self.parts[category]):05d}.parquet"
+            with open_uri(part, 'wb') as f:
+                pq.write_table(to_table(records, category).sort_by('pid'), f)
+            self.parts[category].append(part)
+            self._buffer[category] = []
+
+        self._buffered = 0
+
+    def _merge(self, category):
+
+        parts = self.parts[category]
+        path = self.path(category)
+
+        if not parts:
+            with open_uri(path, 'wb') as f:
+                pq.write_table(to_table([], category).drop_columns(list(self.drop)), f)
+            return path
+
+        schemas = []
+        for part in parts:
+            with open_uri(part, 'rb') as f:
+                schemas.append(pq.read_schema(f))
+        schema = pa.unify_schemas(schemas, promote_options='permissive').remove_metadata()
+        schema = pa.schema([field for field in schema if field.name not in self.drop])
+
+        # every part is sorted, but not the parts among themselves: the
+        # pids retried at the end of a scan come after higher ones.
+        with open_uri(path, 'wb') as f, parquet_writer(f, schema) as writer:
+            write_row_groups(writer, merge_sorted([read_row_groups(part, schema) for part in parts]))
+
+        return path
+
+    def close(self):
+
+        self.flush()
+        paths = {category: self._merge(category) for category in CATEGORIES}
+        remove_tree(self.parts_dir)
+        return paths
+
+def parquet_writer(f, schema):
+
+    # string columns dictionary encoded, and the file marked as sorted by
+    # pid.
+    strings = [field.name for field in schema if pa.types.is_string(field.type)]
+    sorting = [pq.SortingColumn(schema.get_field_index('pid'))] if 'pid' in schema.names else None
+    return pq.ParquetWriter(f, schema, use_dictionary=strings, sorting_columns=sorting)
+
+def write_row_groups(writer, tables, row_group_rows=ROW_GROUP_ROWS):
+
+    # writes a stream of tables as row groups of row_group_rows rows, holding
+    # at most one row group in memory.
+    buffered = []
+    rows = 0
+    for table in tables:
+        buffered.append(table)
+        rows += table.num_rows
+        while rows >= row_group_rows:
+            table = pa.concat_tables(buffered)
+            writer.write_table(table.slice(0, row_group_rows))
+            rest = table.slice(row_group_rows)
+            buffered, rows = [rest], rest.num_rows
+    if rows:
+        writer.write_table(pa.concat_tables(buffered))
+
+def read_row_groups(path, schema):
+
+    # the row groups of a parquet file one at a time, conformed to schema.
+    with open_uri(path, 'rb') as f:
+        parquet_file = pq.ParquetFile(f)
+        for i in range(parquet_file.num_row_groups):
+            yield conform(parquet_file.read_row_group(i), schema)
+
+def merge_sorted(runs, key='pid'):
+
+    # merges runs, each a stream of tables sorted by key, into one stream of
+    # sorted tables. Every step takes the rows of each run's current table
+    # up to the smallest last key among them, which uses up at least one of
+    # those tables, so only one table per run is held in memory.
+    heads = []
+    for run in runs:
+        run = iter(run)
+        table = _next_rows(run)
+        if table is not None:
+            heads.append([table, run])
+
+    while heads:
+        bound = min(table.column(key)[-1].as_py() for table, _ in heads)
+        taken = []
+        for head in heads:
+            table, run = head
+            rows = pc.sum(pc.less_equal(table.column(key), bound)).as_py() or 0
+            if rows:
+                taken.append(table.slice(0, rows))
+            head[0] = table.slice(rows) if rows < table.num_rows else _next_rows(run)
+        heads = [head for head in heads if head[0] is not None]
+        yield pa.concat_tables(taken).sort_by(key)
+
+def _next_rows(run):
+    # the next table of a run that has rows, None once it is used up.
+    for table in run:
+        if table.num_rows:
+            return table
+    return None
+
+def conform(table, schema):
+
+    # adds the columns the table lacks as nulls and puts them in schema order.
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+# the tests import vgsi the way the dags do, and the stub server from the
+# benchmarks:
+#
+#   cd airflow && python -m pytest -q tests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'dags'), os.path.join(ROOT, 'benchmarks')]
+
+from stub_server import StubServer
+
+@pytest.fixture(scope='session')
+def stub():
+    # 200 pids, a third of them parcels.
+    with StubServer(pids=200, density=0.3) as server:
+        yield server
@@ -0,0 +1,35 @@
+from stub_server import StubServer
+from vgsi.vgsi_archive import RawArchive
+from vgsi.vgsi_fetch import FetchOptions
+from vgsi.vgsi_utils import load_city
+
+FETCH_DATE = '2026-10-18'
+
+def _rows(frame):
+    # updated_at is when the rows were built, not what the page says.
+    frame = frame.drop(columns=['updated_at']).sort_values(['pid', 'uuid'])
+    return frame.astype(str).values.tolist()
+
+def test_replay_rebuilds_the_scan_from_the_archive(tmp_path):
+    root = str(tmp_path / 'archive')
+    with StubServer(pids=60, density=0.5) as stub:
+        live = load_city(
+            'benchct',
+            base_url=stub.url,
+            pid_max=60,
+            null_pages_seq=None,
+            fetch_options=FetchOptions(concurrency=4, delay_seconds=0),
+            parser='lxml',
+            archive=root,
+            fetch_date=FETCH_DATE
+        )
+        url = stub.url
+
+    # the stub is gone, the replay only reads the archive.
+    archive = RawArchive(root)
+    assert archive.fetch_dates('benchct') == [FETCH_DATE]
+    replayed = load_city('benchct', base_url=url, pid_max=60, parser='lxml', archive=archive, replay=True, workers=2)
+
+    assert len(live[0]) > 0
+    for live_frame, replayed_frame in zip(live, replayed):
+        assert _rows(live_frame) == _rows(replayed_frame)
@@ -0,0 +1,40 @@
+from vgsi.vgsi_bigquery import OCCURRENCE_FIELD, merge_query
+
+TARGET = 'project.vgsi.raw_ownership'
+STAGING = 'project.vgsi.raw_ownership__staging_newhaven_000'
+
+def _statements(*args, **kwargs):
+    return [statement.strip() for statement in merge_query(*args, **kwargs).split(';\n')]
+
+def test_merge_query_creates_and_merges():
+    columns = ['uuid', 'pid', 'property_uuid', 'owner', 'sale_price', 'book_and_page', 'sale_date', 'updated_at', 'snapshot_date']
+    create, occurrence, extra, merge = _statements(TARGET, STAGING, 'ownership', columns)
+
+    assert create.startswith(f"CREATE TABLE IF NOT EXISTS `{TARGET}` (`uuid` STRING, `pid` INT64")
+    assert create.endswith(f"`{OCCURRENCE_FIELD}` INT64) PARTITION BY DATE(`updated_at`) CLUSTER BY city, pid")
+    assert occurrence == f"ALTER TABLE `{TARGET}` ADD COLUMN IF NOT EXISTS `{OCCURRENCE_FIELD}` INT64"
+    # columns the schema doesn't know, like the lake's partition column
+    assert extra == f"ALTER TABLE `{TARGET}` ADD COLUMN IF NOT EXISTS `snapshot_date` STRING"
+
+    assert merge.startswith(f"MERGE `{TARGET}` T USING (")
+    assert f"FROM `{STAGING}`" in merge
+    assert "MAX(`updated_at`) OVER (PARTITION BY `city`, `pid`) AS _latest" in merge
+    assert (
+        f"ROW_NUMBER() OVER (PARTITION BY `city`, `pid`, `owner`, `sale_date`, `book_and_page` ORDER BY `uuid`) - 1 AS `{OCCURRENCE_FIELD}`"
+    ) in merge
+    assert (
+        "ON T.`city` IS NOT DISTINCT FROM S.`city` AND T.`pid` IS NOT DISTINCT FROM S.`pid` "
+        "AND T.`owner` IS NOT DISTINCT FROM S.`owner` AND T.`sale_date` IS NOT DISTINCT FROM S.`sale_date` "
+        "AND T.`book_and_page` IS NOT DISTINCT FROM S.`book_and_page` "
+        f"AND COALESCE(T.`{OCCURRENCE_FIELD}`, 0) = S.`{OCCURRENCE_FIELD}` "
+    ) in merge
+    assert "WHEN MATCHED THEN UPDATE SET `uuid` = S.`uuid`, " in merge
+    names = ', '.join(f"`{name}`" for name in columns + [OCCURRENCE_FIELD])
+    assert merge.endswith(f"WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({', '.join(f'S.{name}' for name in names.split(', '))});")
+
+def test_merge_query_schema_columns():
+    # without the staging columns, the category's schema
+    create, occurrence, merge = _statements('project.vgsi.raw_property', 'project.vgsi.raw_property__staging_x', 'property')
+    assert "PARTITION BY `city`, `pid` ORDER BY `uuid`" in merge
+    assert "`land_appraised_value` = S.`land_appraised_value`" in merge
+    assert "DELETE" not in merge
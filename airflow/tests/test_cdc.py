@@ -0,0 +1,68 @@
+from stub_server import StubServer
+from vgsi.vgsi_cdc import CHANGE_FIELD, DELETE, INSERT, UPDATE, ChangeSink, ChangeStore, row_keys
+from vgsi.vgsi_fetch import FetchOptions, fetch_page, make_session, parse_property
+from vgsi.vgsi_utils import load_city
+from vgsi.vgsi_writer import CATEGORIES, DataFrameSink, property_records
+
+def _changes(store, pids, density):
+    # the change sets of a scan of a stub town, committed like the dag does.
+    with StubServer(pids=pids, density=density) as stub:
+        sink = ChangeSink(store, 'benchct', DataFrameSink())
+        output = load_city(
+            'benchct',
+            base_url=stub.url,
+            pid_max=pids,
+            null_pages_seq=None,
+            fetch_options=FetchOptions(concurrency=4, delay_seconds=0, session=make_session(pool_size=4)),
+            parser='lxml',
+            sink=sink
+        )
+        valid = stub.valid_pids()
+    store.commit()
+    return dict(zip(CATEGORIES, output['changes'])), valid
+
+def _counts(frame):
+    return frame[CHANGE_FIELD].value_counts().to_dict() if len(frame) else {}
+
+def test_inserts_then_nothing_then_deletes(tmp_path):
+    store = ChangeStore(str(tmp_path / 'changes.sqlite'))
+
+    first, valid = _changes(store, 60, 1.0)
+    assert _counts(first['property']) == {INSERT: len(valid)}
+
+    # the same town again has nothing to report
+    second, _ = _changes(store, 60, 1.0)
+    assert all(len(frame) == 0 for frame in second.values())
+
+    # parcels that are gone are deleted, with every row they had
+    third, left = _changes(store, 60, 0.5)
+    gone = set(valid) - set(left)
+    properties = third['property']
+    assert _counts(properties) == {DELETE: len(gone)}
+    assert set(properties['pid']) == gone
+    assert set(third['ownership']['pid']) <= gone
+    assert (third['ownership'][CHANGE_FIELD] == DELETE).all()
+
+def test_changed_page_is_an_update_of_its_changed_rows(tmp_path):
+    store = ChangeStore(str(tmp_path / 'changes.sqlite'))
+    with StubServer(pids=10) as stub:
+        page = fetch_page(stub.url, 1, make_session(pool_size=1)).content
+    store.diff('benchct', 1, property_records(parse_property(stub.url, 1, page, 'lxml', 'benchct')))
+    store.commit()
+
+    # the town rezones the parcel, nothing else on its page changes.
+    rezoned = page.replace(b'MainContent_lblZone">RS2<', b'MainContent_lblZone">RM-2<')
+    assert rezoned != page
+    changes = store.diff('benchct', 1, property_records(parse_property(stub.url, 1, rezoned, 'lxml', 'benchct')))
+
+    assert [record[CHANGE_FIELD] for record in changes['property']] == [UPDATE]
+    assert all(not changes[category] for category in CATEGORIES if category != 'property')
+
+def test_row_keys_count_duplicates_in_uuid_order():
+    sale = {'owner': 'SMITH JOHN', 'sale_date': '2001-05-01', 'book_and_page': '12/34'}
+    records = [sale | {'uuid': 'b'}, sale | {'uuid': 'a'}, {'owner': 'DOE JANE', 'uuid': 'c'}]
+
+    keys = row_keys('ownership', records)
+    assert len(set(keys)) == 3
+    # the order the page lists them in doesn't matter
+    assert row_keys('ownership', records[::-1]) == keys[::-1]
@@ -0,0 +1,36 @@
+from stub_server import StubServer
+from vgsi.vgsi_fetch import FetchOptions, instance_limit, make_session
+from vgsi.vgsi_utils import load_city
+
+def test_adaptive_limit_sees_retried_overload():
+    # the session retries every 503 until it gets through, the limit must be
+    # cut by them all the same.
+    with StubServer(pids=200, capacity=3, latency=0.02) as stub:
+        output = load_city(
+            'benchct',
+            base_url=stub.url,
+            pid_max=200,
+            null_pages_seq=None,
+            fetch_options=FetchOptions(concurrency=16, delay_seconds=0, adaptive=True, session=make_session(16, backoff_factor=0.05))
+        )
+        limit = instance_limit(stub.url)
+
+    assert len(output[0]) == len(stub.valid_pids())
+    assert any(reason == 'errors' for _, _, reason in limit.history)
+
+def test_legacy_fetch_arguments(stub):
+    # the arguments load_city took before FetchOptions still reach the scan.
+    session = make_session(pool_size=4)
+    get = session.get
+    timeouts = set()
+
+    def recording_get(url, *args, **kwargs):
+        timeouts.add(kwargs.get('timeout'))
+        return get(url, *args, **kwargs)
+
+    session.get = recording_get
+    output = load_city('benchct', base_url=stub.url, pid_max=60, delay_seconds=0, concurrency=4, session=session, timeout=(2, 7))
+    expected = load_city('benchct', base_url=stub.url, pid_max=60, fetch_options=FetchOptions(concurrency=4, delay_seconds=0))
+
+    assert timeouts == {(2, 7)}
+    assert len(output[0]) == len(expected[0]) > 0
@@ -0,0 +1,48 @@
+import pyarrow.parquet as pq
+from vgsi.vgsi_fetch import FetchOptions
+from vgsi.vgsi_incremental import FingerprintStore, write_carried_forward
+from vgsi.vgsi_utils import ScanState, load_city
+
+# records carry the pid printed on the page, which the stub's fixtures
+# don't match, so parcels are counted.
+
+def _scan(stub, store, fetch_date):
+    output = load_city(
+        'benchct',
+        base_url=stub.url,
+        pid_max=stub.pids,
+        null_pages_seq=None,
+        fetch_options=FetchOptions(concurrency=4, delay_seconds=0),
+        state=ScanState(fingerprints=store),
+        parser='lxml',
+        fetch_date=fetch_date
+    )
+    return len(output[0]), store.carried_forward('benchct', fetch_date)
+
+def test_unchanged_parcels_are_carried_forward(stub, tmp_path):
+    path = str(tmp_path / 'fingerprints.sqlite')
+    valid = stub.valid_pids()
+
+    store = FingerprintStore(path)
+    parcels, carried = _scan(stub, store, '2026-10-04')
+    store.commit()
+    assert parcels == len(valid) and carried == {}
+
+    # nothing changed: no parcel is handed on, each is carried forward from
+    # the run that last wrote its rows.
+    store = FingerprintStore(path)
+    parcels, carried = _scan(stub, store, '2026-10-11')
+    assert parcels == 0
+    assert carried == {pid: '2026-10-04' for pid in valid}
+
+    # that run's load failed and it never committed, the next one still
+    # points at the first run's rows.
+    store = FingerprintStore(path)
+    parcels, carried = _scan(stub, store, '2026-10-18')
+    store.commit()
+    assert parcels == 0
+    assert carried == {pid: '2026-10-04' for pid in valid}
+
+    manifest = str(tmp_path / 'carried_forward.parquet')
+    write_carried_forward(manifest, carried)
+    assert pq.read_table(manifest).to_pydict() == {'pid': valid, 'changed_at': ['2026-10-04'] * len(valid)}
@@ -0,0 +1,41 @@
+import random
+import pytest
+from vgsi.vgsi_catalog import probe_city, refresh_profiles
+from vgsi.vgsi_index import PIDIndex, discover_pids, probe_pid_max
+
+def _town(pids):
+    pids = set(pids)
+    return lambda pid: pid in pids
+
+@pytest.mark.parametrize('density', [1.0, 0.3, 0.05])
+def test_probe_pid_max_from_known_pid(density):
+    rng = random.Random(7)
+    pids = [pid for pid in range(2000, 40000) if rng.random() < density]
+    # a gap wider than a window in the middle of the range
+    pids = [pid for pid in pids if not 20000 <= pid < 20050]
+    known = pids[:len(pids) // 3]
+    known_density = len(known) / (known[-1] - known[0] + 1)
+    assert probe_pid_max(_town(pids), start=known[-1], density=known_density) == pids[-1]
+
+def test_probe_pid_max_without_parcels():
+    assert probe_pid_max(_town([]), start=1) is None
+
+def test_discover_pids(stub):
+    assert discover_pids(stub.url, workers=4) == stub.valid_pids()
+
+def test_refresh_profiles_seeds_index(stub, tmp_path):
+    pid_index = PIDIndex(str(tmp_path / 'pid_index.sqlite'))
+    profiles = refresh_profiles({'benchct': {'url': stub.url}}, str(tmp_path / 'profiles.json'), pid_index=pid_index)
+
+    valid = stub.valid_pids()
+    assert pid_index.pids('benchct') == valid
+    # seeded pids are not a scan
+    assert pid_index.last_seen('benchct') is None
+    assert profiles['benchct']['pid_min'] == valid[0]
+    assert profiles['benchct']['pid_max'] == valid[-1]
+
+def test_probe_city_from_known_pids(stub):
+    valid = stub.valid_pids()
+    profile = probe_city(stub.url, known=valid[:len(valid) // 2])
+    assert profile['pid_max'] == valid[-1]
+    assert 0 < profile['density'] < 1
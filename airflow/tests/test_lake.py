@@ -0,0 +1,67 @@
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import vgsi.vgsi_lake as vgsi_lake
+from vgsi.vgsi_lake import compact_lake, compact_partition, partition_path, partitions
+
+SNAPSHOT = '2026-10-18'
+
+def _write(root, name, pids, value='old'):
+    path = f"{partition_path(root, 'property', 'x', SNAPSHOT)}/{name}.parquet"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.table({'pid': list(pids), 'value': [value] * len(pids)}), path)
+    return path
+
+def _compact(root):
+    return compact_lake(root, SNAPSHOT, ['x'], ['property'])
+
+def _partition(root):
+    directory = partition_path(root, 'property', 'x', SNAPSHOT)
+    return sorted(os.listdir(directory)), pq.read_table(directory).sort_by('pid')
+
+def test_compaction_is_idempotent(tmp_path):
+    root = str(tmp_path)
+    _write(root, 'x_000', range(1, 50))
+    _write(root, 'x_001', range(50, 100))
+
+    assert _compact(root) == {partition_path(root, 'property', 'x', SNAPSHOT): 2}
+    names, table = _partition(root)
+    files = partitions(root, SNAPSHOT, ['x'], ['property'])[partition_path(root, 'property', 'x', SNAPSHOT)]
+
+    assert compact_partition(files) == files
+    assert _compact(root) == {}
+    assert _partition(root)[0] == names == [names[0]] and names[0].startswith('compacted-')
+    assert table.column('pid').to_pylist() == list(range(1, 100))
+
+def test_leftovers_of_a_stopped_compaction_are_removed(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    _write(root, 'x_000', range(1, 50))
+    _write(root, 'x_001', range(50, 100))
+    # the compacted file is written, its inputs are not removed.
+    with monkeypatch.context() as patch:
+        patch.setattr(vgsi_lake, 'remove_files', lambda paths: None)
+        _compact(root)
+    assert len(_partition(root)[0]) == 3
+
+    _compact(root)
+
+    names, table = _partition(root)
+    assert len(names) == 1
+    assert table.column('pid').to_pylist() == list(range(1, 100))
+
+def test_rerun_shard_replaces_its_rows(tmp_path):
+    root = str(tmp_path)
+    _write(root, 'x_000', range(1, 50))
+    _write(root, 'x_001', range(50, 100))
+    _compact(root)
+    # the second shard runs again after the compaction and finds fewer
+    # parcels, its file comes back under the same name.
+    _write(root, 'x_001', range(50, 90), value='new')
+
+    _compact(root)
+
+    names, table = _partition(root)
+    assert len(names) == 1
+    assert table.column('pid').to_pylist() == list(range(1, 90))
+    assert table.column('value').to_pylist() == ['old'] * 49 + ['new'] * 40
+    assert _compact(root) == {}
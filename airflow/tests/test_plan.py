@@ -0,0 +1,45 @@
+from vgsi.vgsi_plan import plan_shards
+
+class _Index:
+    def __init__(self, known):
+        self.known = known
+
+    def pids(self, city):
+        return self.known.get(city, [])
+
+CITIES = {
+    # indexed, 25 known pids with a gap after pid 20.
+    'indexed': {'url': 'http://indexed/', 'profile': {'latency_ms': 100}},
+    # not indexed: a large, sparse and slow town, and a small quick one.
+    'sparse': {'url': 'http://sparse/', 'profile': {'pid_max': 400000, 'density': 0.25, 'latency_ms': 800}},
+    'small': {'url': 'http://small/', 'profile': {'pid_max': 2000, 'density': 0.9, 'latency_ms': 50}},
+}
+
+def _plan(**kwargs):
+    index = _Index({'indexed': list(range(1, 21)) + list(range(40, 45))})
+    return plan_shards(CITIES, pid_index=index, **kwargs)
+
+def test_indexed_city_is_cut_at_its_known_pids():
+    shards = [shard for shard in _plan(shard_size=10) if shard['city'] == 'indexed']
+
+    bounds = sorted((shard['pid_min'], shard['pid_max'], shard['null_pages_seq']) for shard in shards)
+    # every shard but the last ends before the next one's first known pid,
+    # only the last walks on with the stop rule.
+    assert bounds == [(1, 10, None), (11, 39, None), (40, 1000000, 10)]
+
+def test_profiled_city_is_cut_by_density():
+    shards = [shard for shard in _plan(shard_size=20000) if shard['city'] == 'sparse']
+
+    # 100000 parcels in 400000 pids, 5 shards of 80000 pids.
+    assert [shard['pid_min'] for shard in sorted(shards, key=lambda shard: shard['pid_min'])] == [1, 80001, 160001, 240001, 320001]
+
+def test_concurrency_follows_latency_and_size():
+    shards = _plan(shard_size=20000, concurrency=16)
+    concurrency = {shard['city']: shard['concurrency'] for shard in shards}
+
+    # 80000 pids at 800ms need every connection, 2000 at 50ms just one.
+    assert concurrency['sparse'] == 16
+    assert concurrency['small'] == 1
+    assert all(1 <= shard['concurrency'] <= 16 for shard in shards)
+    # longest first
+    assert shards[0]['city'] == 'sparse' and shards[-1]['city'] != 'sparse'
@@ -0,0 +1,16 @@
+import pstats
+from vgsi.__main__ import main
+
+def test_cprofile_scrape_with_workers(stub, tmp_path, capsys):
+    # the fetch threads and the parse processes of a scan under cProfile,
+    # which on Python 3.12+ has to share one profiler.
+    out = str(tmp_path / 'scan.prof')
+    main([
+        '--profile', 'cprofile', '--profile-out', out,
+        'scrape', 'benchct', '--url', stub.url, '--pid-max', '60',
+        '--concurrency', '4', '--workers', '2', '--parser', 'lxml'
+    ])
+
+    assert 'property' in capsys.readouterr().out
+    functions = {name for _, _, name in pstats.Stats(out).stats}
+    assert 'fetch_page' in functions
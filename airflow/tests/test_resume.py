@@ -0,0 +1,62 @@
+import pytest
+from stub_server import StubServer
+from vgsi.vgsi_fetch import FetchOptions, make_session
+from vgsi.vgsi_utils import ScanState, load_city
+from vgsi.vgsi_writer import CATEGORIES, ParquetSink
+import pandas as pd
+
+class Crash(BaseException):
+    # not an Exception, so the scan can't record it as a failed pid.
+    pass
+
+def _session(crash_pid=None):
+    session = make_session(pool_size=4)
+    get = session.get
+
+    def crashing_get(url, *args, **kwargs):
+        if url.endswith(f"pid={crash_pid}"):
+            raise Crash()
+        return get(url, *args, **kwargs)
+
+    session.get = crashing_get
+    return session
+
+def _scan(stub, output, checkpoint=None, crash_pid=None, workers=None):
+    return load_city(
+        'benchct',
+        base_url=stub.url,
+        pid_max=stub.pids + 20,
+        fetch_options=FetchOptions(concurrency=4, delay_seconds=0, session=_session(crash_pid)),
+        state=ScanState(checkpoint=checkpoint),
+        parser='lxml',
+        fetch_date='2026-01-01',
+        workers=workers,
+        sink=ParquetSink(output, batch_size=20)
+    )
+
+def _frame(path):
+    frame = pd.read_parquet(path).drop(columns='updated_at')
+    return frame.sort_values(list(frame.columns), key=lambda column: column.astype(str)).reset_index(drop=True)
+
+@pytest.fixture(scope='module')
+def stub():
+    with StubServer(pids=100, density=0.5) as server:
+        yield server
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_resumed_scan_matches_full_scan(stub, tmp_path, workers):
+    requests = stub.requests
+    full = _scan(stub, str(tmp_path / 'full' / 'benchct'), workers=workers)
+    full_requests = stub.requests - requests
+
+    checkpoint = str(tmp_path / 'resumed' / 'checkpoint.json')
+    output = str(tmp_path / 'resumed' / 'benchct')
+    with pytest.raises(Crash):
+        _scan(stub, output, checkpoint, crash_pid=80, workers=workers)
+    requests = stub.requests
+    resumed = _scan(stub, output, checkpoint, workers=workers)
+
+    # the resumed scan starts after the checkpoint, not from pid 1
+    assert stub.requests - requests < full_requests
+    for category in CATEGORIES:
+        pd.testing.assert_frame_equal(_frame(resumed[category]), _frame(full[category]))
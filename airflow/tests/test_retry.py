@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import requests
+from vgsi.vgsi_fetch import FetchOptions, make_session
+from vgsi.vgsi_metrics import Metrics
+from vgsi.vgsi_retry import MAX_ATTEMPTS, PARKED_WAIT, RetryOptions, RetryQueue
+from vgsi.vgsi_utils import ScanState, load_city
+
+FLAKY = {3, 10, 17, 40, 41, 42, 77}
+
+# records carry the pid printed on the page, which the stub's fixtures
+# don't match, so parcels are counted.
+
+def _session(failures):
+    # fails the pids failures(pid) says, like a town that drops connections.
+    session = make_session(pool_size=4)
+    get = session.get
+
+    def flaky_get(url, *args, **kwargs):
+        if 'pid=' in url and failures(int(url.rsplit('=', 1)[1])):
+            raise requests.ConnectionError(f"connection dropped: {url}")
+        return get(url, *args, **kwargs)
+
+    session.get = flaky_get
+    return session
+
+def _scan(stub, queue, failures, metrics=None):
+    return load_city(
+        'benchct',
+        base_url=stub.url,
+        pid_max=stub.pids + 20,
+        fetch_options=FetchOptions(concurrency=4, delay_seconds=0, session=_session(failures)),
+        retry_options=RetryOptions(rounds=1, backoff=0, max_failures_seq=None),
+        state=ScanState(retry_queue=queue),
+        parser='lxml',
+        metrics=metrics
+    )
+
+def test_drain_recovers_failed_pids(stub, tmp_path):
+    queue = RetryQueue(str(tmp_path / 'retry_queue.sqlite'))
+    metrics = Metrics(city='benchct')
+    attempts = set()
+
+    def first_attempt(pid):
+        failed = pid in FLAKY and pid not in attempts
+        attempts.add(pid)
+        return failed
+
+    output = _scan(stub, queue, first_attempt, metrics)
+
+    counters = metrics.summary()['counters']
+    assert counters['retried_pids'] == len(FLAKY)
+    assert counters['recovered_pids'] == len(FLAKY & set(stub.valid_pids()))
+    assert len(output[0]) == len(stub.valid_pids())
+    assert queue.pids('benchct') == []
+
+def test_queue_outlives_failed_run(stub, tmp_path):
+    path = str(tmp_path / 'retry_queue.sqlite')
+
+    # still failing after the drain: queued, and kept once committed
+    queue = RetryQueue(path)
+    first = _scan(stub, queue, lambda pid: pid in FLAKY)
+    queue.commit()
+    assert RetryQueue(path).pids('benchct') == sorted(FLAKY)
+    assert len(first[0]) == len(set(stub.valid_pids()) - FLAKY)
+
+    # the next run gets them and empties the queue
+    queue = RetryQueue(path)
+    second = _scan(stub, queue, lambda pid: False)
+    queue.commit()
+    assert RetryQueue(path).pids('benchct') == []
+    assert len(second[0]) == len(stub.valid_pids())
+
+def test_pids_past_max_attempts_stay_queued(stub, tmp_path):
+    queue = RetryQueue(str(tmp_path / 'retry_queue.sqlite'))
+    for _ in range(MAX_ATTEMPTS):
+        queue.add('benchct', 3, 'transient')
+    queue.add('benchct', 10, 'transient')
+    later = datetime.now() + PARKED_WAIT
+
+    # parked: left out of drains until its wait is over, and reported.
+    assert queue.pids('benchct') == [10]
+    assert queue.pids('benchct', now=later) == [3, 10]
+    assert queue.parked('benchct') == [3]
+    metrics = Metrics(city='benchct')
+    _scan(stub, queue, lambda pid: pid == 3, metrics)
+    assert metrics.summary()['gauges']['parked_pids'] == 1
+
+    # the scan tried it once more, every further failure doubles the wait.
+    assert queue.pids('benchct', now=later + timedelta(seconds=1)) == []
+    assert queue.pids('benchct', now=later + PARKED_WAIT + timedelta(seconds=1)) == [3]
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+from vgsi.vgsi_fetch import scan_pids
+
+def _scan(fetch, pids, concurrency):
+    async def collect():
+        return [item async for item in scan_pids(fetch, pids, concurrency)]
+    return asyncio.run(collect())
+
+def test_results_come_in_pid_order():
+    finished = []
+
+    def fetch(pid):
+        # later pids answer first
+        time.sleep((10 - pid) * 0.005)
+        finished.append(pid)
+        if pid == 4:
+            raise ValueError(pid)
+        return pid * 10
+
+    results = _scan(fetch, range(10), 5)
+
+    assert [pid for pid, _, _ in results] == list(range(10))
+    assert [result for pid, result, _ in results if pid != 4] == [pid * 10 for pid in range(10) if pid != 4]
+    assert isinstance(results[4][2], ValueError) and results[4][1] is None
+    # they were fetched concurrently, not one after the other
+    assert finished[:5] != sorted(finished[:5])
+
+def test_concurrency_bounds_the_calls_in_flight():
+    in_flight = [0, 0]
+    lock = threading.Lock()
+
+    def fetch(pid):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return pid
+
+    results = _scan(fetch, range(20), 3)
+
+    assert [pid for pid, _, _ in results] == list(range(20))
+    assert in_flight[1] <= 3
@@ -0,0 +1,32 @@
+import pandas as pd
+from vgsi.vgsi_schema import DATE, FLOAT, INT, MONEY, STRING, TIMESTAMP, coerce_column, to_table
+
+def _coerce(values, kind):
+    return coerce_column(pd.Series(values, dtype=object), kind).tolist()
+
+def test_money_drops_signs_and_separators():
+    assert _coerce(['$1,234,500', ' $87 ', '', None, 'n/a'], MONEY)[:2] == [1234500, 87]
+    assert pd.isna(_coerce(['', None, 'n/a'], MONEY)).all()
+
+def test_numbers():
+    assert _coerce(['0.25', ' 3 '], FLOAT) == [0.25, 3.0]
+    values = _coerce(['12', '12.0', '3.5', 'two', ''], INT)
+    assert values[:2] == [12, 12]
+    assert all(value is pd.NA for value in values[2:])
+
+def test_dates_and_timestamps():
+    dates = _coerce(['05/01/2001', '2001-05-01', ''], DATE)
+    assert dates[0] == pd.Timestamp('2001-05-01')
+    assert pd.isna(dates[1]) and pd.isna(dates[2])
+    assert _coerce(['2026-10-18 12:00:00'], TIMESTAMP) == [pd.Timestamp('2026-10-18 12:00:00')]
+
+def test_strings_are_stripped_and_blanks_null():
+    values = _coerce([' ELM ST ', '   ', 42], STRING)
+    assert values[0] == 'ELM ST' and values[2] == '42'
+    assert values[1] is pd.NA
+
+def test_unknown_columns_stay_strings():
+    table = to_table([{'pid': '7', 'city': 'x', 'land_zone': ' RS2 ', 'surprise': 1}], 'property')
+    assert table.column('pid').to_pylist() == [7]
+    assert table.column('land_zone').to_pylist() == ['RS2']
+    assert table.schema.field('surprise').type == 'string'